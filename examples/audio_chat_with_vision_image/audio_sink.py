@@ -0,0 +1,262 @@
+# 流式保存返回的语音: 收到 base64 编码的 PCM 数据后立即解码并追加写入 wav 文件,
+# 不在内存中拼接整段语音, 对话结束时再修正 wav 文件头中的长度
+#
+# WavStreamSink 在调用方的线程中写文件; AsyncWavStreamSink 供 asyncio 中使用,
+# 每个会话一个, 文件写入交给后台线程, 不阻塞事件循环
+#
+# 性能测试, 对比原来拼接 bytes 再写文件和流式写入的耗时和内存:
+#
+#     python audio_sink.py --minutes 10
+
+import asyncio
+import base64
+import binascii
+import queue
+import threading
+import wave
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+# 扣子返回的语音格式: 24kHz, 16bit, 单声道
+PCM_FRAME_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+PCM_CHANNELS = 1
+
+
+class WavStreamSink:
+    def __init__(
+        self,
+        path: str,
+        channels: int = PCM_CHANNELS,
+        sample_width: int = PCM_SAMPLE_WIDTH,
+        frame_rate: int = PCM_FRAME_RATE,
+        flush_bytes: int = 64 * 1024,
+        on_pcm: Optional[Callable[[memoryview], None]] = None,
+    ):
+        self.path = path
+        self.frame_rate = frame_rate
+        self.flush_bytes = flush_bytes  # 缓冲区超过这个大小时写入文件
+        # 每次写入文件时回调, 可以用来边收边播放或转发; memoryview 只在回调中有效, 需要保留时请复制
+        self.on_pcm = on_pcm
+        self.bytes_written = 0
+        self._frame_size = channels * sample_width
+        self._buffer = bytearray()
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(sample_width)
+        self._wav.setframerate(frame_rate)
+
+    # 已经写入的语音时长, 秒
+    @property
+    def duration(self) -> float:
+        return self.bytes_written / self._frame_size / self.frame_rate
+
+    def write(self, pcm: bytes):
+        self._buffer += pcm
+        if len(self._buffer) >= self.flush_bytes:
+            self.flush()
+
+    # 写入 conversation.audio.delta 事件中 base64 编码的语音
+    def write_base64(self, data: str):
+        self.write(binascii.a2b_base64(data))
+
+    # 把缓冲区中完整的帧写入文件, 不完整的帧留到下次
+    def flush(self):
+        size = len(self._buffer) - len(self._buffer) % self._frame_size
+        if not size:
+            return
+        with memoryview(self._buffer) as view:
+            chunk = view[:size]
+            # writeframesraw 不会每次都回写文件头, 文件头在 close 时统一修正
+            self._wav.writeframesraw(chunk)
+            if self.on_pcm is not None:
+                self.on_pcm(chunk)
+            chunk.release()
+        del self._buffer[:size]
+        self.bytes_written += size
+
+    def close(self):
+        if self._wav is None:
+            return
+        self.flush()
+        self._wav.close()
+        self._wav = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# 后台写文件线程, 多个 AsyncWavStreamSink 共用, 写入任务按提交顺序执行
+class BackgroundWavWriter:
+    def __init__(self):
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="wav_writer", daemon=True
+                )
+                self._thread.start()
+        future: Future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def _run(self):
+        while True:
+            fn, args, future = self._queue.get()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+wav_writer = BackgroundWavWriter()
+
+
+# asyncio 中使用的 wav 写入: 在事件循环中只把语音追加到缓冲区, 攒够 flush_bytes 后交给后台线程写入
+# 每个会话使用自己的 sink, 会话之间的语音互不影响; close 后缓冲区和文件都会被释放
+class AsyncWavStreamSink:
+    def __init__(
+        self,
+        path: str,
+        channels: int = PCM_CHANNELS,
+        sample_width: int = PCM_SAMPLE_WIDTH,
+        frame_rate: int = PCM_FRAME_RATE,
+        flush_bytes: int = 64 * 1024,
+        writer: Optional[BackgroundWavWriter] = None,
+    ):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.bytes_received = 0
+        self._frame_rate = frame_rate
+        self._frame_size = channels * sample_width
+        self._buffer = bytearray()
+        self._writer = writer or wav_writer
+        self._sink: Optional[WavStreamSink] = None
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        # 打开文件也在后台线程中执行, 之后的写入任务一定在它之后执行
+        self._submit(self._open, channels, sample_width, frame_rate)
+
+    # 已经收到的语音时长, 秒
+    @property
+    def duration(self) -> float:
+        return self.bytes_received / self._frame_size / self._frame_rate
+
+    def write(self, pcm: bytes):
+        if self._closed:
+            raise ValueError(f"{self.path} 已经关闭")
+        self._buffer += pcm
+        self.bytes_received += len(pcm)
+        if len(self._buffer) >= self.flush_bytes:
+            self._submit(self._write, bytes(self._buffer))
+            self._buffer.clear()
+
+    def write_base64(self, data: str):
+        self.write(binascii.a2b_base64(data))
+
+    # 写入剩余的语音并关闭文件, 等待后台线程完成; 写入过程中的错误会在这里抛出
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        data, self._buffer = bytes(self._buffer), bytearray()
+        await asyncio.wrap_future(self._submit(self._close, data))
+        if self._error is not None:
+            raise self._error
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        return self._writer.submit(self._guard, fn, *args)
+
+    # 出错后跳过后续的写入, 错误在 close 时抛出
+    def _guard(self, fn: Callable, *args):
+        if self._error is not None and fn != self._close:
+            return
+        try:
+            fn(*args)
+        except BaseException as e:
+            self._error = self._error or e
+
+    def _open(self, channels: int, sample_width: int, frame_rate: int):
+        self._sink = WavStreamSink(
+            self.path, channels, sample_width, frame_rate, flush_bytes=0
+        )
+
+    def _write(self, data: bytes):
+        self._sink.write(data)
+
+    def _close(self, data: bytes):
+        if self._sink is None:
+            return
+        try:
+            if self._error is None:
+                self._sink.write(data)
+        finally:
+            self._sink.close()
+            self._sink = None
+
+
+# 性能测试: 模拟 minutes 分钟的语音回复, 每个 delta 事件 chunk_ms 毫秒
+def benchmark(minutes: float, chunk_ms: int, old: bool):
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+
+    from cozepy.util import write_pcm_to_wav_file
+
+    chunk = os.urandom(PCM_FRAME_RATE * PCM_SAMPLE_WIDTH * chunk_ms // 1000)
+    encoded = base64.b64encode(chunk).decode("utf-8")
+    count = int(minutes * 60 * 1000 / chunk_ms)
+    total = len(chunk) * count
+
+    def old_flow(path):
+        pcm_datas = b""
+        for _ in range(count):
+            pcm_datas += base64.b64decode(encoded)
+        write_pcm_to_wav_file(pcm_datas, path)
+
+    def new_flow(path):
+        with WavStreamSink(path) as sink:
+            for _ in range(count):
+                sink.write_base64(encoded)
+
+    print(
+        f"语音 {minutes} 分钟, {count} 个 delta 事件, PCM {total / 1024 / 1024:.1f}MB"
+    )
+    flows = (
+        (("原流程", old_flow), ("新流程", new_flow)) if old else (("新流程", new_flow),)
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, f in flows:
+            path = os.path.join(tmp, "output.wav")
+            tracemalloc.start()
+            start = time.perf_counter()
+            f(path)
+            cost = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with wave.open(path, "rb") as wav:
+                assert wav.getnframes() * PCM_SAMPLE_WIDTH == total
+            print(
+                f"  {name}: 耗时 {cost * 1000:10.1f}ms, 峰值内存 {peak / 1024 / 1024:8.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="语音保存性能测试")
+    parser.add_argument("--minutes", default=10, type=float)
+    parser.add_argument(
+        "--chunk-ms", default=100, type=int, help="每个 delta 事件的语音时长"
+    )
+    parser.add_argument("--skip-old", action="store_true", help="不运行原来的流程")
+    args = parser.parse_args()
+    benchmark(args.minutes, args.chunk_ms, not args.skip_old)
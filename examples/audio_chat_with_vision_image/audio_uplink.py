@@ -0,0 +1,315 @@
+# websocket 语音上行: 按 wav 文件头中的采样率和帧大小切分语音, 按真实说话的速度发送
+#
+# - 语音数据以 memoryview 切片的形式发送, 不复制文件内容; 大文件可以使用 mmap
+# - 按单调时钟计算每个分片应该发送的时间, sleep 的误差不会累积
+# - websocket 发送队列中等待发送的分片过多时暂停读取, 避免网络慢时在内存中堆积
+# - 统计每个分片的发送延迟和抖动
+#
+# 性能测试, 模拟发送队列偶尔变慢, 对比原来的发送方式和新的发送方式:
+#
+#     python audio_uplink.py --seconds 10
+
+import asyncio
+import mmap
+import struct
+import time
+from typing import AsyncIterable, Iterable, Iterator, Optional, Union
+
+from cozepy import AsyncWebsocketsChatClient, InputAudioBufferAppendEvent
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavFormatError(Exception):
+    pass
+
+
+# 解析 wav 文件头, 返回 (声道数, 采样位宽(字节), 采样率, 语音数据的偏移, 语音数据的长度)
+def parse_wav_header(buf: memoryview):
+    if len(buf) < 12 or buf[0:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        raise WavFormatError("不是 wav 文件")
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(buf):
+        chunk_id = bytes(buf[offset : offset + 4])
+        (chunk_size,) = struct.unpack_from("<I", buf, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", buf, body)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavFormatError("wav 文件中 data 在 fmt 之前")
+            format_tag, channels, frame_rate, _, _, bits = fmt
+            if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE):
+                raise WavFormatError(f"不支持的 wav 编码: {format_tag}")
+            # 边录边写的文件中 data 长度可能还没有回写, 以文件实际长度为准
+            size = min(chunk_size, len(buf) - body)
+            return channels, bits // 8, frame_rate, body, size
+        offset = body + chunk_size + (chunk_size & 1)  # chunk 按 2 字节对齐
+    raise WavFormatError("wav 文件中没有 data")
+
+
+# wav 文件语音源, 读取文件头后按时长切分语音数据
+class WavAudioSource:
+    def __init__(self, path: str, use_mmap: bool = True):
+        with open(path, "rb") as f:
+            if use_mmap:
+                self._mmap: Optional[mmap.mmap] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ
+                )
+                self._buf = memoryview(self._mmap)
+            else:
+                self._mmap = None
+                self._buf = memoryview(f.read())
+        header = parse_wav_header(self._buf)
+        self.channels, self.sample_width, self.frame_rate, offset, size = header
+        self.frame_size = self.channels * self.sample_width
+        self.bytes_per_second = self.frame_rate * self.frame_size
+        self.data = self._buf[offset : offset + size - size % self.frame_size]
+
+    # 语音时长, 秒
+    @property
+    def duration(self) -> float:
+        return len(self.data) / self.bytes_per_second
+
+    # 按 chunk_ms 毫秒切分, 分片大小是帧大小的整数倍
+    def chunks(self, chunk_ms: int = 20) -> Iterator[memoryview]:
+        size = max(1, self.bytes_per_second * chunk_ms // 1000 // self.frame_size)
+        size *= self.frame_size
+        for i in range(0, len(self.data), size):
+            yield self.data[i : i + size]
+
+    def close(self):
+        self.data.release()
+        self._buf.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # 还有分片在发送队列中, mmap 会在分片释放后自动关闭
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# 语音上行: 按 bytes_per_second 控制发送速度, 并根据 websocket 发送队列的长度限流
+class AudioUplink:
+    def __init__(
+        self,
+        client: AsyncWebsocketsChatClient,
+        max_pending: int = 8,
+        realtime: bool = True,
+        queue_timeout: float = 10,
+    ):
+        self.client = client
+        self.max_pending = max_pending  # 发送队列中最多等待发送的分片数
+        # 文件等预先准备好的语音需要按真实速度发送; 麦克风等实时语音源本身就是实时的, 不需要再控制速度
+        self.realtime = realtime
+        self.queue_timeout = queue_timeout  # 等待发送队列变短的最长时间, 秒
+
+    # SDK 的发送任务是否还在运行: 连接断开或发送出错后发送任务结束, 队列不会再变短
+    def _sender_alive(self) -> bool:
+        client = self.client
+        send_task = client._send_task
+        return (
+            client._state == AsyncWebsocketsChatClient.State.CONNECTED
+            and send_task is not None
+            and not send_task.done()
+        )
+
+    async def _wait_queue(self, poll_interval: float) -> int:
+        # 发送队列是 SDK 的内部属性, 没有提供等待队列变短的接口, 这里轮询队列长度
+        # 发送任务已经结束或者等待超过 queue_timeout 时抛出异常, 不会一直等待下去
+        queue = self.client._input_queue
+        depth = queue.qsize()
+        deadline = time.monotonic() + self.queue_timeout
+        while queue.qsize() >= self.max_pending:
+            if not self._sender_alive():
+                raise ConnectionError("websocket 连接已经断开, 发送队列不会再被消费")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"等待发送队列超过 {self.queue_timeout}s")
+            await asyncio.sleep(poll_interval)
+        return depth
+
+    # 发送语音分片, 返回发送统计
+    async def send(
+        self,
+        chunks: Union[Iterable[memoryview], AsyncIterable[memoryview]],
+        bytes_per_second: int,
+    ) -> dict:
+        stats = new_uplink_stats()
+        start = time.monotonic()
+        sent_bytes = 0
+        prev_sent_at = None
+        prev_target = None
+        jitter = 0.0
+
+        async def iterate():
+            if hasattr(chunks, "__aiter__"):
+                async for c in chunks:
+                    yield c
+            else:
+                for c in chunks:
+                    yield c
+
+        async for chunk in iterate():
+            duration = len(chunk) / bytes_per_second
+            # 分片应该发送的时间, 由已发送的数据量计算, 不依赖每次 sleep 的精度
+            target = start + sent_bytes / bytes_per_second
+            if self.realtime:
+                delay = target - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            queued_at = time.monotonic()
+            depth = await self._wait_queue(min(duration / 4, 0.005) or 0.001)
+            # delta 是 bytes 类型, model_construct 跳过校验直接使用 memoryview, 发送时才编码为 base64
+            await self.client.input_audio_buffer_append(
+                InputAudioBufferAppendEvent.Data.model_construct(delta=chunk)
+            )
+            sent_at = time.monotonic()
+
+            stats["chunks"] += 1
+            stats["bytes"] += len(chunk)
+            stats["send_ms"].append((sent_at - queued_at) * 1000)
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], depth)
+            if self.realtime:
+                stats["late_ms"].append(max(0.0, sent_at - target) * 1000)
+            # 抖动: 相邻分片实际发送间隔和理想间隔之差的平滑平均 (RFC 3550)
+            if prev_sent_at is not None:
+                d = (sent_at - prev_sent_at) - (target - prev_target)
+                jitter += (abs(d) - jitter) / 16
+            prev_sent_at, prev_target = sent_at, target
+            sent_bytes += len(chunk)
+
+        stats["jitter_ms"] = jitter * 1000
+        stats["audio_ms"] = sent_bytes / bytes_per_second * 1000
+        stats["total_ms"] = (time.monotonic() - start) * 1000
+        return stats
+
+
+def new_uplink_stats() -> dict:
+    return {
+        "chunks": 0,
+        "bytes": 0,
+        "send_ms": [],  # 每个分片从准备发送到放入发送队列的耗时, 包括等待队列变短的时间
+        "late_ms": [],  # 每个分片比应该发送的时间晚了多少
+        "max_queue_depth": 0,
+        "jitter_ms": 0.0,
+        "audio_ms": 0.0,
+        "total_ms": 0.0,
+    }
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def format_uplink_stats(stats: dict) -> str:
+    return (
+        f"发送 {stats['chunks']} 个分片, 语音 {stats['audio_ms']:.0f}ms, "
+        f"耗时 {stats['total_ms']:.0f}ms, "
+        f"发送延迟 p50 {percentile(stats['send_ms'], 0.5):.2f}ms "
+        f"p99 {percentile(stats['send_ms'], 0.99):.2f}ms, "
+        f"滞后 p99 {percentile(stats['late_ms'], 0.99):.2f}ms, "
+        f"抖动 {stats['jitter_ms']:.2f}ms, 最大队列长度 {stats['max_queue_depth']}"
+    )
+
+
+# 性能测试: 模拟的 websocket 客户端每隔一段时间发送变慢, 对比原来的发送方式和新的发送方式
+def benchmark(seconds: float, chunk_ms: int, stall_ms: float):
+    import os
+    import tempfile
+    import tracemalloc
+    import wave
+
+    class FakeClient:
+        def __init__(self):
+            self._input_queue = asyncio.Queue()
+            self._state = AsyncWebsocketsChatClient.State.CONNECTED
+            self._send_task = None
+            self.sent = 0
+            self.max_depth = 0
+
+        async def input_audio_buffer_append(self, data):
+            self.max_depth = max(self.max_depth, self._input_queue.qsize())
+            await self._input_queue.put(data)
+
+        async def send_loop(self):
+            n = 0
+            while True:
+                data = await self._input_queue.get()
+                n += 1
+                # 每 50 个分片模拟一次网络变慢
+                await asyncio.sleep(stall_ms / 1000 if n % 50 == 0 else 0.0005)
+                self.sent += len(data.delta)
+                self._input_queue.task_done()
+
+    async def old(path):
+        client = FakeClient()
+        sender = asyncio.create_task(client.send_loop())
+        start = time.monotonic()
+        late = []
+        with open(path, "rb") as f:
+            audio_data = f.read()
+        deltas = [audio_data[i : i + 1024] for i in range(0, len(audio_data), 1024)]
+        sent = 0
+        for delta in deltas:
+            late.append(max(0.0, time.monotonic() - start - sent / 48000) * 1000)
+            await client.input_audio_buffer_append(
+                InputAudioBufferAppendEvent.Data.model_validate({"delta": delta})
+            )
+            sent += len(delta)
+            await asyncio.sleep(len(delta) * 1.0 / 24000 / 2)
+        await client._input_queue.join()
+        sender.cancel()
+        return (
+            f"滞后 p99 {percentile(late, 0.99):.2f}ms, "
+            f"最大队列长度 {client.max_depth}"
+        )
+
+    async def new(path):
+        client = FakeClient()
+        sender = client._send_task = asyncio.create_task(client.send_loop())
+        with WavAudioSource(path) as source:
+            stats = await AudioUplink(client).send(
+                source.chunks(chunk_ms), source.bytes_per_second
+            )
+            await client._input_queue.join()
+        sender.cancel()
+        return format_uplink_stats(stats)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "input.wav")
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(24000)
+            wav.writeframes(os.urandom(int(24000 * 2 * seconds)))
+        print(f"语音 {seconds}s, 每 50 个分片发送变慢 {stall_ms}ms")
+        for name, f in (("原流程", old), ("新流程", new)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = asyncio.run(f(path))
+            cost = (time.perf_counter() - start) * 1000
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {name}: 耗时 {cost:.0f}ms, 峰值内存 {peak / 1024:.0f}KB")
+            print(f"    {result}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="websocket 语音上行性能测试")
+    parser.add_argument("--seconds", default=10, type=float)
+    parser.add_argument("--chunk-ms", default=20, type=int)
+    parser.add_argument("--stall-ms", default=200, type=float)
+    args = parser.parse_args()
+    benchmark(args.seconds, args.chunk_ms, args.stall_ms)
@@ -0,0 +1,279 @@
+# 批量评测: 读取 (语音, 图片) 样本清单, 并发地通过和 http_chat.py 一样的 /v3/chat 流程对话
+#
+# - 使用 AsyncCoze, 最多同时进行 concurrency 个对话, 每秒最多开始 rate 个样本
+# - 回复的文字和语音边收边写入 output_dir/<id>.txt 和 output_dir/<id>.wav
+# - 每个样本完成后追加一行结果到 output_dir/results.jsonl, 中断后重新运行会跳过已经成功的样本
+# - 结束时输出吞吐报告 (样本/分钟, tokens/s, 错误率), 并保存到 output_dir/report.json
+#
+# 样本清单是 jsonl 文件, 每行一个样本, 路径相对于清单文件所在的目录:
+#
+#     {"id": "case_001", "audio": "audio/001.wav", "image": "image/001.png"}
+#
+#     COZE_API_TOKEN=扣子令牌 COZE_BOT_ID=智能体_ID python batch_eval.py manifest.jsonl --concurrency 8 --rate 2
+
+import asyncio
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from contextlib import aclosing
+from typing import Dict, List, Optional
+
+from cozepy import (
+    COZE_CN_BASE_URL,
+    AsyncCoze,
+    ChatEventType,
+    TokenAuth,
+    setup_logging,
+)
+
+from audio_sink import AsyncWavStreamSink
+from audio_uplink import percentile
+from http_chat import build_question
+from upload_cache import UploadCache, upload_cache_namespace
+
+setup_logging(logging.ERROR)
+
+# 样本 id 会用作输出文件名, 只允许文字、数字、下划线、连字符和点, 不能包含路径分隔符
+SAMPLE_ID_RE = re.compile(r"^[\w.-]+$")
+
+
+# 读取样本清单, 没有 id 的样本使用行号作为 id; id 不合法或者重复时抛出 ValueError
+def load_manifest(path: str) -> List[Dict]:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            pair_id = str(item.get("id") or index)
+            if not SAMPLE_ID_RE.match(pair_id) or pair_id in (".", ".."):
+                raise ValueError(f"第 {index + 1} 行的样本 id 不合法: {pair_id!r}")
+            if pair_id in seen:
+                raise ValueError(f"第 {index + 1} 行的样本 id 重复: {pair_id!r}")
+            seen.add(pair_id)
+            pairs.append(
+                {
+                    "id": pair_id,
+                    "audio": os.path.join(base_dir, item["audio"]),
+                    "image": os.path.join(base_dir, item["image"]),
+                }
+            )
+    return pairs
+
+
+# 读取已经完成的样本结果, 进程崩溃时最后一行可能不完整
+def load_results(path: str) -> Dict[str, dict]:
+    results = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                results[result["id"]] = result
+    except FileNotFoundError:
+        pass
+    return results
+
+
+# 限制每秒开始的样本数: 按单调时钟为每个样本排好开始时间, 突发时也不会超过 rate
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        at = max(now, self._next)
+        self._next = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class BatchEvaluator:
+    def __init__(
+        self,
+        api_base: str,
+        token: str,
+        bot_id: str,
+        output_dir: str,
+        concurrency: int = 4,
+        rate: float = 0.0,
+    ):
+        self.coze = AsyncCoze(auth=TokenAuth(token), base_url=api_base)
+        # 评测集中经常有相同的图片, 相同内容的文件只上传一次
+        self.upload_cache = UploadCache(
+            namespace=upload_cache_namespace(api_base, token)
+        )
+        self.bot_id = bot_id
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate)
+        self.results_path = os.path.join(output_dir, "results.jsonl")
+
+    # 评测一个样本, 返回结果; 失败时返回错误信息, 不抛出异常
+    async def run_pair(self, pair: Dict) -> dict:
+        result = {"id": pair["id"], "status": "ok", "logid": "", "error": ""}
+        result.update(tokens=0, output_tokens=0, ttft_ms=0.0, latency_ms=0.0)
+        text_path = os.path.join(self.output_dir, f"{pair['id']}.txt")
+        audio_path = os.path.join(self.output_dir, f"{pair['id']}.wav")
+        sink: Optional[AsyncWavStreamSink] = None
+        start = time.perf_counter()
+        try:
+            # 语音和图片同时上传
+            audio_file, image_file = await asyncio.gather(
+                self.upload_cache.async_upload(self.coze, pair["audio"]),
+                self.upload_cache.async_upload(self.coze, pair["image"]),
+            )
+            chat_start = time.perf_counter()
+            # AsyncCoze 的 chat.stream 是异步生成器, logid 从事件的响应中获取
+            stream = self.coze.chat.stream(
+                bot_id=self.bot_id,
+                user_id=secrets.token_urlsafe(),
+                additional_messages=[build_question(audio_file, image_file)],
+            )
+            # 对话失败时在循环中抛出异常, aclosing 保证生成器和 http 响应被关闭
+            async with aclosing(stream):
+                with open(text_path, "w", encoding="utf-8") as text_file:
+                    async for event in stream:
+                        if not result["logid"]:
+                            result["logid"] = event.response.logid
+                        if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                            if not result["ttft_ms"]:
+                                ttft = time.perf_counter() - chat_start
+                                result["ttft_ms"] = ttft * 1000
+                            # 文字边收边写入文件, 中断时可以看到已经收到的内容
+                            text_file.write(event.message.content)
+                            text_file.flush()
+                        elif event.event == ChatEventType.CONVERSATION_AUDIO_DELTA:
+                            if sink is None:
+                                sink = AsyncWavStreamSink(audio_path)
+                            sink.write_base64(event.message.content)
+                        elif event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
+                            if event.chat.usage:
+                                result["tokens"] = event.chat.usage.token_count
+                                result["output_tokens"] = event.chat.usage.output_count
+                        elif event.event == ChatEventType.CONVERSATION_CHAT_FAILED:
+                            raise Exception(f"对话失败: {event.chat.last_error}")
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            if sink is not None:
+                try:
+                    await sink.close()
+                except Exception as e:
+                    result["status"] = "error"
+                    result["error"] = result["error"] or f"写入语音失败: {e}"
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    async def run(self, pairs: List[Dict], verbose: bool = True) -> dict:
+        os.makedirs(self.output_dir, exist_ok=True)
+        done = load_results(self.results_path)
+        pending = [p for p in pairs if done.get(p["id"], {}).get("status") != "ok"]
+        if verbose:
+            print(f"共 {len(pairs)} 个样本, 已完成 {len(pairs) - len(pending)} 个")
+
+        results = []
+        queue = iter(pending)
+        results_file = open(self.results_path, "a", encoding="utf-8")
+
+        async def worker():
+            for pair in queue:
+                await self.rate_limiter.acquire()
+                result = await self.run_pair(pair)
+                # 每个样本完成后立即追加到结果文件, 中断后重新运行时以文件中的结果为准
+                results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                results_file.flush()
+                results.append(result)
+                if verbose:
+                    print(
+                        f"[{len(results)}/{len(pending)}] {result['id']} {result['status']} "
+                        f"{result['latency_ms']:.0f}ms {result['error']}"
+                    )
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        finally:
+            results_file.close()
+        report = build_report(results, time.perf_counter() - start)
+        report["skipped"] = len(pairs) - len(pending)
+        with open(os.path.join(self.output_dir, "report.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+def build_report(results: List[dict], elapsed: float) -> dict:
+    ok = [r for r in results if r["status"] == "ok"]
+    tokens = sum(r["tokens"] for r in ok)
+    output_tokens = sum(r["output_tokens"] for r in ok)
+    return {
+        "pairs": len(results),
+        "errors": len(results) - len(ok),
+        "elapsed_s": elapsed,
+        "pairs_per_min": len(results) / elapsed * 60 if elapsed else 0.0,
+        "tokens_per_s": tokens / elapsed if elapsed else 0.0,
+        "output_tokens_per_s": output_tokens / elapsed if elapsed else 0.0,
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "ttft_p50_ms": percentile([r["ttft_ms"] for r in ok], 0.5),
+        "ttft_p99_ms": percentile([r["ttft_ms"] for r in ok], 0.99),
+        "latency_p50_ms": percentile([r["latency_ms"] for r in ok], 0.5),
+        "latency_p99_ms": percentile([r["latency_ms"] for r in ok], 0.99),
+    }
+
+
+def format_report(report: dict) -> str:
+    return (
+        f"完成 {report['pairs']} 个样本 (跳过已完成的 {report['skipped']} 个), "
+        f"耗时 {report['elapsed_s']:.1f}s\n"
+        f"  吞吐 {report['pairs_per_min']:.1f} 样本/分钟, "
+        f"{report['tokens_per_s']:.1f} tokens/s "
+        f"(输出 {report['output_tokens_per_s']:.1f} tokens/s)\n"
+        f"  错误 {report['errors']} 个, 错误率 {report['error_rate'] * 100:.1f}%\n"
+        f"  首字耗时 p50 {report['ttft_p50_ms']:.0f}ms p99 {report['ttft_p99_ms']:.0f}ms, "
+        f"总耗时 p50 {report['latency_p50_ms']:.0f}ms p99 {report['latency_p99_ms']:.0f}ms"
+    )
+
+
+# 主入口
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批量评测语音和图片对话")
+    parser.add_argument("manifest", help="样本清单, jsonl 格式")
+    parser.add_argument("--output-dir", default="./eval_output")
+    parser.add_argument(
+        "--concurrency", default=4, type=int, help="最多同时进行的对话数"
+    )
+    parser.add_argument(
+        "--rate", default=0, type=float, help="每秒最多开始的样本数, 0 表示不限制"
+    )
+    parser.add_argument("--api-base", default=COZE_CN_BASE_URL)
+    args = parser.parse_args()
+
+    coze_token = os.getenv("COZE_API_TOKEN") or (
+        "请配置你的扣子访问凭据" "please config your coze access_token"
+    )
+    coze_bot_id = os.getenv("COZE_BOT_ID") or (
+        "请配置你的扣子 bot_id" "please config your coze bot_id"
+    )
+    evaluator = BatchEvaluator(
+        args.api_base,
+        coze_token,
+        coze_bot_id,
+        args.output_dir,
+        args.concurrency,
+        args.rate,
+    )
+    report = asyncio.run(evaluator.run(load_manifest(args.manifest)))
+    print(format_report(report))
@@ -0,0 +1,233 @@
+# 录制和回放对话事件流, 用于离线分析和优化客户端处理事件 (解析、打印、拼接语音) 的耗时
+#
+# - 录制: 记录 /v3/chat 的每个 sse 事件和 websocket 收到的每个事件的原始内容和到达时间
+# - 回放: 把录制的事件按原来的顺序交给 SDK 解析, 再交给同样的处理函数, 可以尽快回放或按录制时的节奏回放
+#
+# 录制文件每行是一个 json: 以 {"kind": "sse" | "ws", ...} 开头的一行表示一次对话的开始,
+# 之后每行是 [距离对话开始的微秒数, 原始事件]; 文件只追加写入, 一个文件中可以录制多次对话
+#
+#     COZE_RECORD_PATH=./http.cassette python http_chat.py
+#     python cassette.py ./http.cassette --pace fast --repeat 100 --quiet --profile
+#
+# 录制和回放依赖 SDK 的内部接口 (Stream._handler、_sync_chat_stream_handler、
+# AsyncWebsocketsChatClient._load_all_event), 只在 CASSETTE_COZEPY_VERSION 版本上验证过,
+# requirements.txt 中固定了这个版本; 其他版本的 SDK 录制时会给出警告
+
+import asyncio
+import json
+import time
+import warnings
+from typing import Dict, Iterator, List, Tuple
+
+import httpx
+from cozepy import AsyncWebsocketsChatClient, ChatEvent, Stream, WebsocketsEventType
+from cozepy.chat import _sync_chat_stream_handler
+from cozepy.version import VERSION as COZEPY_VERSION
+
+CASSETTE_VERSION = 1
+CASSETTE_COZEPY_VERSION = "0.13.0"
+
+
+class CassetteRecorder:
+    def __init__(self, path: str, kind: str, **meta):
+        self.path = path
+        self.kind = kind
+        # 追加写入, 不修改已经写入的内容; 进程崩溃时最多丢失最后一行
+        self._file = open(path, "a", encoding="utf-8")
+        self._start = time.monotonic()
+        self.events = 0
+        if COZEPY_VERSION != CASSETTE_COZEPY_VERSION:
+            warnings.warn(
+                f"录制只在 cozepy {CASSETTE_COZEPY_VERSION} 上验证过, "
+                f"当前版本 {COZEPY_VERSION} 可能无法正确录制"
+            )
+        header = {"kind": kind, "version": CASSETTE_VERSION, "created_at": time.time()}
+        header["cozepy_version"] = COZEPY_VERSION
+        self._write({**header, **meta})
+
+    def _write(self, obj):
+        self._file.write(json.dumps(obj, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+    def record(self, payload: Dict):
+        t = int((time.monotonic() - self._start) * 1_000_000)
+        self._write([t, payload])
+        self.events += 1
+
+    # 录制 /v3/chat 的 sse 事件流: 在 SDK 解析每个事件之前记录 event 和 data 的原始内容
+    def record_stream(self, stream):
+        handler = stream._handler
+
+        def recording_handler(data, raw_response):
+            self.record(dict(data))
+            return handler(data, raw_response)
+
+        stream._handler = recording_handler
+        return stream
+
+    # 录制 websocket 收到的事件: 在 SDK 解析每个事件之前记录 json 消息
+    def record_websocket(self, client: AsyncWebsocketsChatClient):
+        load_all_event = client._load_all_event
+
+        def recording_load_all_event(message):
+            self.record(message)
+            return load_all_event(message)
+
+        client._load_all_event = recording_load_all_event
+        return client
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# 读取录制文件, 返回每次对话的 (头信息, [(秒, 原始事件), ...])
+def load_cassette(path: str) -> List[Tuple[Dict, List[Tuple[float, Dict]]]]:
+    sessions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                break  # 录制时进程崩溃, 最后一行不完整
+            if isinstance(item, dict):
+                sessions.append((item, []))
+            elif sessions:
+                sessions[-1][1].append((item[0] / 1_000_000, item[1]))
+    return sessions
+
+
+# 回放的节奏: realtime 为 True 时按录制时事件的间隔等待, 否则尽快回放
+def _wait_until(start: float, t: float, realtime: bool):
+    if realtime:
+        delay = start + t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# 把录制的 sse 事件还原成 SDK 的 Stream[ChatEvent], 事件由 SDK 重新解析, 可以直接交给 handle_coze_stream
+def replay_stream(
+    header: Dict, events: List[Tuple[float, Dict]], realtime: bool = False
+) -> Stream[ChatEvent]:
+    def lines() -> Iterator[str]:
+        start = time.monotonic()
+        for t, data in events:
+            _wait_until(start, t, realtime)
+            for field, value in data.items():
+                yield f"{field}:{value}"
+            yield ""
+
+    raw_response = httpx.Response(200, headers={"x-tt-logid": header.get("logid", "")})
+    return Stream(
+        raw_response,
+        lines(),
+        fields=["event", "data"],
+        handler=_sync_chat_stream_handler,
+    )
+
+
+# 把录制的 websocket 事件交给 handler, 和 SDK 的接收循环一样先解析再调用对应的处理函数
+async def replay_websocket(
+    header: Dict,
+    events: List[Tuple[float, Dict]],
+    on_event,
+    realtime: bool = False,
+):
+    # 不建立连接, 只使用客户端解析事件和分发事件的逻辑
+    client = AsyncWebsocketsChatClient(
+        base_url="ws://replay",
+        requester=None,
+        bot_id=header.get("bot_id", "replay"),
+        on_event=on_event,
+    )
+    start = time.monotonic()
+    for t, message in events:
+        if realtime:
+            delay = start + t - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # 读取录制文件时已经解析过 json, 这里从 SDK 解析事件开始, 和接收循环中的处理一致
+        handler = client._on_event.get(message.get("event_type"))
+        event = client._load_all_event(message)
+        if handler and event:
+            await handler(client, event)
+    closed = client._on_event.get(WebsocketsEventType.CLOSED)
+    if closed:
+        await closed(client)
+
+
+# 回放 load_cassette 读取的所有对话, 交给 http_chat 和 websocket_chat 中同样的处理函数, 返回回放统计
+def replay(
+    sessions: List[Tuple[Dict, List[Tuple[float, Dict]]]],
+    realtime: bool = False,
+    verbose: bool = True,
+    output_path: str = "./output_replay_audio.wav",
+) -> dict:
+    from http_chat import handle_coze_stream
+    from websocket_chat import WebsocketsChatEventHandler
+
+    stats = {"sessions": len(sessions), "events": 0, "total_ms": 0.0}
+    start = time.perf_counter()
+    for header, events in sessions:
+        if header["kind"] == "sse":
+            stream = replay_stream(header, events, realtime)
+            handle_coze_stream(stream, output_path, verbose)
+        elif header["kind"] == "ws":
+            handler = WebsocketsChatEventHandler(output_path, verbose)
+            asyncio.run(replay_websocket(header, events, handler, realtime))
+        stats["events"] += len(events)
+    stats["total_ms"] = (time.perf_counter() - start) * 1000
+    return stats
+
+
+def format_replay_stats(stats: dict) -> str:
+    per_event_us = stats["total_ms"] * 1000 / stats["events"] if stats["events"] else 0
+    return (
+        f"回放 {stats['sessions']} 次对话, {stats['events']} 个事件, "
+        f"耗时 {stats['total_ms']:.1f}ms, 每个事件 {per_event_us:.1f}us"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import cProfile
+    import pstats
+    import sys
+
+    parser = argparse.ArgumentParser(description="回放录制的对话事件流")
+    parser.add_argument("path", help="录制文件")
+    parser.add_argument("--pace", default="fast", choices=["fast", "recorded"])
+    parser.add_argument("--repeat", default=1, type=int)
+    parser.add_argument("--output", default="./output_replay_audio.wav")
+    parser.add_argument("--quiet", action="store_true", help="不打印回复的文字")
+    parser.add_argument("--profile", action="store_true", help="使用 cProfile 分析耗时")
+    args = parser.parse_args()
+
+    # 只读取一次录制文件, 统计和分析的只是处理事件的耗时
+    sessions = load_cassette(args.path)
+    profiler = cProfile.Profile() if args.profile else None
+    results = []
+    for _ in range(args.repeat):
+        if profiler:
+            profiler.enable()
+        realtime = args.pace == "recorded"
+        results.append(replay(sessions, realtime, not args.quiet, args.output))
+        if profiler:
+            profiler.disable()
+    # 回复的文字输出到 stdout, 统计输出到 stderr
+    print(format_replay_stats(results[0]), file=sys.stderr)
+    if args.repeat > 1:
+        total = sorted(r["total_ms"] for r in results)
+        print(
+            f"{args.repeat} 次回放耗时 p50 {total[len(total) // 2]:.1f}ms",
+            file=sys.stderr,
+        )
+    if profiler:
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(
+            25
+        )
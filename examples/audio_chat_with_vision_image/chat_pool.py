@@ -0,0 +1,509 @@
+# websocket 对话连接池: 为同一个 bot_id/workflow_id 预先建立 websocket 连接, 多次短对话复用这些连接,
+# 省去每次建立连接和发送 chat_update 的耗时
+#
+# - 启动时预先建立 min_size 个连接, 后台定期对空闲连接做 ping 检查, 空闲超过 idle_timeout 的连接会被关闭
+# - 每个连接记录最近一次发送的 chat_update 配置, 配置没有变化时不再重复发送
+# - 统计从提交语音到收到第一段语音回复的耗时 (time to first audio delta)
+#
+# 连接上的对话上下文会在复用时保留, 为了不让后一个会话接着上一个用户的对话, 默认要求每个会话在 chat_update 配置中
+# 指定 conversation_id, 由 session(handler, config) 在交出连接前发送; 只有同一个用户的连续对话 (如单用户的语音前端)
+# 可以设置 share_conversation=True, 不指定 conversation_id, 沿用连接上的对话
+#
+# SDK 没有提供替换事件处理函数和检查连接状态的接口, 连接池使用了 AsyncWebsocketsChatClient 的内部属性
+# (_on_event、_state、_ws、_send_task、_receive_task), 这些属性以 requirements.txt 中固定的 cozepy 版本为准
+#
+# 使用方式:
+#
+#     pools = WebsocketChatPools(coze)
+#     pool = await pools.get(bot_id, workflow_id)
+#     async with pool.session(handler, config) as conn:  # config.chat_config.conversation_id 为这个用户的会话
+#         ...发送语音
+#         await conn.complete_input()
+#         await conn.client.wait()
+#
+# 性能测试, 对比每次新建连接和使用连接池的耗时:
+#
+#     python chat_pool.py --ws-base-url ws://127.0.0.1:8098 --rounds 20
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from cozepy import (
+    AsyncCoze,
+    AsyncWebsocketsChatClient,
+    AsyncWebsocketsChatEventHandler,
+    ChatUpdateEvent,
+    WebsocketsEventType,
+)
+from cozepy.log import log_info
+
+
+# 池中的一个 websocket 连接, 收到的事件转发给当前使用这个连接的 handler
+class PooledChatConnection:
+    def __init__(self, pool: "WebsocketChatPool", client: AsyncWebsocketsChatClient):
+        self.pool = pool
+        self.client = client
+        self.handler: Optional[AsyncWebsocketsChatEventHandler] = None
+        self.config_json: Optional[str] = None  # 最近一次发送的 chat_update 配置
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.uses = 0
+        self.closed = False
+        self._acquired_at: Optional[float] = None
+        self._input_completed_at: Optional[float] = None
+        # 把 SDK 按事件类型注册的处理函数替换为转发函数
+        for event_type, fn in list(client._on_event.items()):
+            client._on_event[event_type] = self._forwarder(event_type, fn.__name__)
+
+    def _forwarder(self, event_type: WebsocketsEventType, name: str):
+        async def forward(cli, *args):
+            if event_type == WebsocketsEventType.CONVERSATION_AUDIO_DELTA:
+                self._record_first_audio()
+            elif event_type == WebsocketsEventType.CLOSED:
+                self.closed = True
+            handler = self.handler
+            if handler is not None:
+                await getattr(handler, name)(cli, *args)
+
+        return forward
+
+    # 记录首段语音回复的耗时: 从提交语音开始计算, 以及从获取连接开始计算(包括建立连接和发送语音)
+    def _record_first_audio(self):
+        now = time.monotonic()
+        if self._input_completed_at is not None:
+            self.pool.ttfa_ms.append((now - self._input_completed_at) * 1000)
+            self._input_completed_at = None
+        if self._acquired_at is not None:
+            self.pool.session_ttfa_ms.append((now - self._acquired_at) * 1000)
+            self._acquired_at = None
+
+    # 发送 chat_update, 和连接上一次发送的配置相同时跳过, 返回是否发送
+    async def update_config(self, data: ChatUpdateEvent.Data) -> bool:
+        self.pool.check_config(data)
+        config_json = data.model_dump_json()
+        if config_json == self.config_json:
+            self.pool.config_skipped += 1
+            return False
+        await self.client.chat_update(data)
+        self.config_json = config_json
+        return True
+
+    # 语音发送完成, 从这时开始计算首段语音回复的耗时
+    async def complete_input(self):
+        await self.client.input_audio_buffer_complete()
+        self._input_completed_at = time.monotonic()
+
+    # 连接是否可用: SDK 的接收任务或发送任务结束(连接断开或出错)后不能再使用
+    # 发送任务结束的连接发送的语音不会再被发出, 如果继续使用, 上行会一直等待发送队列变短
+    @property
+    def alive(self) -> bool:
+        client = self.client
+        return (
+            not self.closed
+            and client._state == AsyncWebsocketsChatClient.State.CONNECTED
+            and client._ws is not None
+            and client._receive_task is not None
+            and not client._receive_task.done()
+            and client._send_task is not None
+            and not client._send_task.done()
+        )
+
+    async def ping(self, timeout: float) -> bool:
+        if not self.alive:
+            return False
+        try:
+            pong_waiter = await self.client._ws.ping()
+            await asyncio.wait_for(pong_waiter, timeout)
+            return True
+        except Exception:
+            return False
+
+    async def close(self):
+        self.closed = True
+        try:
+            await self.client.close()
+        except Exception as e:
+            log_info(f"关闭 websocket 连接失败: {str(e)}")
+
+
+class WebsocketChatPool:
+    def __init__(
+        self,
+        coze: AsyncCoze,
+        bot_id: str,
+        workflow_id: Optional[str] = None,
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 60,
+        health_check_interval: float = 15,
+        ping_timeout: float = 5,
+        ws_base_url: Optional[str] = None,
+        share_conversation: bool = False,
+    ):
+        self.coze = coze
+        self.bot_id = bot_id
+        self.workflow_id = workflow_id
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        # 不使用 coze 客户端的地址时指定, 如本地的 mock 服务
+        self.ws_base_url = ws_base_url
+        # 为 False 时每个会话都要在 chat_update 配置中指定 conversation_id, 复用连接时不会接着上一个会话的对话
+        self.share_conversation = share_conversation
+        self._idle: List[PooledChatConnection] = []
+        self._size = 0  # 已建立和正在建立的连接数
+        self._cond = asyncio.Condition()
+        self._maintain_task: Optional[asyncio.Task] = None
+        self._closed = False
+        # 统计
+        self.connects = 0
+        self.reuses = 0
+        self.evicted = 0
+        self.config_skipped = 0
+        self.connect_ms: List[float] = []
+        self.acquire_ms: List[float] = []
+        self.ttfa_ms: List[float] = []
+        self.session_ttfa_ms: List[float] = []
+
+    async def start(self):
+        await asyncio.gather(*[self._add_idle() for _ in range(self.min_size)])
+        self._maintain_task = asyncio.create_task(self._maintain())
+
+    async def _connect(self) -> PooledChatConnection:
+        start = time.monotonic()
+        if self.ws_base_url:
+            client = AsyncWebsocketsChatClient(
+                base_url=self.ws_base_url,
+                requester=self.coze._requester,
+                bot_id=self.bot_id,
+                workflow_id=self.workflow_id,
+                on_event=AsyncWebsocketsChatEventHandler(),
+            )
+        else:
+            client = self.coze.websockets.chat.create(
+                bot_id=self.bot_id,
+                workflow_id=self.workflow_id,
+                on_event=AsyncWebsocketsChatEventHandler(),
+            )
+        conn = PooledChatConnection(self, client)
+        await client.connect()
+        self.connects += 1
+        self.connect_ms.append((time.monotonic() - start) * 1000)
+        return conn
+
+    async def _add_idle(self):
+        async with self._cond:
+            if self._size >= self.max_size:
+                return
+            self._size += 1
+        try:
+            conn = await self._connect()
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        async with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    # 检查 chat_update 配置: 不共享对话时必须指定 conversation_id
+    def check_config(self, config: Optional[ChatUpdateEvent.Data]):
+        if self.share_conversation:
+            return
+        chat_config = config.chat_config if config is not None else None
+        if chat_config is None or not chat_config.conversation_id:
+            raise ValueError(
+                "chat_update 配置中需要指定 conversation_id, 否则复用的连接会接着上一个会话的对话"
+            )
+
+    # 取出一个可用连接, 没有空闲连接且未达到 max_size 时新建连接, 否则等待其他会话归还
+    # config 不为空时, 交出连接前先发送 chat_update
+    async def acquire(
+        self,
+        handler: Optional[AsyncWebsocketsChatEventHandler] = None,
+        config: Optional[ChatUpdateEvent.Data] = None,
+    ) -> PooledChatConnection:
+        if self._closed:
+            raise RuntimeError("连接池已经关闭")
+        self.check_config(config)
+        start = time.monotonic()
+        conn = None
+        dead = []
+        try:
+            async with self._cond:
+                while conn is None:
+                    # 等待期间连接池可能被关闭, 每次被唤醒后都要重新检查
+                    if self._closed:
+                        raise RuntimeError("连接池已经关闭")
+                    while self._idle:
+                        # 优先使用最近归还的连接
+                        candidate = self._idle.pop()
+                        if candidate.alive:
+                            conn = candidate
+                            self.reuses += 1
+                            break
+                        self._size -= 1
+                        self.evicted += 1
+                        dead.append(candidate)
+                    if conn is None and self._size < self.max_size:
+                        self._size += 1
+                        break
+                    if conn is None:
+                        await self._cond.wait()
+        finally:
+            for candidate in dead:
+                await candidate.close()
+        if conn is None:
+            try:
+                conn = await self._connect()
+            except BaseException:
+                async with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        conn.handler = handler
+        conn.uses += 1
+        conn._acquired_at = start
+        if config is not None:
+            try:
+                await conn.update_config(config)
+            except BaseException:
+                await self.release(conn, reuse=False)
+                raise
+        self.acquire_ms.append((time.monotonic() - start) * 1000)
+        return conn
+
+    # 归还连接; 对话没有正常结束时 reuse=False, 关闭连接而不是放回池中
+    async def release(self, conn: PooledChatConnection, reuse: bool = True):
+        conn.handler = None
+        conn.last_used_at = time.monotonic()
+        if reuse and conn.alive and not self._closed:
+            async with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+            return
+        await conn.close()
+        async with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def session(
+        self,
+        handler: Optional[AsyncWebsocketsChatEventHandler] = None,
+        config: Optional[ChatUpdateEvent.Data] = None,
+    ):
+        conn = await self.acquire(handler, config)
+        reuse = False
+        try:
+            yield conn
+            reuse = True
+        finally:
+            await self.release(conn, reuse)
+
+    # 定期检查空闲连接: 关闭空闲过久和 ping 失败的连接, 并补足 min_size 个连接
+    async def _maintain(self):
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            async with self._cond:
+                idle, self._idle = self._idle, []
+            now = time.monotonic()
+            keep, drop = [], []
+            for conn in idle:
+                expired = now - conn.last_used_at > self.idle_timeout
+                if expired and len(keep) + 1 > self.min_size:
+                    drop.append(conn)
+                else:
+                    keep.append(conn)
+            results = await asyncio.gather(*[c.ping(self.ping_timeout) for c in keep])
+            for conn, ok in zip(keep, results):
+                if not ok:
+                    drop.append(conn)
+            for conn in drop:
+                await conn.close()
+            async with self._cond:
+                self._idle.extend(c for c, ok in zip(keep, results) if ok)
+                self._size -= len(drop)
+                self.evicted += len(drop)
+                missing = self.min_size - self._size
+                self._cond.notify_all()
+            for _ in range(max(0, missing)):
+                try:
+                    await self._add_idle()
+                except Exception as e:
+                    log_info(f"补充 websocket 连接失败: {str(e)}")
+
+    async def close(self):
+        self._closed = True
+        if self._maintain_task is not None:
+            self._maintain_task.cancel()
+        async with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            # 唤醒所有等待连接的会话, 它们会发现连接池已经关闭并抛出异常
+            self._cond.notify_all()
+        await asyncio.gather(*[conn.close() for conn in idle])
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "evicted": self.evicted,
+            "config_skipped": self.config_skipped,
+            "connect_ms": percentiles(self.connect_ms),
+            "acquire_ms": percentiles(self.acquire_ms),
+            "ttfa_ms": percentiles(self.ttfa_ms),
+            "session_ttfa_ms": percentiles(self.session_ttfa_ms),
+        }
+
+
+# 按 bot_id/workflow_id 管理连接池, 第一次使用时创建并预热
+class WebsocketChatPools:
+    def __init__(self, coze: AsyncCoze, **pool_kwargs):
+        self.coze = coze
+        self.pool_kwargs = pool_kwargs
+        self._pools: Dict[Tuple[str, Optional[str]], WebsocketChatPool] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(
+        self, bot_id: str, workflow_id: Optional[str] = None
+    ) -> WebsocketChatPool:
+        key = (bot_id, workflow_id)
+        async with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = WebsocketChatPool(
+                    self.coze, bot_id, workflow_id, **self.pool_kwargs
+                )
+                await pool.start()
+                self._pools[key] = pool
+            return pool
+
+    async def close(self):
+        async with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        await asyncio.gather(*[pool.close() for pool in pools])
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0, "p50": 0.0, "p99": 0.0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": values[len(values) // 2],
+        "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+    }
+
+
+def format_pool_stats(stats: dict) -> str:
+    def ms(name):
+        return f"p50 {stats[name]['p50']:.1f}ms p99 {stats[name]['p99']:.1f}ms"
+
+    return (
+        f"连接 {stats['size']} 个 (空闲 {stats['idle']}), 新建 {stats['connects']} 次, "
+        f"复用 {stats['reuses']} 次, 淘汰 {stats['evicted']} 次, "
+        f"跳过重复的 chat_update {stats['config_skipped']} 次\n"
+        f"  建立连接 {ms('connect_ms')}, 获取连接 {ms('acquire_ms')}, "
+        f"首段语音 {ms('ttfa_ms')}, 从获取连接到首段语音 {ms('session_ttfa_ms')}"
+    )
+
+
+# 性能测试: 同一段语音连续对话 rounds 次, 对比每次新建连接和使用连接池的耗时
+async def benchmark(
+    token: str,
+    api_base: str,
+    ws_base_url: Optional[str],
+    bot_id: str,
+    workflow_id: Optional[str],
+    audio_path: str,
+    rounds: int,
+    concurrency: int,
+):
+    from cozepy import TokenAuth
+
+    from audio_uplink import AudioUplink, WavAudioSource
+
+    coze = AsyncCoze(auth=TokenAuth(token), base_url=api_base)
+    config = ChatUpdateEvent.Data.model_validate(
+        {"chat_config": ChatUpdateEvent.ChatConfig.model_validate({})}
+    )
+
+    async def utterance(conn: PooledChatConnection, source: WavAudioSource):
+        # 不按真实说话速度发送, 只比较连接和回复的耗时
+        uplink = AudioUplink(conn.client, realtime=False)
+        await uplink.send(source.chunks(), source.bytes_per_second)
+        await conn.complete_input()
+        await conn.client.wait()
+
+    async def run(pool: WebsocketChatPool, fresh: bool):
+        with WavAudioSource(audio_path) as source:
+
+            async def one():
+                start = time.monotonic()
+                async with pool.session(config=config) as conn:
+                    await utterance(conn, source)
+                    if fresh:
+                        # 每次新建连接: 用完后关闭, 不放回池中
+                        conn.closed = True
+                return (time.monotonic() - start) * 1000
+
+            latencies = []
+            start = time.monotonic()
+            for _ in range(rounds // concurrency):
+                latencies += await asyncio.gather(*[one() for _ in range(concurrency)])
+            total = time.monotonic() - start
+        return percentiles(latencies), len(latencies) / total
+
+    for name, fresh in (("每次新建连接", True), ("使用连接池", False)):
+        pool = WebsocketChatPool(
+            coze,
+            bot_id,
+            workflow_id,
+            min_size=0 if fresh else concurrency,
+            max_size=concurrency,
+            ws_base_url=ws_base_url,
+            # 同一段语音连续对话, 相当于同一个用户, 沿用连接上的对话
+            share_conversation=True,
+        )
+        await pool.start()
+        latency, throughput = await run(pool, fresh)
+        print(
+            f"{name}: 单次对话 p50 {latency['p50']:.1f}ms p99 {latency['p99']:.1f}ms, "
+            f"{throughput:.1f} 次/秒"
+        )
+        print(f"  {format_pool_stats(pool.stats())}")
+        await pool.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from cozepy import COZE_CN_BASE_URL
+
+    parser = argparse.ArgumentParser(description="websocket 对话连接池性能测试")
+    parser.add_argument("--ws-base-url", default=None, help="如 ws://127.0.0.1:8098")
+    parser.add_argument("--audio", default="./input_audio.wav")
+    parser.add_argument("--rounds", default=20, type=int)
+    parser.add_argument("--concurrency", default=1, type=int)
+    args = parser.parse_args()
+    asyncio.run(
+        benchmark(
+            os.getenv("COZE_API_TOKEN") or "mock",
+            COZE_CN_BASE_URL,
+            args.ws_base_url,
+            os.getenv("COZE_BOT_ID") or "mock",
+            os.getenv("COZE_WORKFLOW_ID"),
+            args.audio,
+            args.rounds,
+            args.concurrency,
+        )
+    )
@@ -1,7 +1,9 @@
-import base64
 import logging
 import os
 import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 from cozepy import (
     COZE_CN_BASE_URL,
@@ -9,49 +11,104 @@ from cozepy import (
     TokenAuth,
     Message,
     MessageObjectString,
+    ChatEvent,
     ChatEventType,
+    File,
+    Stream,
     setup_logging,
 )
-from cozepy.util import write_pcm_to_wav_file
+
+from audio_sink import WavStreamSink
+from cassette import CassetteRecorder
+from upload_cache import UploadCache, upload_cache_namespace
 
 setup_logging(logging.ERROR)
 
 
-# 主脚本
-def run_app(api_base: str, token: str, bot_id: str, audio_path: str, image_path: str):
+# 处理返回的 sse 事件流, 打印文字, 语音边收边写入 wav 文件, 返回语音时长
+def handle_coze_stream(
+    stream: Stream[ChatEvent], wav_audio_path: str, verbose: bool = True
+) -> float:
+    with WavStreamSink(wav_audio_path) as sink:
+        for event in stream:
+            if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                # 当事件类型是 conversation.message.delta, 打印到控制台
+                if verbose:
+                    print(event.message.content, end="", flush=True)
+            elif event.event == ChatEventType.CONVERSATION_AUDIO_DELTA:
+                sink.write_base64(event.message.content)
+    if verbose:
+        print(f"\n保存返回语音到: {wav_audio_path}, 时长 {sink.duration:.1f}s")
+    return sink.duration
+
+
+# 并发上传对话中的附件 (语音、图片), 所有附件都上传完成后返回, 顺序和 paths 一致
+def upload_attachments(
+    coze: Coze, upload_cache: UploadCache, paths: List[str]
+) -> List[File]:
+    def upload(path: str):
+        start = time.perf_counter()
+        file = upload_cache.upload(coze, path)
+        return file, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        results = list(pool.map(upload, paths))
+    for path, (file, cost) in zip(paths, results):
+        # 命中缓存的文件没有发起请求, 没有 logid
+        logid = file.response.logid if file._raw_response else "命中缓存"
+        print(
+            f"上传 {os.path.basename(path)}: {file.id}, 耗时 {cost:.0f}ms, logid: {logid}"
+        )
+    print(
+        f"上传 {len(paths)} 个附件, 总耗时 {(time.perf_counter() - start) * 1000:.0f}ms"
+    )
+    return [file for file, _ in results]
+
+
+# 用户的问题: 一张图片和一段语音
+def build_question(audio_file: File, image_file: File) -> Message:
+    return Message.build_user_question_objects(
+        [
+            MessageObjectString.build_image(file_id=image_file.id),
+            MessageObjectString.build_audio(file_id=audio_file.id),
+        ]
+    )
+
+
+# 主脚本, 回复的语音写入 output_path
+# record_path 不为空时把返回的事件流录制到这个文件, 可以用 cassette.py 回放
+def run_app(
+    api_base: str,
+    token: str,
+    bot_id: str,
+    audio_path: str,
+    image_path: str,
+    record_path: Optional[str] = None,
+    output_path: str = "./output_http_audio.wav",
+):
     coze = Coze(auth=TokenAuth(token), base_url=api_base)
+    upload_cache = UploadCache(namespace=upload_cache_namespace(api_base, token))
 
-    # 将语音和图片上传到 coze
-    audio_file = coze.files.upload(file=audio_path)
-    image_file = coze.files.upload(file=image_path)
+    # 将语音和图片同时上传到 coze, 之前上传过的相同文件直接使用缓存的 file id
+    audio_file, image_file = upload_attachments(
+        coze, upload_cache, [audio_path, image_path]
+    )
 
     # 调用 /v3/chat 发起对话, 传入语音和图片的 file id
     stream = coze.chat.stream(
         bot_id=bot_id,
         user_id=secrets.token_urlsafe(),
-        additional_messages=[
-            Message.build_user_question_objects(
-                [
-                    MessageObjectString.build_image(file_id=image_file.id),
-                    MessageObjectString.build_audio(file_id=audio_file.id),
-                ]
-            )
-        ],
+        additional_messages=[build_question(audio_file, image_file)],
     )
     print(f"对话开始 logid: {stream.response.logid}")
 
-    # 处理返回的 sse 事件流
-    pcm_datas = b""
-    for event in stream:
-        if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
-            # 当事件类型是 conversation.message.delta, 打印到控制台
-            print(event.message.content, end="", flush=True)
-        elif event.event == ChatEventType.CONVERSATION_AUDIO_DELTA:
-            pcm_datas += base64.b64decode(event.message.content)
-
-    wav_audio_path = os.path.join("./output_http_audio.wav")
-    write_pcm_to_wav_file(pcm_datas, wav_audio_path)
-    print(f"\n保存返回语音到: {wav_audio_path}")
+    if not record_path:
+        handle_coze_stream(stream, output_path)
+        return
+    with CassetteRecorder(record_path, "sse", logid=stream.response.logid) as recorder:
+        handle_coze_stream(recorder.record_stream(stream), output_path)
+    print(f"录制 {recorder.events} 个事件到: {record_path}")
 
 
 # 主入口
@@ -67,5 +124,7 @@ if __name__ == "__main__":
     # 使用本地的文件来使用语音对话+图片识别
     audio_path = "./input_audio.wav"
     image_path = "./input_coze.png"
+    # 设置 COZE_RECORD_PATH 时录制返回的事件流
+    record_path = os.getenv("COZE_RECORD_PATH")
     # 运行脚本
-    run_app(coze_api_base, coze_token, coze_bot_id, audio_path, image_path)
+    run_app(coze_api_base, coze_token, coze_bot_id, audio_path, image_path, record_path)
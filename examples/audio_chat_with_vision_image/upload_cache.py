@@ -0,0 +1,245 @@
+# 文件上传缓存: 按文件内容的 sha256 缓存扣子返回的 file id, 相同内容的文件不会重复上传
+#
+# 缓存保存在本地 json 文件中, 超过有效期的记录会被清理; 多个线程(或协程)同时上传相同内容时,
+# 只有一个会真正调用 files.upload, 其他的等待并复用它的结果
+#
+# 可以通过环境变量配置:
+#
+#     COZE_UPLOAD_CACHE_PATH: 缓存文件路径, 默认 ./.coze_upload_cache.json, 设置为空时只缓存在内存中
+#     COZE_UPLOAD_CACHE_TTL: 缓存有效期, 秒, 默认 7 天
+#
+# 性能测试:
+#
+#     python upload_cache.py --concurrency 20 --latency 0.2
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple, Union
+
+from cozepy import AsyncCoze, Coze, File
+
+COZE_UPLOAD_CACHE_PATH = os.getenv(
+    "COZE_UPLOAD_CACHE_PATH", "./.coze_upload_cache.json"
+)
+COZE_UPLOAD_CACHE_TTL = float(os.getenv("COZE_UPLOAD_CACHE_TTL", str(7 * 24 * 3600)))
+
+UPLOAD_HASH_CHUNK_BYTES = 1024 * 1024  # 计算本地文件哈希时每次读取的字节数
+
+# 上传内容: 本地文件路径、bytes 或 (文件名, bytes)
+UploadContent = Union[str, bytes, Tuple[str, bytes]]
+
+
+# 返回上传内容的文件名和 sha256, 本地文件分块读取, 不会把整个文件读入内存
+def hash_upload_content(file: UploadContent) -> Tuple[str, str]:
+    if isinstance(file, str):
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        return os.path.basename(file), digest.hexdigest()
+    name, data = file if isinstance(file, tuple) else ("file", file)
+    return name, hashlib.sha256(data).hexdigest()
+
+
+# 打开上传内容, 本地文件以文件对象的形式交给 files.upload, 由 httpx 边读边发送
+@contextlib.contextmanager
+def open_upload_content(name: str, file: UploadContent):
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            yield name, f
+    else:
+        yield name, file[1] if isinstance(file, tuple) else file
+
+
+# 不同的扣子地址和令牌上传的文件不能互相使用, 用它们的哈希区分缓存
+def upload_cache_namespace(api_base: str, token: str) -> str:
+    return hashlib.sha256(f"{api_base}\n{token}".encode("utf-8")).hexdigest()[:16]
+
+
+class UploadCache:
+    def __init__(
+        self,
+        path: Optional[str] = COZE_UPLOAD_CACHE_PATH,
+        ttl: float = COZE_UPLOAD_CACHE_TTL,
+        namespace: str = "",
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.uploads = 0
+        self._lock = threading.Lock()
+        # 缓存的文件信息: key -> {"id", "file_name", "bytes", "created_at", "cached_at"}
+        self._entries: Dict[str, dict] = self._load()
+        # 正在上传的文件, 同一个 key 只上传一次
+        self._inflight: Dict[str, Future] = {}
+        self._async_inflight: Dict[str, asyncio.Future] = {}
+
+    def key(self, name: str, digest: str) -> str:
+        # 文件名会影响扣子识别的文件类型, 也作为 key 的一部分
+        return f"{self.namespace}:{digest}:{os.path.splitext(name)[1].lower()}"
+
+    def get(self, key: str) -> Optional[File]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["cached_at"] > self.ttl:
+                del self._entries[key]
+                return None
+            self.hits += 1
+        return File(**{k: v for k, v in entry.items() if k != "cached_at"})
+
+    def put(self, key: str, file: File):
+        with self._lock:
+            self._entries[key] = {**file.model_dump(), "cached_at": time.time()}
+            self._save()
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    # 上传文件, 命中缓存时直接返回缓存的文件信息
+    def upload(self, coze: Coze, file: UploadContent) -> File:
+        name, digest = hash_upload_content(file)
+        key = self.key(name, digest)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            with open_upload_content(name, file) as content:
+                uploaded = coze.files.upload(file=content)
+            self.uploads += 1
+            self.put(key, uploaded)
+            future.set_result(uploaded)
+            return uploaded
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # AsyncCoze 版本的 upload, 计算哈希在线程中执行, 不阻塞事件循环
+    async def async_upload(self, coze: AsyncCoze, file: UploadContent) -> File:
+        name, digest = await asyncio.to_thread(hash_upload_content, file)
+        key = self.key(name, digest)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        future = self._async_inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            with open_upload_content(name, file) as content:
+                uploaded = await coze.files.upload(file=content)
+            self.uploads += 1
+            await asyncio.to_thread(self.put, key, uploaded)
+            future.set_result(uploaded)
+            return uploaded
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 没有其他等待者时, 避免 "exception was never retrieved"
+            raise
+        finally:
+            del self._async_inflight[key]
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        now = time.time()
+        return {k: v for k, v in entries.items() if now - v["cached_at"] <= self.ttl}
+
+    # 写入缓存文件前合并其他进程写入的记录并清理过期记录, 先写临时文件再替换, 避免文件写一半
+    def _save(self):
+        if not self.path:
+            return
+        for key, entry in self._load().items():
+            if entry["cached_at"] > self._entries.get(key, {}).get("cached_at", 0):
+                self._entries[key] = entry
+        now = time.time()
+        self._entries = {
+            k: v for k, v in self._entries.items() if now - v["cached_at"] <= self.ttl
+        }
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.path)
+
+
+# 性能测试: 模拟上传耗时, 对比每次都上传和使用缓存的耗时
+def benchmark(concurrency: int, latency: float, size: int, rounds: int):
+    from concurrent.futures import ThreadPoolExecutor
+
+    class FakeFiles:
+        def __init__(self):
+            self.calls = 0
+            self.lock = threading.Lock()
+
+        def upload(self, file):
+            with self.lock:
+                self.calls += 1
+                file_id = f"file_{self.calls}"
+            time.sleep(latency)
+            return File(id=file_id, bytes=len(file[1]), file_name=file[0])
+
+    class FakeCoze:
+        files = FakeFiles()
+
+    data = os.urandom(size)
+    coze = FakeCoze()
+    cache = UploadCache(path=None)
+
+    def run(name, f):
+        coze.files.calls = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            with ThreadPoolExecutor(concurrency) as pool:
+                ids = set(pool.map(lambda _: f().id, range(concurrency)))
+        cost = (time.perf_counter() - start) * 1000
+        print(
+            f"  {name}: 耗时 {cost:8.1f}ms, 上传 {coze.files.calls:4d} 次, "
+            f"最后一轮 file id {len(ids)} 个"
+        )
+
+    print(
+        f"{rounds} 轮, 每轮 {concurrency} 个并发上传相同的 {size // 1024}KB 文件, "
+        f"上传耗时 {latency * 1000:.0f}ms"
+    )
+    run("不使用缓存", lambda: coze.files.upload(file=("input.png", data)))
+    run("使用缓存", lambda: cache.upload(coze, ("input.png", data)))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="文件上传缓存性能测试")
+    parser.add_argument("--concurrency", default=20, type=int)
+    parser.add_argument("--latency", default=0.2, type=float, help="模拟的上传耗时, 秒")
+    parser.add_argument("--size", default=1024 * 1024, type=int)
+    parser.add_argument("--rounds", default=3, type=int)
+    args = parser.parse_args()
+    benchmark(args.concurrency, args.latency, args.size, args.rounds)
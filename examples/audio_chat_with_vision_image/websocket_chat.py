@@ -2,6 +2,7 @@ import asyncio
 import json
 import logging
 import os
+from typing import Optional
 
 from cozepy import (
     COZE_CN_BASE_URL,
@@ -9,7 +10,6 @@ from cozepy import (
     AsyncCoze,
     AsyncWebsocketsChatEventHandler,
     AsyncWebsocketsChatClient,
-    InputAudioBufferAppendEvent,
     ChatUpdateEvent,
     ConversationChatCreatedEvent,
     ConversationMessageDeltaEvent,
@@ -17,13 +17,23 @@ from cozepy import (
     ConversationChatCompletedEvent,
 )
 from cozepy.log import log_info, setup_logging
-from cozepy.util import write_pcm_to_wav_file
+
+from audio_sink import AsyncWavStreamSink
+from audio_uplink import AudioUplink, WavAudioSource, format_uplink_stats
+from cassette import CassetteRecorder
+from upload_cache import UploadCache, upload_cache_namespace
 
 setup_logging(logging.ERROR)
 
 
+# 每个 websocket 连接使用一个 handler, 返回的语音写入这个连接自己的 wav 文件
 class WebsocketsChatEventHandler(AsyncWebsocketsChatEventHandler):
-    delta = []
+    def __init__(
+        self, output_path: str = "./output_ws_audio.wav", verbose: bool = True
+    ):
+        self.output_path = output_path
+        self.verbose = verbose
+        self.sink: Optional[AsyncWavStreamSink] = None
 
     async def on_error(self, cli: AsyncWebsocketsChatClient, e: Exception):
         import traceback
@@ -34,34 +44,43 @@ class WebsocketsChatEventHandler(AsyncWebsocketsChatEventHandler):
     async def on_conversation_chat_created(
         self, cli: AsyncWebsocketsChatClient, event: ConversationChatCreatedEvent
     ):
-        print(f"对话开始 logid: {event.detail.logid}")
+        if self.verbose:
+            print(f"对话开始 logid: {event.detail.logid}")
 
     async def on_conversation_message_delta(
         self, cli: AsyncWebsocketsChatClient, event: ConversationMessageDeltaEvent
     ):
-        print(event.data.content, end="", flush=True)
+        if self.verbose:
+            print(event.data.content, end="", flush=True)
 
     async def on_conversation_audio_delta(
         self, cli: AsyncWebsocketsChatClient, event: ConversationAudioDeltaEvent
     ):
-        self.delta.append(event.data.get_audio())
+        # 收到第一段语音时创建 sink, 写文件在后台线程中进行
+        if self.sink is None:
+            self.sink = AsyncWavStreamSink(self.output_path)
+        self.sink.write(event.data.get_audio())
 
     async def on_conversation_chat_completed(
         self, cli: "AsyncWebsocketsChatClient", event: ConversationChatCompletedEvent
     ):
-        wav_audio_path = os.path.join("./output_ws_audio.wav")
-        write_pcm_to_wav_file(b"".join(self.delta), wav_audio_path)
-        print(f"\n保存返回语音到: {wav_audio_path}")
+        duration = await self.close_sink()
+        if self.verbose:
+            print(f"\n保存返回语音到: {self.output_path}, 时长 {duration:.1f}s")
 
+    async def on_closed(self, cli: "AsyncWebsocketsChatClient"):
+        # 对话没有正常结束时, 也要关闭文件并释放缓冲区
+        await self.close_sink()
 
-def split_bytes_by_length(data, length):
-    res = []
-    for i in range(0, len(data), length):
-        res.append(data[i : i + length])
-    return res
+    async def close_sink(self) -> float:
+        sink, self.sink = self.sink, None
+        if sink is None:
+            return 0.0
+        await sink.close()
+        return sink.duration
 
 
-# 主脚本
+# 主脚本, record_path 不为空时把 websocket 收到的事件录制到这个文件, 可以用 cassette.py 回放
 async def run_app(
     api_base: str,
     token: str,
@@ -69,55 +88,61 @@ async def run_app(
     workflow_id: str,
     audio_path: str,
     image_path: str,
+    output_path: str = "./output_ws_audio.wav",
+    record_path: Optional[str] = None,
 ):
     coze = AsyncCoze(auth=TokenAuth(token), base_url=api_base)
+    upload_cache = UploadCache(namespace=upload_cache_namespace(api_base, token))
 
-    # 将图片上传到 coze
-    image_file = await coze.files.upload(file=image_path)
+    # 将图片上传到 coze, 之前上传过的相同图片直接使用缓存的 file id
+    image_file = await upload_cache.async_upload(coze, image_path)
     print(f"图片上传结果 {image_file.id}")
-    # 低于语音数据
-    with open(audio_path, "rb") as f:
-        audio_data = f.read()
 
     chat = coze.websockets.chat.create(
         bot_id=bot_id,
         workflow_id=workflow_id,
-        on_event=WebsocketsChatEventHandler(),
+        on_event=WebsocketsChatEventHandler(output_path),
     )
-
-    # 建立 websocket 链接
-    async with chat() as client:
-        print("建立 websocket 链接成功")
-        # 发送 chat_flow 参数
-        await client.chat_update(
-            ChatUpdateEvent.Data.model_validate(
-                {
-                    "chat_config": ChatUpdateEvent.ChatConfig.model_validate(
-                        {
-                            "parameters": {
-                                "image": json.dumps(
-                                    {
-                                        "file_id": image_file.id,
-                                    }
-                                ),
-                            }
-                        }
-                    )
-                }
-            )
-        )
-        # 发送语音数据
-        for delta in split_bytes_by_length(audio_data, 1024):
-            await client.input_audio_buffer_append(
-                InputAudioBufferAppendEvent.Data.model_validate(
+    recorder = None
+    if record_path:
+        recorder = CassetteRecorder(record_path, "ws", bot_id=bot_id)
+        recorder.record_websocket(chat)
+
+    try:
+        # 建立 websocket 链接
+        async with chat() as client:
+            print("建立 websocket 链接成功")
+            # 发送 chat_flow 参数
+            await client.chat_update(
+                ChatUpdateEvent.Data.model_validate(
                     {
-                        "delta": delta,
+                        "chat_config": ChatUpdateEvent.ChatConfig.model_validate(
+                            {
+                                "parameters": {
+                                    "image": json.dumps(
+                                        {
+                                            "file_id": image_file.id,
+                                        }
+                                    ),
+                                }
+                            }
+                        )
                     }
                 )
             )
-            await asyncio.sleep(len(delta) * 1.0 / 24000 / 2)  # 模拟真实说话间隔
-        await client.input_audio_buffer_complete()
-        await client.wait()
+            # 按 wav 文件头中的采样率, 以真实说话的速度发送语音数据
+            with WavAudioSource(audio_path) as source:
+                stats = await AudioUplink(client).send(
+                    source.chunks(), source.bytes_per_second
+                )
+                await client.input_audio_buffer_complete()
+                print(format_uplink_stats(stats))
+                await client.wait()
+    finally:
+        # 对话异常结束时也要关闭录制文件, 保留已经收到的事件
+        if recorder:
+            recorder.close()
+            print(f"录制 {recorder.events} 个事件到: {record_path}")
 
 
 # main 入口异步函数
@@ -136,9 +161,17 @@ async def main():
     # 使用本地的文件来使用语音对话+图片识别
     audio_path = "./input_audio.wav"
     image_path = "./input_coze.png"
+    # 设置 COZE_RECORD_PATH 时录制返回的事件流
+    record_path = os.getenv("COZE_RECORD_PATH")
     # 运行脚本
     await run_app(
-        coze_api_base, coze_token, coze_bot_id, coze_workflow_id, audio_path, image_path
+        coze_api_base,
+        coze_token,
+        coze_bot_id,
+        coze_workflow_id,
+        audio_path,
+        image_path,
+        record_path=record_path,
     )
 
 
@@ -0,0 +1,564 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+from functools import wraps
+
+import httpx
+from cozepy import (
+    AsyncCoze,
+    AsyncJWTAuth,
+    AsyncJWTOAuthApp,
+    AsyncPKCEOAuthApp,
+    COZE_CN_BASE_URL,
+)
+from dotenv import load_dotenv
+from quart import (
+    Blueprint,
+    Quart,
+    render_template,
+    request,
+    redirect,
+    url_for,
+    Response,
+    jsonify,
+)
+
+# 几个渠道示例共用的代码在上一级目录: connector_common.py 和审核引擎 audit.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit import KeywordAuditEngine  # noqa: E402
+from connector_common import (  # noqa: E402
+    AsyncAccessTokenManager,
+    BotInfoCache,
+    BotStore,
+    CozeCallbackHandler,
+    MemoryTokenStore,
+    RequestLogger,
+    SQLiteBotStore,
+    SQLiteTokenStore,
+    TokenStore,
+    handle_bot_published_event,
+    merge_bot_infos,
+    setup_logging,
+)
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_ENABLED = True  # 安装了 h2 时使用 http/2 访问扣子
+except ImportError:
+    HTTP2_ENABLED = False
+
+# 加载 .env 文件, 用户可以自行修改 .env
+load_dotenv()
+
+app = Quart(__name__)
+app.secret_key = os.urandom(24)
+
+
+# 配置日志
+LOG_MODE = os.getenv("LOG_MODE", "async")  # async: 后台线程输出日志; sync: 直接输出
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))  # 请求日志采样率, 0~1
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "4096"))  # body 截断长度
+setup_logging(LOG_MODE)
+logger = logging.getLogger(__name__)
+request_logger = RequestLogger(logger, LOG_SAMPLE_RATE, LOG_BODY_MAX_BYTES)
+
+# 渠道类型, 决定注册哪些路由, 分别对应同目录下三个 Flask 版本的示例
+# none_auth: 无需授权; oauth: OAuth 授权; device_bind: 设备绑定
+CONNECTOR_MODE = os.getenv("CONNECTOR_MODE", "none_auth")
+# 渠道 id
+CONNECTOR_ID = os.getenv("CONNECTOR_ID")  # 渠道 id
+CONNECTOR_PKCE_CLIENT_ID = os.getenv("CONNECTOR_PKCE_CLIENT_ID")  # 渠道 pkce client id
+# OAuth 配置
+CONNECTOR_CLIENT_ID = os.getenv(
+    "CONNECTOR_CLIENT_ID"
+)  # 渠道分配给扣子的 oauth client_id
+CONNECTOR_CLIENT_SECRET = os.getenv(
+    "CONNECTOR_CLIENT_SECRET"
+)  # 渠道分配给扣子的 oauth client_secret
+CONNECTOR_USER_ID = os.getenv("CONNECTOR_USER_ID")  # oauth 后渠道的用户 uid
+CONNECTOR_USER_NAME = os.getenv("CONNECTOR_USER_NAME")  # oauth 后渠道的用户 name
+# 扣子的配置
+COZE_CALLBACK_TOKEN = os.getenv("COZE_CALLBACK_TOKEN")  # 扣子回调 token
+# 回调时间戳允许的误差(秒), 以及回调去重缓存的条数
+COZE_CALLBACK_MAX_SKEW = int(os.getenv("COZE_CALLBACK_MAX_SKEW", "300"))
+COZE_CALLBACK_DEDUP_SIZE = int(os.getenv("COZE_CALLBACK_DEDUP_SIZE", "10000"))
+COZE_API_BASE = os.getenv("COZE_API_BASE", COZE_CN_BASE_URL)  # 可指向本地模拟服务压测
+# 访问扣子 API 的连接池配置
+COZE_HTTP_MAX_CONNECTIONS = int(os.getenv("COZE_HTTP_MAX_CONNECTIONS", "100"))
+COZE_HTTP_MAX_KEEPALIVE = int(os.getenv("COZE_HTTP_MAX_KEEPALIVE", "20"))
+COZE_HTTP_TIMEOUT = float(os.getenv("COZE_HTTP_TIMEOUT", "10"))  # 秒
+COZE_HTTP_MAX_RETRIES = int(os.getenv("COZE_HTTP_MAX_RETRIES", "3"))
+# 服务静态配置
+AUDIT_TERMS_FILE = os.getenv("AUDIT_TERMS_FILE", "audit_terms.txt")  # 敏感词文件
+BOTS_FILE = "bots.json"  # 旧版本存储 bot 信息的文件, 启动时会迁移到 BOTS_DB_FILE
+BOTS_DB_FILE = "bots.db"  # 存储 bot 信息的 sqlite 数据库
+OAUTH_STORE = os.getenv("OAUTH_STORE", "sqlite")  # 授权码和 token 存储: memory/sqlite
+OAUTH_DB_FILE = "oauth.db"  # 多进程部署时共享授权码和 token 的 sqlite 数据库
+OAUTH_CODE_TTL = 300  # 授权码有效期, 秒
+OAUTH_TOKEN_TTL = 3600  # access_token 有效期, 秒
+BOT_INFO_CACHE_TTL = int(os.getenv("BOT_INFO_CACHE_TTL", "600"))  # bot 信息缓存时间, 秒
+BOT_INFO_FETCH_WORKERS = int(os.getenv("BOT_INFO_FETCH_WORKERS", "8"))  # 并发拉取数
+ACCESS_TOKEN_TTL = 86399  # 渠道 access_token 的有效期, 秒
+ACCESS_TOKEN_REFRESH_BEFORE = 600  # access_token 过期前多少秒开始后台刷新
+COZE_OAUTH_CONFIG_PATH = "coze_oauth_config.json"  # jwt oauth 配置文件
+
+app.jinja_env.globals["connector_mode"] = CONNECTOR_MODE
+
+
+# 基于配置文件加载 coze oauth jwt app
+def load_coze_oauth_app(config_path) -> AsyncJWTOAuthApp:
+    try:
+        with open(config_path, "r") as file:
+            config = json.loads(file.read())
+        if config.get("client_type") != "jwt":
+            raise ValueError(f"不支持的 client_type: {config.get('client_type')}")
+        return AsyncJWTOAuthApp(
+            client_id=config.get("client_id", ""),
+            private_key=config.get("private_key", ""),
+            public_key_id=config.get("public_key_id", ""),
+            base_url=config.get("coze_api_base") or COZE_API_BASE,
+        )
+    except FileNotFoundError:
+        raise Exception("配置不存在")
+    except Exception as e:
+        raise Exception(f"加载 OAuth 失败: {str(e)}")
+
+
+# 日志装饰器, 采样和脱敏见 connector_common.RequestLogger
+def log_request_response(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        sampled = request_logger.sampled()
+        if sampled:
+            request_logger.log_request(
+                request.method,
+                request.url,
+                request.args.to_dict(),
+                (await request.form).to_dict(),
+                await request.get_data(),
+            )
+
+        # 执行原始函数, 并记录耗时
+        start = time.perf_counter()
+        response = await f(*args, **kwargs)
+        cost_ms = (time.perf_counter() - start) * 1000
+
+        if sampled:
+            body, code = RequestLogger.split_response(response, Response)
+            if isinstance(body, Response):
+                body = await body.get_data()
+            request_logger.log_response(f.__name__, code, cost_ms, body)
+
+        return response
+
+    return decorated_function
+
+
+# 渠道的扣子客户端和 oauth 客户端
+connector_oauth_app = load_coze_oauth_app(COZE_OAUTH_CONFIG_PATH)
+connector_pkce_oauth_app = AsyncPKCEOAuthApp(
+    client_id=CONNECTOR_PKCE_CLIENT_ID or "", base_url=COZE_API_BASE
+)
+connector_coze = AsyncCoze(
+    auth=AsyncJWTAuth(oauth_app=connector_oauth_app, ttl=ACCESS_TOKEN_TTL),
+    base_url=COZE_API_BASE,
+)
+
+# 进程内共享的扣子 http 客户端, 复用 keep-alive 连接, 连接失败时自动重连
+coze_http_client = httpx.AsyncClient(
+    base_url=COZE_API_BASE,
+    timeout=httpx.Timeout(COZE_HTTP_TIMEOUT),
+    transport=httpx.AsyncHTTPTransport(
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=COZE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=COZE_HTTP_MAX_KEEPALIVE,
+        ),
+        retries=COZE_HTTP_MAX_RETRIES,
+    ),
+)
+
+
+# 服务退出时关闭连接池
+@app.after_serving
+async def close_coze_http_client():
+    await coze_http_client.aclose()
+
+
+bot_info_cache = BotInfoCache(BOT_INFO_CACHE_TTL)
+# 限制拉取 bot 信息时对扣子的并发请求数
+bot_info_semaphore = asyncio.Semaphore(BOT_INFO_FETCH_WORKERS)
+
+
+# 渠道的 access_token, 快过期时在后台刷新, 见 connector_common.AsyncAccessTokenManager
+connector_token_manager = AsyncAccessTokenManager(
+    connector_oauth_app, ACCESS_TOKEN_TTL, ACCESS_TOKEN_REFRESH_BEFORE
+)
+
+
+bot_store: BotStore = SQLiteBotStore(BOTS_DB_FILE)
+bot_store.migrate_from_json(BOTS_FILE)
+
+
+# 加载已经发布的 bot 数据
+async def load_bots(offset=0, limit=None):
+    return await asyncio.to_thread(bot_store.list, offset, limit)
+
+
+oauth_store: TokenStore = (
+    MemoryTokenStore() if OAUTH_STORE == "memory" else SQLiteTokenStore(OAUTH_DB_FILE)
+)
+
+
+# 从扣子拉取 bot 的描述和头像, 并写入缓存
+async def fetch_bot_info(bot_id):
+    async with bot_info_semaphore:
+        bot_info = await connector_coze.bots.retrieve(bot_id=bot_id)
+    return bot_info_cache.set_bot(bot_id, bot_info)
+
+
+# 在后台刷新 bot 信息缓存, 失败只记录日志, 下次打开 bots 页面时会重新拉取
+async def refresh_bot_info(bot_id):
+    try:
+        await fetch_bot_info(bot_id)
+    except Exception as e:
+        logger.warning(f"刷新 bot 信息缓存失败: {bot_id}, {e}")
+
+
+# 加载已经发布的 bot 数据, 并且拉取头像等数据
+async def load_bot_and_info(offset=0, limit=None):
+    bots = await load_bots(offset, limit)
+    # 只拉取没有命中缓存的 bot, 并发请求扣子
+    infos, missed = bot_info_cache.get_many([bot["bot_id"] for bot in bots])
+    fetched = await asyncio.gather(*[fetch_bot_info(bot_id) for bot_id in missed])
+    infos.update(zip(missed, fetched))
+    return merge_bot_infos(bots, infos)
+
+
+# 请求扣子 API, 遇到 429 和 5xx 时按 Retry-After 或指数退避重试
+async def coze_api_request(method: str, path: str, **kwargs) -> httpx.Response:
+    for attempt in range(COZE_HTTP_MAX_RETRIES + 1):
+        response = await coze_http_client.request(method, path, **kwargs)
+        if response.status_code != 429 and response.status_code < 500:
+            return response
+        if attempt == COZE_HTTP_MAX_RETRIES:
+            break
+        retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else 0.2 * 2**attempt
+        logger.warning(f"请求扣子 {path} 失败: {response.status_code}, {delay}s 后重试")
+        await asyncio.sleep(delay)
+    return response
+
+
+async def update_coze_device(
+    connector_id: str, token: str, device_id: str, device_name: str
+):
+    url = f"/v1/connectors/{connector_id}/user_configs"
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    data = {
+        "configs": [
+            {"key": "device_id", "enums": [{"value": device_id, "label": device_name}]}
+        ]
+    }
+
+    response = await coze_api_request("POST", url, json=data, headers=headers)
+    if response.status_code >= 400:
+        logid = response.headers.get("x-tt-logid")
+        raise Exception(f"同步设备失败: {logid}, resp: {response.text}")
+
+
+async def get_coze_user_info(pkce_token: str):
+    url = "/v1/users/me"
+    headers = {
+        "Authorization": f"Bearer {pkce_token}",
+    }
+    response = await coze_api_request("GET", url, headers=headers)
+    response.raise_for_status()
+    # user_id, user_name, nick_name, avatar_url
+    return response.json()["data"]
+
+
+# 回调的验签、防重放和去重, 见 connector_common.CozeCallbackHandler
+coze_callback_handler = CozeCallbackHandler(
+    COZE_CALLBACK_TOKEN, COZE_CALLBACK_MAX_SKEW, COZE_CALLBACK_DEDUP_SIZE
+)
+
+
+# bot 发布审核引擎, 敏感词文件修改后自动重新加载
+audit_engine = KeywordAuditEngine(AUDIT_TERMS_FILE)
+
+
+# 首页路由, 302 到 bots 列表页
+@app.route("/")
+@log_request_response
+async def index():
+    return redirect(url_for("bots"))
+
+
+# bots 列表页, 展示所有已经发布的 bots 列表, 支持和 bot 聊天
+@app.route("/bots")
+@log_request_response
+async def bots():
+    # 支持 ?offset=0&limit=20 分页, 默认展示全部
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    bots, token = await asyncio.gather(
+        load_bot_and_info(offset, limit), connector_token_manager.get_access_token()
+    )
+    return await render_template("bots.html", bots=bots, token=token)
+
+
+# 服务的监控指标
+@app.route("/metrics")
+async def metrics():
+    return jsonify({"access_token": connector_token_manager.metrics()})
+
+
+# 在扣子发布智能体到渠道的时候, 扣子会给本接口推送一条 json 数据, 包含 bot 相关信息
+@app.route("/coze/callback", methods=["POST"])
+@log_request_response
+async def coze_callback():
+    callback = coze_callback_handler.begin(request.headers, await request.get_data())
+    if callback.result is None:
+        result = await handle_coze_event(callback.event)
+        coze_callback_handler.finish(callback, result)
+    return jsonify(callback.result[0]), callback.result[1]
+
+
+# 处理扣子推送的事件, 返回响应数据和状态码
+async def handle_coze_event(event):
+    # 审核和保存 bot 都是阻塞调用, 放到线程中执行, 不阻塞事件循环
+    result, bot_id = await asyncio.to_thread(
+        handle_bot_published_event, event, audit_engine, bot_store
+    )
+    if bot_id is not None:
+        # bot 重新发布后描述和头像可能变化, 异步刷新缓存, 不阻塞回调响应
+        app.add_background_task(refresh_bot_info, bot_id)
+    return result
+
+
+# OAuth 授权自定义渠道的路由, CONNECTOR_MODE=oauth 时注册
+oauth_bp = Blueprint("oauth", __name__)
+
+
+# oauth 授权页, 在扣子发布页面点击授权的时候, 会跳转到本页面
+@oauth_bp.route("/oauth/authorize", methods=["GET", "POST"])
+@log_request_response
+async def oauth_authorize():
+    if request.method == "GET":
+        # 验证必要参数
+        client_id = request.args.get("client_id")
+        redirect_uri = request.args.get("redirect_uri")
+        response_type = request.args.get("response_type")
+        state = request.args.get("state") or ""
+
+        if not all([client_id, redirect_uri, response_type]):
+            return jsonify({"code": 400, "message": "缺少必要参数"}), 400
+
+        if client_id != CONNECTOR_CLIENT_ID:
+            return jsonify({"code": 401, "message": "client_id 无效"}), 401
+
+        if response_type != "code":
+            return jsonify({"code": 400, "message": "response_type 必须为 code"}), 400
+
+        return await render_template(
+            "authorize.html",
+            client_id=client_id,
+            redirect_uri=redirect_uri,
+            response_type=response_type,
+            state=state,
+        )
+    else:
+        # 处理授权确认
+        form = await request.form
+        client_id = form.get("client_id")
+        redirect_uri = form.get("redirect_uri")
+        state = form.get("state")
+        action = form.get("action")
+
+        if action == "deny":
+            return await render_template("error.html")
+
+        # 生成授权码
+        code = secrets.token_urlsafe(16)
+
+        # 保存授权码, 在 /oauth/token 中校验
+        # 在实际应用中，这里还应该将授权码与用户信息关联
+        await asyncio.to_thread(
+            oauth_store.put,
+            f"code:{code}",
+            {"client_id": client_id, "redirect_uri": redirect_uri},
+            OAUTH_CODE_TTL,
+        )
+
+        return redirect(f"{redirect_uri}?code={code}&state={state}")
+
+
+# oauth code 换 token api, 扣子在发布页点击授权后同意授权后, 会携带
+# code302到扣子页面, 扣子会使用 code 访问本接口申请获取 access_token
+@oauth_bp.route("/oauth/token", methods=["POST"])
+@log_request_response
+async def oauth_token():
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"code": 400, "message": "请求参数错误"}), 400
+
+    # 验证必要参数
+    required_fields = ["client_id", "client_secret", "code", "grant_type"]
+    for field in required_fields:
+        if field not in data:
+            return jsonify({"code": 400, "message": f"缺少必要参数: {field}"}), 400
+
+    # 验证 client_id 和 client_secret
+    if (
+        data["client_id"] != CONNECTOR_CLIENT_ID
+        or data["client_secret"] != CONNECTOR_CLIENT_SECRET
+    ):
+        return jsonify({"code": 401, "message": "client_id 或 client_secret 无效"}), 401
+
+    # 验证 grant_type
+    if data["grant_type"] != "authorization_code":
+        return jsonify(
+            {"code": 400, "message": "grant_type 必须为 authorization_code"}
+        ), 400
+
+    # 验证授权码, 授权码只能使用一次
+    code_info = await asyncio.to_thread(oauth_store.pop, f"code:{data['code']}")
+    if not code_info or code_info["client_id"] != data["client_id"]:
+        return jsonify({"code": 400, "message": "code 无效或已过期"}), 400
+
+    # 生成 access_token
+    access_token = secrets.token_urlsafe(32)
+
+    # 保存 token, 在 /oauth/user 中校验
+    await asyncio.to_thread(
+        oauth_store.put,
+        f"token:{access_token}",
+        {"client_id": data["client_id"]},
+        OAUTH_TOKEN_TTL,
+    )
+
+    return jsonify(
+        {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "expires_in": OAUTH_TOKEN_TTL,
+        }
+    )
+
+
+# 在上一步获取到 access_token 后, 使用 access_token 换取
+# oauth 授权的用户信息, 扣子会绑定扣子用户和 oauth 授权用户
+@oauth_bp.route("/oauth/user", methods=["GET"])
+@log_request_response
+async def oauth_user():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return jsonify({"code": 401, "message": "未提供有效的访问令牌"}), 401
+
+    # 验证 access_token
+    access_token = auth_header.split(" ")[1]
+    if await asyncio.to_thread(oauth_store.get, f"token:{access_token}") is None:
+        return jsonify({"code": 401, "message": "访问令牌无效"}), 401
+
+    # 在实际应用中，这里应该验证 access_token 的有效性
+    # 并根据 access_token 获取对应的用户信息
+    return jsonify({"id": CONNECTOR_USER_ID, "name": CONNECTOR_USER_NAME})
+
+
+# 设备绑定自定义渠道的路由, CONNECTOR_MODE=device_bind 时注册
+device_bp = Blueprint("device", __name__)
+
+
+# 使用 pkce 授权获取到用户的 AccessToken
+@device_bp.route("/pkce_callback")
+@log_request_response
+async def pkce_callback():
+    redirect_uri = request.base_url
+    code = request.args.get("code")
+    code_verifier = request.args.get("state")
+    if not code or not code_verifier:
+        return jsonify({"message": "缺少授权码或 state"}), 400
+
+    try:
+        # 获取 token
+        token = await connector_pkce_oauth_app.get_access_token(
+            redirect_uri=redirect_uri, code=code, code_verifier=code_verifier
+        )
+        # 创建响应对象并设置 cookie
+        resp = redirect(url_for("device.devices") + "?auth_success=true")
+        resp.set_cookie(
+            "coze_pkce_access_token",
+            token.access_token,
+            max_age=token.expires_in - int(time.time()),
+            httponly=True,
+            secure=True,
+        )
+        return resp
+    except Exception as e:
+        return jsonify({"message": f"PKCE 授权失败: {str(e)}"}), 500
+
+
+# 用 cookie 中的 coze_pkce_access_token 获取用户信息
+@device_bp.route("/users_me")
+@log_request_response
+async def users_me():
+    # 从 cookie 中获取 token
+    token = request.cookies.get("coze_pkce_access_token")
+    if not token:
+        return jsonify({"message": "未登录"}), 401
+
+    try:
+        # 调用扣子 API 获取用户信息
+        user_info = await get_coze_user_info(token)
+        return jsonify(user_info), 200
+    except Exception as e:
+        return jsonify({"message": f"获取用户信息失败: {str(e)}"}), 500
+
+
+@device_bp.route("/devices")
+@log_request_response
+async def devices():
+    return await render_template("devices.html", client_id=CONNECTOR_PKCE_CLIENT_ID)
+
+
+# 通过调用扣子接口, 将设备 id 同步到扣子, 用户可以在发布页面点击配置选择对应的设备 id
+@device_bp.route("/sync_device", methods=["POST"])
+@log_request_response
+async def sync_device():
+    data = await request.get_json(silent=True)
+    if not data or "device_id" not in data or "device_name" not in data:
+        return jsonify({"message": "缺少必要参数"}), 400
+
+    device_id = data["device_id"]
+    device_name = data["device_name"]
+
+    # 从 cookie 中获取 token
+    token = request.cookies.get("coze_pkce_access_token")
+    if not token:
+        return jsonify({"message": "未登录"}), 401
+
+    try:
+        # 调用扣子 API 同步设备信息
+        await update_coze_device(CONNECTOR_ID, token, device_id, device_name)
+        return jsonify({"message": "设备同步成功"}), 200
+    except Exception as e:
+        return jsonify({"message": f"同步设备失败: {str(e)}"}), 500
+
+
+# 按渠道类型注册路由
+if CONNECTOR_MODE == "oauth":
+    app.register_blueprint(oauth_bp)
+elif CONNECTOR_MODE == "device_bind":
+    app.register_blueprint(device_bp)
+
+
+# 主入口, 生产环境使用 uvicorn app:app 启动
+if __name__ == "__main__":
+    app.run(debug=True)
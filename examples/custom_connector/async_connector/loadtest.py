@@ -0,0 +1,264 @@
+# 压测脚本: 启动本地模拟的扣子 API, 分别压测 Flask 版本和 async 版本的渠道服务, 对比吞吐和延迟
+#
+#     python loadtest.py --scenario all --concurrency 200 --requests 2000 --latency-ms 50
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# 和其他示例共用的本地模拟扣子 API
+MOCK_COZE_PATH = os.path.join(HERE, "..", "..", "mock_coze", "mock_coze.py")
+CALLBACK_TOKEN = "loadtest_callback_token"
+CLIENT_ID = "loadtest_client_id"
+CLIENT_SECRET = "loadtest_client_secret"
+
+# 每个场景在 Flask 版本中对应的示例目录和 async 版本的 CONNECTOR_MODE
+SCENARIOS = {
+    "callback": ("device_bind_connector", "device_bind"),
+    "bots": ("device_bind_connector", "device_bind"),
+    "users_me": ("device_bind_connector", "device_bind"),
+    "oauth": ("oauth_connector", "oauth"),
+}
+
+
+# 生成指向模拟服务的 jwt oauth 配置
+def write_oauth_config(workdir: str, mock_url: str):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    config = {
+        "client_type": "jwt",
+        "client_id": "loadtest",
+        "public_key_id": "loadtest",
+        "private_key": private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode(),
+        "coze_api_base": mock_url,
+    }
+    with open(os.path.join(workdir, "coze_oauth_config.json"), "w") as f:
+        json.dump(config, f)
+
+
+# 启动被压测的服务, 每次使用新的工作目录, 避免 bots.db 等数据互相影响
+def start_server(target: str, scenario: str, port: int, mock_url: str):
+    flask_dir, mode = SCENARIOS[scenario]
+    workdir = tempfile.mkdtemp(prefix=f"loadtest_{target}_")
+    write_oauth_config(workdir, mock_url)
+    env = dict(
+        os.environ,
+        COZE_API_BASE=mock_url,
+        COZE_CALLBACK_TOKEN=CALLBACK_TOKEN,
+        CONNECTOR_CLIENT_ID=CLIENT_ID,
+        CONNECTOR_CLIENT_SECRET=CLIENT_SECRET,
+        CONNECTOR_ID="loadtest_connector",
+        CONNECTOR_PKCE_CLIENT_ID="loadtest_pkce",
+        CONNECTOR_MODE=mode,
+        LOG_SAMPLE_RATE="0",
+    )
+    if target == "flask":
+        app_path = os.path.join(HERE, "..", flask_dir, "app.py")
+        cmd = [sys.executable, "-m", "flask", "--app", app_path, "run"]
+        cmd += ["--port", str(port), "--with-threads"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", HERE]
+        cmd += ["--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(
+        cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url + "/metrics")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise Exception(f"服务启动超时: {url}")
+
+
+def signed_callback(bot_id: str):
+    body = json.dumps(
+        {
+            "header": {"event_type": "bot.published"},
+            "event": {"bot_id": bot_id, "bot_name": f"bot {bot_id}"},
+        }
+    )
+    timestamp, nonce = str(int(time.time())), secrets.token_hex(8)
+    signature = hashlib.sha1(
+        (timestamp + nonce + CALLBACK_TOKEN + body).encode("utf-8")
+    ).hexdigest()
+    headers = {
+        "X-Coze-Signature": signature,
+        "X-Coze-Timestamp": timestamp,
+        "X-Coze-Nonce": nonce,
+        "Content-Type": "application/json",
+    }
+    return body, headers
+
+
+# 各个场景的一次请求, 返回是否成功
+async def run_callback(client: httpx.AsyncClient, i: int) -> bool:
+    body, headers = signed_callback(f"bot_{i}")
+    resp = await client.post("/coze/callback", content=body, headers=headers)
+    return resp.status_code == 200
+
+
+async def run_bots(client: httpx.AsyncClient, i: int) -> bool:
+    return (await client.get("/bots")).status_code == 200
+
+
+async def run_users_me(client: httpx.AsyncClient, i: int) -> bool:
+    resp = await client.get("/users_me", cookies={"coze_pkce_access_token": "t"})
+    return resp.status_code == 200
+
+
+# 完整的 oauth 授权流程: 授权码 -> access_token -> 用户信息
+async def run_oauth(client: httpx.AsyncClient, i: int) -> bool:
+    resp = await client.post(
+        "/oauth/authorize",
+        data={
+            "client_id": CLIENT_ID,
+            "redirect_uri": "https://www.coze.cn/open/oauth/callback",
+            "state": str(i),
+            "action": "allow",
+        },
+    )
+    code = parse_qs(urlparse(resp.headers.get("location", "")).query).get("code")
+    if not code:
+        return False
+    resp = await client.post(
+        "/oauth/token",
+        json={
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "code": code[0],
+            "grant_type": "authorization_code",
+        },
+    )
+    if resp.status_code != 200:
+        return False
+    token = resp.json()["access_token"]
+    resp = await client.get("/oauth/user", headers={"Authorization": f"Bearer {token}"})
+    return resp.status_code == 200
+
+
+RUNNERS = {
+    "callback": run_callback,
+    "bots": run_bots,
+    "users_me": run_users_me,
+    "oauth": run_oauth,
+}
+
+
+async def run_load(url: str, scenario: str, concurrency: int, total: int) -> dict:
+    runner = RUNNERS[scenario]
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    # 压测端不复用连接: httpx 的异步连接池在上百个 keep-alive 连接时本身会成为瓶颈
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        if scenario == "bots":
+            # 先发布一批 bot, 让 bots 页面有数据
+            for i in range(50):
+                await run_callback(client, i)
+
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    ok = await runner(client, i)
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += 0 if ok else 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(total)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="对比 Flask 和 async 渠道服务的性能")
+    parser.add_argument("--scenario", default="all", choices=["all", *SCENARIOS])
+    parser.add_argument("--targets", default="flask,async")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=int, default=50, help="模拟扣子接口耗时")
+    parser.add_argument("--mock-port", type=int, default=8090)
+    parser.add_argument("--port", type=int, default=8091)
+    args = parser.parse_args()
+
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    mock = subprocess.Popen(
+        [
+            sys.executable,
+            MOCK_COZE_PATH,
+            "--port",
+            str(args.mock_port),
+            "--latency-ms",
+            str(args.latency_ms),
+        ]
+    )
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = []
+    try:
+        for scenario in scenarios:
+            for target in args.targets.split(","):
+                url = f"http://127.0.0.1:{args.port}"
+                server = start_server(target, scenario, args.port, mock_url)
+                try:
+                    await wait_ready(url)
+                    result = await run_load(
+                        url, scenario, args.concurrency, args.requests
+                    )
+                    results.append((scenario, target, result))
+                    print(f"{scenario:<10} {target:<6} {result}")
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print()
+    print(
+        f"{'scenario':<10} {'target':<6} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} errors"
+    )
+    for scenario, target, r in results:
+        print(
+            f"{scenario:<10} {target:<6} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} "
+            f"{r['p99_ms']:>9.1f} {r['errors']}/{r['requests']}"
+        )
+
+
+# 主入口
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,245 @@
+# bot 发布审核: 把敏感词表编译成 Aho-Corasick 自动机, 一次扫描即可匹配全部敏感词
+#
+# 敏感词文件每行一个词, 可以在词后面用 tab 指定处理方式, 以 # 开头的行为注释:
+#
+#     违禁
+#     审核中	review
+#
+# reject: 拒绝发布 (默认); review: 转人工审核
+# 修改文件后无需重启服务, 下次审核时会自动重新加载
+#
+# 性能测试:
+#
+#     python audit.py --terms 20000
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# audit_status: 1: 审核中；2: 通过；3: 拒绝
+AUDIT_STATUS_REVIEW = 1
+AUDIT_STATUS_PASS = 2
+AUDIT_STATUS_REJECT = 3
+
+# 敏感词的处理方式, 对应的 audit_status
+AUDIT_ACTIONS = {"reject": AUDIT_STATUS_REJECT, "review": AUDIT_STATUS_REVIEW}
+
+# 没有配置敏感词文件时使用的默认词表
+DEFAULT_AUDIT_TERMS = {
+    "非法": "reject",
+    "违禁": "reject",
+    "敏感": "reject",
+    "审核中": "review",
+}
+
+
+# Aho-Corasick 自动机, 匹配耗时只和文本长度相关, 和词表大小无关
+class AhoCorasick:
+    def __init__(self, terms: Dict[str, str]):
+        # 每个节点: 子节点表、失败指针、以该节点结尾的最严格处理方式
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[Tuple[str, str]]] = [None]
+        for term, action in terms.items():
+            self._add(term.lower(), action)
+        self._build()
+
+    def __len__(self):
+        return len(self._goto)
+
+    def _add(self, term: str, action: str):
+        if not term:
+            return
+        node = 0
+        for ch in term:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            node = nxt
+        self._output[node] = self._stricter(self._output[node], (term, action))
+
+    # 按层遍历, 计算失败指针, 并把失败链上的命中合并到当前节点, 匹配时不用再沿失败链查找
+    def _build(self):
+        todo = deque(self._goto[0].values())
+        while todo:
+            node = todo.popleft()
+            for ch, child in self._goto[node].items():
+                todo.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[child] = fail
+                self._output[child] = self._stricter(
+                    self._output[child], self._output[fail]
+                )
+
+    @staticmethod
+    def _stricter(a, b):
+        if a is None:
+            return b
+        if b is None or a[1] == "reject":
+            return a
+        return b if b[1] == "reject" else a
+
+    # 返回命中的最严格的 (敏感词, 处理方式), 命中 reject 时立即返回
+    def search(self, text: str) -> Optional[Tuple[str, str]]:
+        goto, fail, output = self._goto, self._fail, self._output
+        found = None
+        node = 0
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = output[node]
+            if hit is not None:
+                if hit[1] == "reject":
+                    return hit
+                found = found or hit
+        return found
+
+
+# 审核引擎接口, 返回回调需要的 audit 结构: {"audit_status": ..., "reason": ...}
+class AuditEngine:
+    def audit(self, bot_name: str, description: str = "") -> dict:
+        raise NotImplementedError
+
+
+# 基于敏感词表的审核引擎, 词表文件变化后自动重新编译
+class KeywordAuditEngine(AuditEngine):
+    def __init__(
+        self,
+        terms_file: Optional[str] = None,
+        reload_interval: float = 5,
+        default_terms: Optional[Dict[str, str]] = None,
+    ):
+        self.terms_file = terms_file
+        self.reload_interval = reload_interval  # 检查文件是否变化的间隔, 秒
+        self.default_terms = default_terms or DEFAULT_AUDIT_TERMS
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._automaton = AhoCorasick(self.default_terms)
+        self.reload()
+
+    # 读取敏感词文件, 格式错误的行会被忽略
+    def load_terms(self) -> Dict[str, str]:
+        terms = {}
+        with open(self.terms_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                term, _, action = line.partition("\t")
+                action = action.strip() or "reject"
+                if action not in AUDIT_ACTIONS:
+                    logger.warning(f"忽略未知的敏感词处理方式: {line}")
+                    continue
+                if terms.get(term.strip()) != "reject":
+                    terms[term.strip()] = action
+        return terms
+
+    # 文件有变化时重新编译自动机, 编译完成后再替换, 其他审核请求继续使用旧词表
+    # blocking 为 False 时, 如果已经有线程在加载, 直接返回
+    def reload(self, force: bool = False, blocking: bool = True) -> bool:
+        if not self.terms_file:
+            return False
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.terms_file).st_mtime_ns
+            except FileNotFoundError:
+                return False
+            if mtime == self._mtime and not force:
+                return False
+            start = time.perf_counter()
+            terms = self.load_terms()
+            self._automaton = AhoCorasick(terms)
+            self._mtime = mtime
+        finally:
+            self._lock.release()
+        logger.info(
+            f"加载敏感词 {len(terms)} 个, "
+            f"耗时 {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        return True
+
+    def audit(self, bot_name: str, description: str = "") -> dict:
+        if time.monotonic() - self._checked_at > self.reload_interval:
+            try:
+                self.reload(blocking=False)
+            except Exception as e:
+                logger.error(f"重新加载敏感词失败, 继续使用旧词表: {str(e)}")
+
+        # 名称和描述都要检查, 返回最严格的结果: 拒绝 > 转人工审核 > 通过
+        automaton = self._automaton
+        need_review = False
+        for field, text in (("名称", bot_name), ("描述", description)):
+            hit = automaton.search(text or "")
+            if hit and hit[1] == "reject":
+                return {
+                    "audit_status": AUDIT_STATUS_REJECT,
+                    "reason": f"bot {field}非法",
+                }
+            need_review = need_review or hit is not None
+        if need_review:
+            return {"audit_status": AUDIT_STATUS_REVIEW, "reason": ""}
+        return {"audit_status": AUDIT_STATUS_PASS, "reason": ""}
+
+
+# 性能测试: 对比逐个 in 判断和自动机的单次审核耗时
+def benchmark(term_count: int, rounds: int):
+    import random
+
+    random.seed(0)
+    alphabet = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+    def word(n):
+        return "".join(random.choice(alphabet) for _ in range(n))
+
+    terms = {word(random.randint(2, 6)): "reject" for _ in range(term_count)}
+    terms.update(DEFAULT_AUDIT_TERMS)
+    texts = [(word(12), word(200)) for _ in range(rounds)]
+
+    start = time.perf_counter()
+    automaton = AhoCorasick(terms)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"敏感词 {len(terms)} 个, 自动机节点 {len(automaton)} 个")
+    print(f"编译耗时 {build_ms:.1f}ms")
+
+    engine = KeywordAuditEngine(default_terms=terms)
+    start = time.perf_counter()
+    for name, desc in texts:
+        engine.audit(name, desc)
+    ac_us = (time.perf_counter() - start) / rounds * 1e6
+
+    naive_rounds = max(1, rounds // 100)
+    start = time.perf_counter()
+    for name, desc in texts[:naive_rounds]:
+        any(t in name for t in terms) or any(t in desc for t in terms)
+    naive_us = (time.perf_counter() - start) / naive_rounds * 1e6
+
+    print("名称 12 字 + 描述 200 字, 单次审核耗时:")
+    print(f"  逐个 in 判断: {naive_us:10.1f}us")
+    print(f"  Aho-Corasick: {ac_us:10.1f}us")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="敏感词审核性能测试")
+    parser.add_argument("--terms", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=10000)
+    args = parser.parse_args()
+    benchmark(args.terms, args.rounds)
@@ -0,0 +1,737 @@
+# 几个渠道示例共用的代码: 日志、bot 存储、oauth 授权码和 token 存储、渠道 access_token、
+# 缓存、回调校验和 bot 发布事件的处理
+#
+# 这里的代码和 web 框架无关, Flask 版本 (none_auth_connector、oauth_connector、
+# device_bind_connector) 和 Quart 版本 (async_connector) 都从这里导入, 各个示例中只保留
+# 读取请求、返回响应等和框架相关的部分
+# sqlite 都是阻塞调用, 在协程中需要通过 asyncio.to_thread 调用
+
+import asyncio
+import atexit
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional
+
+from cozepy import AsyncJWTOAuthApp, JWTOAuthApp, OAuthToken
+
+logger = logging.getLogger(__name__)
+
+
+# 日志延迟序列化: 只在输出日志时才转成 json 字符串
+class LazyLogData:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False, default=self._default)
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, bytes):
+            return o.decode("utf-8", errors="replace")
+        return str(o)
+
+
+# 把日志原样放入队列, 格式化和输出都交给后台线程
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# 日志中需要脱敏的字段: oauth 授权码、token 和密钥; pkce_callback 的 state 中是 code_verifier
+LOG_REDACTED_FIELDS = (
+    "access_token",
+    "refresh_token",
+    "client_secret",
+    "code",
+    "code_verifier",
+    "state",
+    "token",
+)
+_fields = "|".join(LOG_REDACTED_FIELDS)
+# json 中的 "字段": "值", body 被截断时值可能没有结尾的引号
+_JSON_FIELD_RE = re.compile(rf'("(?:{_fields})"\s*:\s*")[^"]*("?)')
+# url、表单和 html 中的 字段=值, 重定向页面中的 & 会被转义为 &amp;
+_QUERY_FIELD_RE = re.compile(rf"((?:^|[?&;])(?:{_fields})=)[^&\s\"'<]*")
+
+
+# 把 dict 中的敏感字段替换为 ***, 用于记录 args 和 form
+def redact_log_fields(data: dict) -> dict:
+    redacted = {}
+    for key, value in data.items():
+        if key in LOG_REDACTED_FIELDS and isinstance(value, str):
+            value = "***"
+        elif isinstance(value, dict):
+            value = redact_log_fields(value)
+        redacted[key] = value
+    return redacted
+
+
+# 截断并脱敏请求和响应的 body, 只截断 bytes 和 str, dict 只脱敏, 其他类型不记录
+def redact_log_body(body, max_bytes: int):
+    if isinstance(body, dict):
+        return redact_log_fields(body)
+    if isinstance(body, bytes):
+        body = body[:max_bytes].decode("utf-8", errors="replace")
+    elif isinstance(body, str):
+        body = body[:max_bytes]
+    else:
+        return None
+    body = _JSON_FIELD_RE.sub(r"\1***\2", body)
+    return _QUERY_FIELD_RE.sub(r"\1***", body)
+
+
+# 配置日志, mode 为 async 时由后台线程输出日志, sync 时直接输出
+def setup_logging(mode: str):
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(
+        logging.Formatter(
+            fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+    )
+    if mode == "async":
+        log_queue = queue.SimpleQueue()
+        log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+        log_handler = LazyQueueHandler(log_queue)
+    logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+
+
+# 请求日志, 按 sample_rate 采样记录请求、响应和处理耗时, 由各个示例的日志装饰器调用
+# 授权码、token 和密钥等字段会被替换为 ***, 见 LOG_REDACTED_FIELDS
+class RequestLogger:
+    def __init__(self, logger: logging.Logger, sample_rate: float, body_max_bytes: int):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.body_max_bytes = body_max_bytes
+
+    def sampled(self) -> bool:
+        return random.random() < self.sample_rate
+
+    def log_request(self, method: str, url: str, args: dict, form: dict, body):
+        req_data = {
+            "method": method,
+            "url": redact_log_body(url, self.body_max_bytes),
+            "args": redact_log_fields(args),
+            "form": redact_log_fields(form),
+            "body": redact_log_body(body, self.body_max_bytes),
+        }
+        self.logger.info("Request: %s", LazyLogData(req_data))
+
+    # 拆分路由的返回值, 支持 response_class、str 和 (response_class, int), 返回 (body, code)
+    # body 为 response_class 时由调用方读取响应内容
+    @staticmethod
+    def split_response(response, response_class):
+        body, code = response, 200
+        if isinstance(response, tuple) and len(response) == 2:
+            body, code = response
+        elif isinstance(response, response_class):
+            code = response.status_code
+        return body, code
+
+    def log_response(self, route: str, code: int, cost_ms: float, body):
+        resp_data = {
+            "route": route,
+            "code": code,
+            "cost_ms": round(cost_ms, 3),
+            "body": redact_log_body(body, self.body_max_bytes) if body else None,
+        }
+        self.logger.info("Response: %s", LazyLogData(resp_data))
+
+
+# bot 描述和头像的本地缓存, 以 bot_id 为 key, 过期后重新从扣子拉取
+class BotInfoCache:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = {}  # bot_id -> (过期时间, bot 信息)
+
+    def get(self, bot_id):
+        with self._lock:
+            item = self._items.get(bot_id)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def set(self, bot_id, info):
+        with self._lock:
+            self._items[bot_id] = (time.monotonic() + self.ttl, info)
+
+    # 写入扣子 bots.retrieve 返回的 bot, 返回缓存的字段
+    def set_bot(self, bot_id, bot) -> dict:
+        info = {
+            "bot_description": bot.description,
+            "bot_icon_url": bot.icon_url,
+        }
+        self.set(bot_id, info)
+        return info
+
+    # 批量查询, 返回命中缓存的 {bot_id: bot 信息} 和没有命中的 bot_id 列表
+    def get_many(self, bot_ids):
+        infos, missed = {}, []
+        for bot_id in bot_ids:
+            info = self.get(bot_id)
+            if info is None:
+                missed.append(bot_id)
+            else:
+                infos[bot_id] = info
+        logger.info(f"bot 信息缓存命中: {len(infos)}, 未命中: {len(missed)}")
+        return infos, missed
+
+
+# 把 bot 列表和 bot 信息合并, 用于渲染 bots 页面
+def merge_bot_infos(bots, infos) -> list:
+    res = []
+    for bot in bots:
+        res.append(
+            {
+                "bot_id": bot["bot_id"],
+                "bot_name": bot["bot_name"],
+                **infos[bot["bot_id"]],
+            }
+        )
+    return res
+
+
+# bot 数据存储接口, 可以替换为 mysql、redis 等实现
+class BotStore:
+    def upsert(self, bot_id, bot_name):
+        raise NotImplementedError
+
+    def list(self, offset=0, limit=None):
+        raise NotImplementedError
+
+
+# 基于 sqlite 的 bot 数据存储, 开启 WAL 支持多个 worker 进程并发读写
+class SQLiteBotStore(BotStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 进程内的读缓存, 当数据库中的版本号变化时失效
+        self._cache_version = None
+        self._cache = {}
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bots "
+                "(bot_id TEXT PRIMARY KEY, bot_name TEXT NOT NULL, updated_at INTEGER)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS bots_version (version INTEGER)")
+            conn.execute(
+                "INSERT INTO bots_version SELECT 0 WHERE NOT EXISTS "
+                "(SELECT 1 FROM bots_version)"
+            )
+
+    # 每个线程使用独立的连接
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # 按 bot_id 插入或更新, 同一个事务内递增版本号
+    def upsert(self, bot_id, bot_name):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO bots (bot_id, bot_name, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(bot_id) DO UPDATE SET "
+                "bot_name = excluded.bot_name, updated_at = excluded.updated_at",
+                (bot_id, bot_name, int(time.time())),
+            )
+            conn.execute("UPDATE bots_version SET version = version + 1")
+
+    # 按发布顺序分页返回 bot 列表, limit 为 None 时返回全部
+    def list(self, offset=0, limit=None):
+        conn = self._conn()
+        version = conn.execute("SELECT version FROM bots_version").fetchone()[0]
+        key = (offset, limit)
+        with self._lock:
+            if self._cache_version != version:
+                self._cache_version = version
+                self._cache = {}
+            if key in self._cache:
+                return self._cache[key]
+
+        rows = conn.execute(
+            "SELECT bot_id, bot_name FROM bots ORDER BY rowid LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        ).fetchall()
+        bots = [{"bot_id": bot_id, "bot_name": bot_name} for bot_id, bot_name in rows]
+        with self._lock:
+            if self._cache_version == version:
+                self._cache[key] = bots
+        return bots
+
+    # 将旧版本的 bots.json 导入数据库, 导入后重命名, 只会执行一次
+    # 多个 worker 进程同时启动时, 文件可能刚被其他进程重命名, 所以直接打开而不是先判断是否存在
+    def migrate_from_json(self, json_path: str):
+        try:
+            with open(json_path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO bots (bot_id, bot_name, updated_at) "
+                "VALUES (?, ?, ?)",
+                [
+                    (bot_id, info.get("bot_name", ""), int(time.time()))
+                    for bot_id, info in data.items()
+                ],
+            )
+            conn.execute("UPDATE bots_version SET version = version + 1")
+        try:
+            os.rename(json_path, json_path + ".migrated")
+        except FileNotFoundError:
+            pass  # 其他 worker 进程已经完成迁移
+        logger.info(f"已将 {len(data)} 个 bot 从 {json_path} 迁移到 {self.path}")
+
+
+# 将 bot 数据保存到 bot_store, 失败时重试; 阻塞调用, 在协程中需要通过 asyncio.to_thread 调用
+def save_bot(bot_store: BotStore, bot_id, bot_name):
+    retry_count = 10
+    while retry_count > 0:
+        try:
+            bot_store.upsert(bot_id, bot_name)
+            return
+        except Exception as e:
+            retry_count -= 1
+            logger.warning(f"保存 bot 数据失败，正在重试... : {e}")
+            time.sleep(0.1)
+    raise Exception(f"保存 bot 数据失败: {bot_id}")
+
+
+# oauth 授权码和 access_token 的存储接口, 数据到期后自动失效
+class TokenStore:
+    def put(self, key: str, value: dict, ttl: int):
+        raise NotImplementedError
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    # 取出并删除, 用于只能使用一次的授权码
+    def pop(self, key: str):
+        raise NotImplementedError
+
+    # 清理过期数据, 返回清理的条数
+    def sweep(self) -> int:
+        raise NotImplementedError
+
+
+# 基于内存的存储, 只适合单进程部署; 用最小堆按过期时间排序, 清理时只访问过期数据
+class MemoryTokenStore(TokenStore):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}  # key -> (过期时间, value)
+        self._expiry_heap = []  # (过期时间, key)
+
+    def put(self, key: str, value: dict, ttl: int):
+        expire_at = time.time() + ttl
+        with self._lock:
+            self._items[key] = (expire_at, value)
+            heapq.heappush(self._expiry_heap, (expire_at, key))
+        self.sweep()
+
+    def get(self, key: str):
+        item = self._items.get(key)
+        if item is None or item[0] <= time.time():
+            return None
+        return item[1]
+
+    def pop(self, key: str):
+        with self._lock:
+            item = self._items.pop(key, None)
+        if item is None or item[0] <= time.time():
+            return None
+        return item[1]
+
+    def sweep(self) -> int:
+        now = time.time()
+        count = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expire_at, key = heapq.heappop(self._expiry_heap)
+                # key 可能已经被覆盖写入或者取出, 只删除过期时间一致的数据
+                item = self._items.get(key)
+                if item is not None and item[0] == expire_at:
+                    del self._items[key]
+                    count += 1
+        return count
+
+
+# 基于 sqlite 的存储, 多个 worker 进程共享; 过期时间上建索引, 清理时只扫描过期数据
+class SQLiteTokenStore(TokenStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS oauth_tokens "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expire_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS oauth_tokens_expire_at "
+                "ON oauth_tokens (expire_at)"
+            )
+
+    # 每个线程使用独立的连接
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, key: str, value: dict, ttl: int):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO oauth_tokens (key, value, expire_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+        self.sweep()
+
+    def get(self, key: str):
+        row = (
+            self._conn()
+            .execute(
+                "SELECT value FROM oauth_tokens WHERE key = ? AND expire_at > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    # BEGIN IMMEDIATE 先拿到写锁再查询和删除, 保证多个进程并发使用同一个授权码时只有一个能成功
+    # 没有使用 DELETE ... RETURNING, 它需要 sqlite 3.35 以上, 部分系统自带的 sqlite 版本较旧
+    def pop(self, key: str):
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT value, expire_at FROM oauth_tokens WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM oauth_tokens WHERE key = ?", (key,))
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def sweep(self) -> int:
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "DELETE FROM oauth_tokens WHERE expire_at <= ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+
+# 缓存渠道的 access_token, 快过期时在后台刷新, 并发请求共享同一次刷新
+# 这里是公共部分: 缓存的 token 和监控指标, 刷新方式见下面的线程版本和协程版本
+class BaseAccessTokenManager:
+    def __init__(self, ttl: int, refresh_before: int):
+        self.ttl = ttl
+        self.refresh_before = refresh_before
+        self._token: Optional[OAuthToken] = None
+        self._fetched_at = 0.0
+        # 监控指标
+        self.refresh_count = 0
+        self.refresh_error_count = 0
+        self.last_refresh_latency = 0.0
+
+    # 返回 (是否需要等待刷新, 是否需要后台刷新)
+    def _check_token(self):
+        token = self._token
+        now = int(time.time())
+        if token is None or token.expires_in <= now:
+            return True, False
+        return False, token.expires_in - now < self.refresh_before
+
+    def _on_refreshed(self, token: OAuthToken, start: float):
+        self._token = token
+        self._fetched_at = time.monotonic()
+        self.refresh_count += 1
+        self.last_refresh_latency = self._fetched_at - start
+
+    def _on_refresh_error(self, start: float):
+        self.refresh_error_count += 1
+        self.last_refresh_latency = time.monotonic() - start
+
+    def metrics(self) -> dict:
+        return {
+            "refresh_count": self.refresh_count,
+            "refresh_error_count": self.refresh_error_count,
+            "last_refresh_latency_ms": round(self.last_refresh_latency * 1000, 2),
+            "cache_age_seconds": round(time.monotonic() - self._fetched_at, 2)
+            if self._token
+            else None,
+        }
+
+
+# 线程版本, 用于 Flask 示例
+class AccessTokenManager(BaseAccessTokenManager):
+    def __init__(self, oauth_app: JWTOAuthApp, ttl: int, refresh_before: int):
+        super().__init__(ttl, refresh_before)
+        self.oauth_app = oauth_app
+        self._lock = threading.Lock()
+        self._inflight: Optional[Future] = None  # 正在进行的刷新
+
+    def get_access_token(self) -> str:
+        token = self._token
+        must_wait, refresh_soon = self._check_token()
+        if must_wait:
+            # 没有可用的 token, 只能同步等待刷新
+            return self._refresh().access_token
+        if refresh_soon:
+            self._refresh_in_background()
+        return token.access_token
+
+    # 同一时间只有一个线程请求扣子, 其他线程等待它的结果
+    def _refresh(self) -> OAuthToken:
+        with self._lock:
+            future = self._inflight
+            is_leader = future is None
+            if is_leader:
+                future = self._inflight = Future()
+        if not is_leader:
+            return future.result()
+
+        start = time.monotonic()
+        try:
+            token = self.oauth_app.get_access_token(ttl=self.ttl)
+            self._on_refreshed(token, start)
+            future.set_result(token)
+        except Exception as e:
+            self._on_refresh_error(start)
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight = None
+        return future.result()
+
+    def _refresh_in_background(self):
+        if self._inflight is not None:
+            return
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            logger.warning(f"后台刷新 access_token 失败: {e}")
+
+
+# 协程版本, 用于 Quart 示例, 只能在同一个事件循环中使用
+class AsyncAccessTokenManager(BaseAccessTokenManager):
+    def __init__(self, oauth_app: AsyncJWTOAuthApp, ttl: int, refresh_before: int):
+        super().__init__(ttl, refresh_before)
+        self.oauth_app = oauth_app
+        self._inflight: Optional[asyncio.Task] = None  # 正在进行的刷新
+
+    async def get_access_token(self) -> str:
+        token = self._token
+        must_wait, refresh_soon = self._check_token()
+        if must_wait:
+            # 没有可用的 token, 只能等待刷新; shield 避免请求取消时中断共享的刷新
+            return (await asyncio.shield(self._refresh())).access_token
+        if refresh_soon and self._inflight is None:
+            self._refresh().add_done_callback(self._log_refresh_error)
+        return token.access_token
+
+    # 同一时间只有一个刷新任务, 其他协程等待它的结果
+    def _refresh(self) -> asyncio.Task:
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._do_refresh())
+        return self._inflight
+
+    async def _do_refresh(self) -> OAuthToken:
+        start = time.monotonic()
+        try:
+            token = await self.oauth_app.get_access_token(ttl=self.ttl)
+            self._on_refreshed(token, start)
+            return token
+        except Exception:
+            self._on_refresh_error(start)
+            raise
+        finally:
+            self._inflight = None
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.warning(f"后台刷新 access_token 失败: {task.exception()}")
+
+
+# 已处理回调的 LRU 缓存, 扣子重试投递时直接返回上次的处理结果
+class CallbackDedupCache:
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # 回调签名 -> (过期时间, 处理结果)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, result):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+# 计算扣子 bot 发布回调签名
+def gen_coze_callback_signature(
+    nonce: str, timestamp: str, body: bytes, token: str
+) -> str:
+    """
+    docs: https://www.coze.cn/open/docs/guides/configure_callback_message#bba62e6c
+    """
+    # 按照 timestamp + nonce + token + body 的顺序计算 SHA1
+    # 逐段写入, 不需要解码请求体和拼接字符串
+    hash_obj = hashlib.sha1()
+    hash_obj.update(timestamp.encode("utf-8"))
+    hash_obj.update(nonce.encode("utf-8"))
+    hash_obj.update(token.encode("utf-8"))
+    hash_obj.update(body)
+
+    # 返回十六进制格式的签名
+    return hash_obj.hexdigest()
+
+
+# 校验回调时间戳是否在允许的时间窗口内, 防止重放
+def is_callback_timestamp_valid(timestamp: str, max_skew: int) -> bool:
+    try:
+        ts = int(timestamp)
+    except ValueError:
+        return False
+    if ts > 10**12:
+        ts //= 1000  # 兼容毫秒时间戳
+    return abs(time.time() - ts) <= max_skew
+
+
+# 一次扣子回调的校验结果, 校验失败或者重复投递时 result 已经是要返回的 (响应数据, 状态码)
+class CozeCallback:
+    def __init__(self):
+        self.signature = None
+        self.event = None
+        self.result = None
+        self.started_at = time.perf_counter()
+        self.verified_at = 0.0
+        self.parsed_at = 0.0
+
+
+# 扣子 bot 发布回调的验签、防重放、去重和耗时统计, 事件由各个示例处理:
+#
+#     callback = coze_callback_handler.begin(request.headers, request.get_data())
+#     if callback.result is None:
+#         coze_callback_handler.finish(callback, handle_coze_event(callback.event))
+#     return jsonify(callback.result[0]), callback.result[1]
+class CozeCallbackHandler:
+    def __init__(self, token: str, max_skew: int, dedup_size: int):
+        self.token = token
+        self.max_skew = max_skew
+        # 超过时间窗口的回调会被拒绝, 所以去重缓存只需要保留两倍窗口的时间
+        self.dedup_cache = CallbackDedupCache(dedup_size, max_skew * 2)
+
+    def begin(self, headers, body: bytes) -> CozeCallback:
+        callback = CozeCallback()
+        # 获取签名和时间戳
+        signature = headers.get("X-Coze-Signature")
+        timestamp = headers.get("X-Coze-Timestamp")
+        nonce = headers.get("X-Coze-Nonce")
+
+        if not signature or not timestamp or not nonce:
+            callback.result = {"code": 400, "message": "缺少签名或时间戳"}, 400
+            return callback
+
+        # 拒绝时间窗口之外的回调
+        if not is_callback_timestamp_valid(timestamp, self.max_skew):
+            callback.result = {"code": 401, "message": "时间戳无效或已过期"}, 401
+            return callback
+
+        if not body:
+            callback.result = {"code": 400, "message": "请求体为空"}, 400
+            return callback
+
+        expected_signature = gen_coze_callback_signature(
+            nonce, timestamp, body, self.token
+        )
+        # 使用常量时间比较, 避免通过响应时间猜测签名
+        if not hmac.compare_digest(signature.encode(), expected_signature.encode()):
+            callback.result = {"code": 401, "message": "签名验证失败"}, 401
+            return callback
+        callback.verified_at = time.perf_counter()
+
+        # 重复投递的回调直接返回上次的处理结果, 不再解析和处理
+        result = self.dedup_cache.get(signature)
+        if result is not None:
+            logger.info(f"重复的回调, 直接返回上次的处理结果: {nonce}")
+            callback.result = result
+            return callback
+
+        callback.signature = signature
+        callback.event = json.loads(body)
+        callback.parsed_at = time.perf_counter()
+        return callback
+
+    # 记录事件的处理结果, 扣子重试投递时直接返回
+    def finish(self, callback: CozeCallback, result):
+        callback.result = result
+        self.dedup_cache.set(callback.signature, result)
+        handled = time.perf_counter()
+        logger.info(
+            f"回调处理耗时: 验签 {(callback.verified_at - callback.started_at) * 1000:.3f}ms, "
+            f"解析 {(callback.parsed_at - callback.verified_at) * 1000:.3f}ms, "
+            f"处理 {(handled - callback.parsed_at) * 1000:.3f}ms"
+        )
+
+
+# 处理扣子推送的事件, 只支持 bot.published: 审核 bot 名称和描述, 通过后保存到 bot_store
+# 返回 (响应数据, 状态码) 和保存的 bot_id, bot_id 不为 None 时需要刷新 bot 信息缓存
+# 审核时可能重新编译敏感词, 保存会访问 sqlite, 在协程中需要通过 asyncio.to_thread 调用
+def handle_bot_published_event(event, audit_engine, bot_store: BotStore):
+    event_type = event.get("header", {}).get("event_type", "")
+    # user_id = event.get("event", {}).get("user_id", "")
+    # connector_user_id = event.get("event", {}).get("connector_user_id", "")
+    bot_id = str(event.get("event", {}).get("bot_id", ""))
+    bot_name = event.get("event", {}).get("bot_name", "")
+    description = event.get("event", {}).get("description", "")
+
+    if event_type != "bot.published":
+        return ({"code": 400, "message": f"不支持处理事件 {event_type}"}, 400), None
+
+    # audit_status: 1: 审核中；2: 通过；3: 拒绝
+    audit = audit_engine.audit(bot_name, description)
+    if audit["audit_status"] != 2:
+        return ({"audit": audit}, 200), None
+
+    save_bot(bot_store, bot_id, bot_name)
+    return ({"audit": {"audit_status": 2, "reason": ""}}, 200), bot_id
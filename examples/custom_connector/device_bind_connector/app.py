@@ -1,8 +1,10 @@
-import hashlib
+import atexit
 import json
 import logging
 import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
 import httpx
@@ -25,20 +27,43 @@ from flask import (
     jsonify,
 )
 
+# 几个渠道示例共用的代码在上一级目录: connector_common.py 和审核引擎 audit.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit import KeywordAuditEngine  # noqa: E402
+from connector_common import (  # noqa: E402
+    AccessTokenManager,
+    BotInfoCache,
+    BotStore,
+    CozeCallbackHandler,
+    RequestLogger,
+    SQLiteBotStore,
+    handle_bot_published_event,
+    merge_bot_infos,
+    setup_logging,
+)
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_ENABLED = True  # 安装了 h2 时使用 http/2 访问扣子
+except ImportError:
+    HTTP2_ENABLED = False
+
 # 加载 .env 文件, 用户可以自行修改 .env
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
-app.token_store = {}
+
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+LOG_MODE = os.getenv("LOG_MODE", "async")  # async: 后台线程输出日志; sync: 直接输出
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))  # 请求日志采样率, 0~1
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "4096"))  # body 截断长度
+setup_logging(LOG_MODE)
 logger = logging.getLogger(__name__)
+request_logger = RequestLogger(logger, LOG_SAMPLE_RATE, LOG_BODY_MAX_BYTES)
 
 # 渠道 id
 CONNECTOR_ID = os.getenv("CONNECTOR_ID")  # 渠道 id
@@ -54,8 +79,23 @@ CONNECTOR_USER_ID = os.getenv("CONNECTOR_USER_ID")  # oauth 后渠道的用户 u
 CONNECTOR_USER_NAME = os.getenv("CONNECTOR_USER_NAME")  # oauth 后渠道的用户 name
 # 扣子的配置
 COZE_CALLBACK_TOKEN = os.getenv("COZE_CALLBACK_TOKEN")  # 扣子回调 token
+# 回调时间戳允许的误差(秒), 以及回调去重缓存的条数
+COZE_CALLBACK_MAX_SKEW = int(os.getenv("COZE_CALLBACK_MAX_SKEW", "300"))
+COZE_CALLBACK_DEDUP_SIZE = int(os.getenv("COZE_CALLBACK_DEDUP_SIZE", "10000"))
+COZE_API_BASE = os.getenv("COZE_API_BASE", COZE_CN_BASE_URL)  # 可指向本地模拟服务压测
+# 访问扣子 API 的连接池配置
+COZE_HTTP_MAX_CONNECTIONS = int(os.getenv("COZE_HTTP_MAX_CONNECTIONS", "100"))
+COZE_HTTP_MAX_KEEPALIVE = int(os.getenv("COZE_HTTP_MAX_KEEPALIVE", "20"))
+COZE_HTTP_TIMEOUT = float(os.getenv("COZE_HTTP_TIMEOUT", "10"))  # 秒
+COZE_HTTP_MAX_RETRIES = int(os.getenv("COZE_HTTP_MAX_RETRIES", "3"))
 # 服务静态配置
-BOTS_FILE = "bots.json"  # 存储 bot 信息的文件
+AUDIT_TERMS_FILE = os.getenv("AUDIT_TERMS_FILE", "audit_terms.txt")  # 敏感词文件
+BOTS_FILE = "bots.json"  # 旧版本存储 bot 信息的文件, 启动时会迁移到 BOTS_DB_FILE
+BOTS_DB_FILE = "bots.db"  # 存储 bot 信息的 sqlite 数据库
+BOT_INFO_CACHE_TTL = int(os.getenv("BOT_INFO_CACHE_TTL", "600"))  # bot 信息缓存时间, 秒
+BOT_INFO_FETCH_WORKERS = int(os.getenv("BOT_INFO_FETCH_WORKERS", "8"))  # 并发拉取数
+ACCESS_TOKEN_TTL = 86399  # 渠道 access_token 的有效期, 秒
+ACCESS_TOKEN_REFRESH_BEFORE = 600  # access_token 过期前多少秒开始后台刷新
 COZE_OAUTH_CONFIG_PATH = "coze_oauth_config.json"  # jwt oauth 配置文件
 
 
@@ -71,34 +111,30 @@ def load_coze_oauth_app(config_path) -> JWTOAuthApp:
         raise Exception(f"加载 OAuth 失败: {str(e)}")
 
 
-# 日志装饰器
+# 日志装饰器, 采样和脱敏见 connector_common.RequestLogger
 def log_request_response(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # 记录请求信息
-        req_data = {
-            "method": request.method,
-            "url": request.url,
-            "args": dict(request.args),
-            "form": dict(request.form),
-            "json": request.get_json(silent=True),
-        }
-        logger.info(f"Request: {json.dumps(req_data, ensure_ascii=False)}")
-
-        # 执行原始函数
+        sampled = request_logger.sampled()
+        if sampled:
+            request_logger.log_request(
+                request.method,
+                request.url,
+                request.args.to_dict(),
+                request.form.to_dict(),
+                request.get_data(),
+            )
+
+        # 执行原始函数, 并记录耗时
+        start = time.perf_counter()
         response = f(*args, **kwargs)
+        cost_ms = (time.perf_counter() - start) * 1000
 
-        # 记录响应信息
-        if (
-            isinstance(response, tuple)
-            and len(response) == 2
-            and isinstance(response[0], Response)
-            and isinstance(response[1], int)
-        ):
-            # 如果 response 是 (Response, int) 的 tuple 类型
-            code = response[1]
-            data = response[0].get_json()
-            logger.info(f"Response: {code}, {json.dumps(data, ensure_ascii=False)}")
+        if sampled:
+            body, code = RequestLogger.split_response(response, Response)
+            if isinstance(body, Response):
+                body = None if body.is_streamed else body.get_data()
+            request_logger.log_response(f.__name__, code, cost_ms, body)
 
         return response
 
@@ -108,64 +144,89 @@ def log_request_response(f):
 # 渠道的扣子客户端和 oauth 客户端
 connector_oauth_app = load_coze_oauth_app(COZE_OAUTH_CONFIG_PATH)
 connector_pkce_oauth_app = PKCEOAuthApp(
-    client_id=CONNECTOR_PKCE_CLIENT_ID, base_url=COZE_CN_BASE_URL
+    client_id=CONNECTOR_PKCE_CLIENT_ID, base_url=COZE_API_BASE
 )
 connector_coze = Coze(
-    auth=JWTAuth(oauth_app=connector_oauth_app, ttl=86399),
-    base_url=COZE_CN_BASE_URL,
+    auth=JWTAuth(oauth_app=connector_oauth_app, ttl=ACCESS_TOKEN_TTL),
+    base_url=COZE_API_BASE,
 )
 
+# 进程内共享的扣子 http 客户端, 复用 keep-alive 连接, 连接失败时自动重连
+coze_http_client = httpx.Client(
+    base_url=COZE_API_BASE,
+    timeout=httpx.Timeout(COZE_HTTP_TIMEOUT),
+    transport=httpx.HTTPTransport(
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=COZE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=COZE_HTTP_MAX_KEEPALIVE,
+        ),
+        retries=COZE_HTTP_MAX_RETRIES,
+    ),
+)
+# 进程退出时关闭连接池
+atexit.register(coze_http_client.close)
+
+
+bot_info_cache = BotInfoCache(BOT_INFO_CACHE_TTL)
+# 拉取 bot 信息的线程池, 限制对扣子的并发请求数
+bot_info_executor = ThreadPoolExecutor(max_workers=BOT_INFO_FETCH_WORKERS)
+
+
+# 渠道的 access_token, 快过期时在后台刷新, 见 connector_common.AccessTokenManager
+connector_token_manager = AccessTokenManager(
+    connector_oauth_app, ACCESS_TOKEN_TTL, ACCESS_TOKEN_REFRESH_BEFORE
+)
+
+
+bot_store: BotStore = SQLiteBotStore(BOTS_DB_FILE)
+bot_store.migrate_from_json(BOTS_FILE)
 
-# 从 bots.json 加载已经发布的 bot 数据
-def load_bots():
-    if os.path.exists(BOTS_FILE):
-        with open(BOTS_FILE, "r") as f:
-            data = json.load(f)
-            return [
-                {"bot_id": bot_id, "bot_name": info.get("bot_name", "")}
-                for bot_id, info in data.items()
-            ]
-
-    return []
-
-
-# 从 bots.json 加载已经发布的 bot 数据, 并且拉取头像等数据
-def load_bot_and_info():
-    bots = load_bots()
-    res = []
-    for bot in bots:
-        bot_info = connector_coze.bots.retrieve(bot_id=bot["bot_id"])
-
-        res.append(
-            {
-                "bot_id": bot["bot_id"],
-                "bot_name": bot["bot_name"],
-                "bot_description": bot_info.description,
-                "bot_icon_url": bot_info.icon_url,
-            }
-        )
-    return res
-
-
-# 将 bot 数据保存到本地文件
-def save_bot(bot_id, bot_name):
-    retry_count = 10
-    while retry_count > 0:
-        try:
-            bots = load_bots()
-            bots = {bot["bot_id"]: bot for bot in bots}
-            bots[bot_id] = {
-                "bot_name": bot_name,
-            }
-            with open(BOTS_FILE, "w") as f:
-                json.dump(bots, f)
-            return
-        except Exception as e:
-            logger.warning(f"保存 bot 数据失败，正在重试... : {e}")
+
+# 加载已经发布的 bot 数据
+def load_bots(offset=0, limit=None):
+    return bot_store.list(offset, limit)
+
+
+# 从扣子拉取 bot 的描述和头像, 并写入缓存
+def fetch_bot_info(bot_id):
+    return bot_info_cache.set_bot(bot_id, connector_coze.bots.retrieve(bot_id=bot_id))
+
+
+# 在后台刷新 bot 信息缓存, 失败只记录日志, 下次打开 bots 页面时会重新拉取
+def refresh_bot_info(bot_id):
+    try:
+        fetch_bot_info(bot_id)
+    except Exception as e:
+        logger.warning(f"刷新 bot 信息缓存失败: {bot_id}, {e}")
+
+
+# 加载已经发布的 bot 数据, 并且拉取头像等数据
+def load_bot_and_info(offset=0, limit=None):
+    bots = load_bots(offset, limit)
+    # 只拉取没有命中缓存的 bot, 并发请求扣子
+    infos, missed = bot_info_cache.get_many([bot["bot_id"] for bot in bots])
+    infos.update(zip(missed, bot_info_executor.map(fetch_bot_info, missed)))
+    return merge_bot_infos(bots, infos)
+
+
+# 请求扣子 API, 遇到 429 和 5xx 时按 Retry-After 或指数退避重试
+def coze_api_request(method: str, path: str, **kwargs) -> httpx.Response:
+    for attempt in range(COZE_HTTP_MAX_RETRIES + 1):
+        response = coze_http_client.request(method, path, **kwargs)
+        if response.status_code != 429 and response.status_code < 500:
+            return response
+        if attempt == COZE_HTTP_MAX_RETRIES:
+            break
+        retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else 0.2 * 2**attempt
+        logger.warning(f"请求扣子 {path} 失败: {response.status_code}, {delay}s 后重试")
+        time.sleep(delay)
+    return response
 
 
 def update_coze_device(connector_id: str, token: str, device_id: str, device_name: str):
-    url = f"https://api.coze.cn/v1/connectors/{connector_id}/user_configs"
+    url = f"/v1/connectors/{connector_id}/user_configs"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     data = {
         "configs": [
@@ -173,41 +234,31 @@ def update_coze_device(connector_id: str, token: str, device_id: str, device_nam
         ]
     }
 
-    client = httpx.Client()
-    response = client.post(url, json=data, headers=headers)
+    response = coze_api_request("POST", url, json=data, headers=headers)
     if response.status_code >= 400:
         logid = response.headers.get("x-tt-logid")
         raise Exception(f"同步设备失败: {logid}, resp: {response.text}")
 
 
 def get_coze_user_info(pkce_token: str):
-    url = "https://api.coze.cn/v1/users/me"
+    url = "/v1/users/me"
     headers = {
         "Authorization": f"Bearer {pkce_token}",
     }
-    client = httpx.Client()
-    response = client.get(url, headers=headers)
+    response = coze_api_request("GET", url, headers=headers)
     response.raise_for_status()
     # user_id, user_name, nick_name, avatar_url
     return response.json()["data"]
 
 
-# 计算扣子 bot 发布回调签名
-def gen_coze_callback_signature(
-    nonce: str, timestamp: str, body: str, token: str
-) -> str:
-    """
-    docs: https://www.coze.cn/open/docs/guides/configure_callback_message#bba62e6c
-    """
-    # 按照指定顺序拼接字符串
-    raw_str = timestamp + nonce + token + body
+# 回调的验签、防重放和去重, 见 connector_common.CozeCallbackHandler
+coze_callback_handler = CozeCallbackHandler(
+    COZE_CALLBACK_TOKEN, COZE_CALLBACK_MAX_SKEW, COZE_CALLBACK_DEDUP_SIZE
+)
 
-    # 使用 SHA1 计算哈希值
-    hash_obj = hashlib.sha1()
-    hash_obj.update(raw_str.encode("utf-8"))
 
-    # 返回十六进制格式的签名
-    return hash_obj.hexdigest()
+# bot 发布审核引擎, 敏感词文件修改后自动重新加载
+audit_engine = KeywordAuditEngine(AUDIT_TERMS_FILE)
 
 
 # 首页路由, 302 到 bots 列表页
@@ -221,52 +272,37 @@ def index():
 @app.route("/bots")
 @log_request_response
 def bots():
-    bots = load_bot_and_info()
-    token = connector_oauth_app.get_access_token(ttl=86399).access_token
+    # 支持 ?offset=0&limit=20 分页, 默认展示全部
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    bots = load_bot_and_info(offset, limit)
+    token = connector_token_manager.get_access_token()
     return render_template("bots.html", bots=bots, token=token)
 
 
+# 服务的监控指标
+@app.route("/metrics")
+def metrics():
+    return jsonify({"access_token": connector_token_manager.metrics()})
+
+
 # 在扣子发布智能体到渠道的时候, 扣子会给本接口推送一条 json 数据, 包含 bot 相关信息
 @app.route("/coze/callback", methods=["POST"])
 @log_request_response
 def coze_callback():
-    # 获取签名和时间戳
-    signature = request.headers.get("X-Coze-Signature")
-    timestamp = request.headers.get("X-Coze-Timestamp")
-    nonce = request.headers.get("X-Coze-Nonce")
-
-    if not signature or not timestamp or not nonce:
-        return jsonify({"code": 400, "message": "缺少签名或时间戳"}), 400
-
-    # 获取请求体
-    body = request.get_data().decode("utf-8")
-    if not body:
-        return jsonify({"code": 400, "message": "请求体为空"}), 400
-
-    expected_signature = gen_coze_callback_signature(
-        nonce, timestamp, body, COZE_CALLBACK_TOKEN
-    )
-    if signature != expected_signature:
-        return jsonify({"code": 401, "message": "签名验证失败"}), 401
-
-    event = json.loads(body)
-    event_type = event.get("header", {}).get("event_type", "")
-    # user_id = event.get("event", {}).get("user_id", "")
-    # connector_user_id = event.get("event", {}).get("connector_user_id", "")
-    bot_id = str(event.get("event", {}).get("bot_id", ""))
-    bot_name = event.get("event", {}).get("bot_name", "")
-
-    if event_type != "bot.published":
-        return jsonify({"code": 400, "message": f"不支持处理事件 {event_type}"}), 400
-
-    # audit_status: 1: 审核中；2: 通过；3: 拒绝
-    if "非法" in bot_name or "违禁" in bot_name or "敏感" in bot_name:
-        return jsonify({"audit": {"audit_status": 3, "reason": "bot 名称非法"}}), 200
-    if "审核中" in bot_name:
-        return jsonify({"audit": {"audit_status": 1, "reason": ""}}), 200
-
-    save_bot(bot_id, bot_name)
-    return jsonify({"audit": {"audit_status": 2, "reason": ""}}), 200
+    callback = coze_callback_handler.begin(request.headers, request.get_data())
+    if callback.result is None:
+        coze_callback_handler.finish(callback, handle_coze_event(callback.event))
+    return jsonify(callback.result[0]), callback.result[1]
+
+
+# 处理扣子推送的事件, 返回响应数据和状态码
+def handle_coze_event(event):
+    result, bot_id = handle_bot_published_event(event, audit_engine, bot_store)
+    if bot_id is not None:
+        # bot 重新发布后描述和头像可能变化, 异步刷新缓存, 不阻塞回调响应
+        bot_info_executor.submit(refresh_bot_info, bot_id)
+    return result
 
 
 # 使用 pkce 授权获取到用户的 AccessToken
@@ -1,13 +1,17 @@
+import asyncio
 import json
 import logging
 import os
 import secrets
-import tempfile
-import tkinter
-from typing import List
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from cozepy import (
     COZE_CN_BASE_URL,
+    AsyncCoze,
     ChatEvent,
     ChatEventType,
     Coze,
@@ -17,133 +21,416 @@ from cozepy import (
     ToolOutput,
     setup_logging,
 )
-from PIL import ImageGrab
-
-setup_logging(logging.ERROR)
 
+from local_files import READ_FILE_MAX_BYTES, READ_FILE_UPLOAD_MAX_BYTES, directory_index, read_file_range
+from plugin_registry import PluginRegistry
+from screenshot import SCREENSHOT_GRABBER, ScreenshotCapture, new_screen_grabber
+from upload_cache import UploadCache, upload_cache_namespace
 
-class LocalAPI:
-    @staticmethod
-    def screenshot() -> str:
-        """截屏并返回本地临时文件地址"""
+setup_logging(logging.ERROR)
 
-        # 获取屏幕尺寸
-        win = tkinter.Tk()
-        width = win.winfo_screenwidth()
-        height = win.winfo_screenheight()
-        win.destroy()  # 关闭临时窗口
+# 端插件并发执行配置
+TOOL_CALL_WORKERS = int(os.getenv("TOOL_CALL_WORKERS", "4"))  # 同时执行的端插件数量
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", "30"))  # 单个端插件的超时时间, 秒
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "10"))  # 一次对话中最多执行几轮端插件
+# 端插件定义文件, 启动时加载
+PLUGIN_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.json")
+PLUGIN_OPENAPI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.yaml")
 
-        # 截取全屏并转换为 RGB 模式
-        img = ImageGrab.grab(bbox=(0, 0, width, height)).convert("RGB")
+tool_call_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_WORKERS, thread_name_prefix="tool_call")
+# 截屏, 屏幕尺寸只在第一次截屏时获取
+screenshot_capture = ScreenshotCapture(new_screen_grabber(SCREENSHOT_GRABBER))
 
-        # 生成临时文件路径 (更低级的方式)
-        fd, temp_path = tempfile.mkstemp(suffix=".jpg")
-        os.close(fd)
-        img.save(temp_path)
 
-        return temp_path
+class LocalAPI:
+    @staticmethod
+    def screenshot() -> bytes:
+        """截取全屏, 缩放后编码为 JPEG, 返回图片内容"""
+        data, _ = screenshot_capture.capture()
+        return data
 
     @staticmethod
-    def list_files(dir: str) -> List[dict]:
-        """获取目录下的文件列表, 返回名称和类型"""
-        return [{"name": i.name, "type": "file" if i.is_file() else "dir"} for i in os.scandir(dir)]
+    def list_files(
+        dir: str, pattern: Optional[str] = None, depth: int = 1, cursor: Optional[str] = None, limit: int = 200
+    ) -> dict:
+        """获取目录下 depth 层以内的文件列表, 返回名称、类型、大小和修改时间, 目录内容会被缓存"""
+        return directory_index.list(dir, pattern, depth, cursor, limit)
 
     @staticmethod
-    def read_file(path: str) -> str:
-        """读取文件内容"""
-        with open(path, "r") as f:
-            return f.read()
+    def read_file(path: str, offset: int = 0, length: Optional[int] = None) -> dict:
+        """按字节范围读取文件内容, 单次最多返回 READ_FILE_MAX_BYTES 字节"""
+        return read_file_range(path, offset, length)
 
 
+# 端插件处理函数, 入参已经按 plugin.yaml 中的定义校验过, 返回插件定义的出参
 class LocalPlugin:
-    def __init__(self, coze: Coze):
+    def __init__(self, coze: Coze, upload_cache: Optional[UploadCache] = None):
         self.coze = coze
+        self.upload_cache = upload_cache or UploadCache(path=None)
+
+    def screenshot(self) -> dict:
+        # 图片在内存中直接上传, 不写临时文件; 屏幕内容没有变化时复用之前上传的图片
+        file = self.upload_cache.upload(self.coze, ("screenshot.jpg", LocalAPI.screenshot()))
+        return {"image": file.id}  # 截图端插件定义的出参是 image, 类型是图片
+
+    def list_files(
+        self, dir: str, pattern: Optional[str] = None, depth: int = 1, cursor: Optional[str] = None, limit: int = 200
+    ) -> dict:
+        # list_files 端插件定义的入参是 dir, pattern, depth, cursor, limit
+        # 出参是 files, 类型是 name + type + size + mtime 的数组, 以及分页的 next_cursor
+        return LocalAPI.list_files(dir, pattern, depth, cursor, limit)
+
+    def read_file(self, path: str, offset: int = 0, length: Optional[int] = None, upload: bool = False) -> dict:
+        # read_file 端插件定义的入参是 path, offset, length, upload, 出参是 content, 类型是 string
+        # upload 为 true 并且文件超过单次读取的大小时, 把整个文件上传到扣子, 只返回文件 id, 不返回内容;
+        # 上传经过上传缓存, 相同内容的文件只上传一次, 超时后上传仍在后台继续, 再次调用时直接返回文件 id
+        size = os.path.getsize(path)
+        if upload and READ_FILE_MAX_BYTES < size <= READ_FILE_UPLOAD_MAX_BYTES:
+            file = self.upload_cache.upload(self.coze, path)
+            return {"size": size, "file": file.id, "content": ""}
+        return LocalAPI.read_file(path, offset, length)
+
+
+# 加载端插件定义, 并注册本地的三个插件(LocalAPI -> LocalPlugin): 获取目录、文件、截屏
+# 新增端插件时, 在 plugin.yaml 中定义后在这里注册即可; 耗时的插件可以使用 async 或 process 执行方式
+def build_plugin_registry(coze: Coze, upload_cache: Optional[UploadCache] = None) -> PluginRegistry:
+    registry = PluginRegistry.load(PLUGIN_MANIFEST_PATH, PLUGIN_OPENAPI_PATH)
+    local_plugin = LocalPlugin(coze, upload_cache)
+    # 使用 PIL.ImageGrab 截屏时依赖 tkinter, 需要在主线程执行
+    registry.register(
+        "screenshot", local_plugin.screenshot, executor="main" if SCREENSHOT_GRABBER == "pil" else "thread"
+    )
+    registry.register("list_files", local_plugin.list_files)
+    registry.register("read_file", local_plugin.read_file)
+    return registry
+
+
+# 记录每个端插件的调用次数、失败次数和耗时
+class ToolLatencyRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, latency_ms: float, ok: bool):
+        with self._lock:
+            self._latencies[name].append(latency_ms)
+            if not ok:
+                self._errors[name] += 1
 
-    def screenshot(self, tool_call_id: str, arguments: str) -> ToolOutput:
-        temp_path = LocalAPI.screenshot()
-        file = self.coze.files.upload(file=temp_path)
-        return ToolOutput(
-            tool_call_id=tool_call_id,
-            output=json.dumps({"image": file.id}),
-        )  # 截图端插件定义的出参是 image, 类型是图片
-
-    def list_files(self, tool_call_id: str, arguments: str) -> ToolOutput:
-        args = json.loads(arguments)
-        dir = args["dir"]  # list_files 端插件定义的入参是 dir
-        files = LocalAPI.list_files(dir)
-
-        return ToolOutput(
-            tool_call_id=tool_call_id, output=json.dumps({"files": files})
-        )  # list_files 端插件定义的出参是 files, 类型是 name + type 的数组
-
-    def read_file(self, tool_call_id: str, arguments: str) -> ToolOutput:
-        args = json.loads(arguments)
-        path = args["path"]  # read_file 端插件定义的入参是 path
-        content = LocalAPI.read_file(path)
-
-        return ToolOutput(
-            tool_call_id=tool_call_id,
-            output=json.dumps(
-                {
-                    "content": content,
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                name: {
+                    "count": len(latencies),
+                    "errors": self._errors[name],
+                    "avg_ms": round(sum(latencies) / len(latencies), 3),
+                    "max_ms": round(max(latencies), 3),
                 }
-            ),
-        )  # read_file 端插件定义的出参是 content, 类型是 string
+                for name, latencies in self._latencies.items()
+            }
 
 
-# 端插件处理器, 支持处理端插件 example 中的三个插件
-def handle_local_plugin(coze: Coze, event: ChatEvent):
-    required_action = event.chat.required_action
-    tool_call = required_action.submit_tool_outputs.tool_calls[0]
-    # 封装了本地的三个插件(LocalAPI -> LocalPlugin): 获取目录、文件、截屏
-    local_plugin = LocalPlugin(coze)
+tool_latency_recorder = ToolLatencyRecorder()
 
-    # 通过端插件中断事件中的 tool_call 信息, 并调用对应的插件处理器
-    if tool_call.function.name in ["screenshot", "list_files", "read_file"]:
+
+# 执行单个端插件, 出错时把错误信息作为插件输出返回给模型, 保证每个 tool_call 都有输出
+def run_tool_call(registry: PluginRegistry, tool_call) -> Tuple[ToolOutput, float, bool]:
+    name, arguments = tool_call.function.name, tool_call.function.arguments
+    start = time.perf_counter()
+    try:
+        result = registry.call(name, arguments)
+        output = ToolOutput(tool_call_id=tool_call.id, output=json.dumps(result, ensure_ascii=False))
+        ok = True
+    except Exception as e:
+        output = ToolOutput(tool_call_id=tool_call.id, output=json.dumps({"error": str(e)}, ensure_ascii=False))
+        ok = False
+    return output, (time.perf_counter() - start) * 1000, ok
+
+
+def record_tool_call(tool_call, latency_ms: float, ok: bool):
+    name = tool_call.function.name
+    tool_latency_recorder.record(name, latency_ms, ok)
+    print(f" > 端插件 {name} {'完成' if ok else '失败'}, 耗时 {latency_ms:.1f}ms")
+
+
+# 并发执行一次中断事件中的所有端插件, 按 tool_calls 的顺序返回输出
+def run_tool_calls(registry: PluginRegistry, tool_calls) -> List[ToolOutput]:
+    outputs: Dict[str, ToolOutput] = {}
+    started_at: Dict[str, float] = {}  # 每个插件真正开始执行的时间, 用于计算单个插件的超时
+
+    def run(tool_call):
+        started_at[tool_call.id] = time.monotonic()
+        return run_tool_call(registry, tool_call)
+
+    # 记录插件的输出和耗时, 超时后才完成的插件不会再走到这里
+    def finish(tool_call, output: ToolOutput, latency_ms: float, ok: bool):
+        record_tool_call(tool_call, latency_ms, ok)
+        outputs[tool_call.id] = output
+
+    pending: Dict[Future, object] = {}
+    for tool_call in tool_calls:
         print(f" > 执行端插件: {tool_call.function.name}, 参数: {tool_call.function.arguments}")
-        local_plugin_api = getattr(local_plugin, tool_call.function.name)
-        output = local_plugin_api(tool_call.id, tool_call.function.arguments)
-        handle_coze_stream(
-            coze,
-            "/v3/chat/submit_tool_outputs",
-            coze.chat.submit_tool_outputs(
+        if registry.executor_of(tool_call.function.name) != "main":
+            pending[tool_call_executor.submit(run, tool_call)] = tool_call
+    # 只能在主线程执行的插件, 在其他插件后台执行的同时依次执行
+    for tool_call in tool_calls:
+        if registry.executor_of(tool_call.function.name) == "main":
+            finish(tool_call, *run_tool_call(registry, tool_call))
+
+    while pending:
+        done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+        for future in done:
+            finish(pending.pop(future), *future.result())
+        now = time.monotonic()
+        for future, tool_call in list(pending.items()):
+            if tool_call.id in started_at and now - started_at[tool_call.id] > TOOL_CALL_TIMEOUT:
+                # 线程无法强制结束, 超时的插件会在后台执行完, 但结果会被丢弃
+                del pending[future]
+                name = tool_call.function.name
+                tool_latency_recorder.record(name, TOOL_CALL_TIMEOUT * 1000, False)
+                print(f" > 端插件 {name} 超时, 超过 {TOOL_CALL_TIMEOUT}s")
+                outputs[tool_call.id] = ToolOutput(
+                    tool_call_id=tool_call.id,
+                    output=json.dumps({"error": f"执行超时, 超过 {TOOL_CALL_TIMEOUT}s"}, ensure_ascii=False),
+                )
+
+    return [outputs[tool_call.id] for tool_call in tool_calls]
+
+
+# 一次对话(一次用户输入)的统计: 会话 id、首个 SSE 事件和首个 token 的耗时、总耗时、端插件轮数
+def new_turn_stats(started_at: Optional[float] = None) -> dict:
+    return {
+        "started_at": started_at or time.perf_counter(),
+        "conversation_id": None,
+        "first_event_ms": None,
+        "first_token_ms": None,
+        "total_ms": None,
+        "tool_rounds": 0,
+    }
+
+
+def record_turn_event(stats: dict, event: ChatEvent):
+    elapsed_ms = (time.perf_counter() - stats["started_at"]) * 1000
+    if stats["first_event_ms"] is None:
+        stats["first_event_ms"] = elapsed_ms
+    if stats["conversation_id"] is None and event.chat is not None:
+        stats["conversation_id"] = event.chat.conversation_id
+    if stats["first_token_ms"] is None and event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+        stats["first_token_ms"] = elapsed_ms
+
+
+def finish_turn_stats(stats: dict) -> dict:
+    stats["total_ms"] = (time.perf_counter() - stats.pop("started_at")) * 1000
+    return stats
+
+
+def format_turn_stats(stats: dict) -> str:
+    def ms(v):
+        return "-" if v is None else f"{v:.0f}ms"
+
+    return (
+        f" > 首个事件 {ms(stats['first_event_ms'])}, 首个 token {ms(stats['first_token_ms'])}, "
+        f"总耗时 {ms(stats['total_ms'])}, 端插件 {stats['tool_rounds']} 轮"
+    )
+
+
+# 对话驱动: 每次只处理一个 SSE 流, 流结束并关闭后, 再执行端插件、提交输出、处理下一个流
+# 多轮端插件调用不会产生递归, 同一时间也只占用一个连接
+class ChatDriver:
+    def __init__(self, coze: Coze, registry: PluginRegistry, max_rounds: int = MAX_TOOL_ROUNDS):
+        self.coze = coze
+        self.registry = registry
+        self.max_rounds = max_rounds  # 一次对话中最多执行几轮端插件
+
+    # 运行一次对话, 返回会话 id 和耗时统计; started_at 是发起请求的时间, 用于计算首包和首 token 耗时
+    def run(self, stream: Stream[ChatEvent], started_at: Optional[float] = None) -> dict:
+        self.stats = new_turn_stats(started_at)
+        api = "/v3/chat"
+        while True:
+            # 消费完当前的流, 返回端插件中断事件, 没有中断说明对话已经结束
+            event = self.handle_stream(api, stream)
+            if event is None:
+                return finish_turn_stats(self.stats)
+            self.stats["tool_rounds"] += 1
+            if self.stats["tool_rounds"] > self.max_rounds:
+                print(f"\n > 端插件调用超过 {self.max_rounds} 轮, 取消本次对话")
+                self.coze.chat.cancel(conversation_id=event.chat.conversation_id, chat_id=event.chat.id)
+                return finish_turn_stats(self.stats)
+
+            # 模型可能在一次中断中要求调用多个端插件, 并发执行后一次性提交所有输出
+            tool_calls = event.chat.required_action.submit_tool_outputs.tool_calls
+            outputs = run_tool_calls(self.registry, tool_calls)
+            api = "/v3/chat/submit_tool_outputs"
+            stream = self.coze.chat.submit_tool_outputs(
                 conversation_id=event.chat.conversation_id,
                 chat_id=event.chat.id,
-                tool_outputs=[output],
+                tool_outputs=outputs,
                 stream=True,
-            ),
+            )
+
+    # SSE 事件处理器
+    def handle_stream(self, api: str, stream: Stream[ChatEvent]) -> Optional[ChatEvent]:
+        # 本次示例处理 3 个事件: 一个是模型输出, 一个是端插件中断, 一个是输出 logid debug.
+        requires_action = None
+        try:
+            for i, event in enumerate(stream):
+                if i == 0:
+                    print(f"[{api}] logid: {event.response.logid}")
+                record_turn_event(self.stats, event)
+
+                # 模型输出事件, 直接 print 到控制台即可
+                if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    print(event.message.content, end="", flush=True)
+
+                # 端插件中断, 中断之后只剩 done 事件, 流结束后再处理
+                if event.event == ChatEventType.CONVERSATION_CHAT_REQUIRES_ACTION:
+                    requires_action = event
+
+                if event.event == ChatEventType.CONVERSATION_CHAT_FAILED:
+                    print(f"\n > 对话失败: {event.chat.last_error}")
+
+            # 收到 done 事件后继续迭代, 读完剩余的数据, httpx 读完响应后会关闭它, 连接放回连接池继续复用
+            for _ in stream:
+                pass
+        finally:
+            # 中途出错时流没有读完, cozepy 的 Stream 没有提供 close 方法, 只能关闭内部的 http 响应;
+            # 依赖 Stream._raw_response, 所以 pyproject.toml 中固定了 cozepy 的版本
+            stream._raw_response.close()
+        return requires_action
+
+
+# asyncio 版本的对话驱动, 基于 AsyncCoze, 一个进程可以同时运行多个对话
+class AsyncChatDriver:
+    def __init__(self, coze: AsyncCoze, registry: PluginRegistry, max_rounds: int = MAX_TOOL_ROUNDS):
+        self.coze = coze
+        self.registry = registry  # 端插件在线程中执行, 不阻塞事件循环; main 执行方式的插件在事件循环所在的主线程执行
+        self.max_rounds = max_rounds
+
+    async def run(self, stream: AsyncIterator[ChatEvent], started_at: Optional[float] = None) -> dict:
+        self.stats = new_turn_stats(started_at)
+        api = "/v3/chat"
+        while True:
+            event = await self.handle_stream(api, stream)
+            if event is None:
+                return finish_turn_stats(self.stats)
+            self.stats["tool_rounds"] += 1
+            if self.stats["tool_rounds"] > self.max_rounds:
+                print(f"\n > 端插件调用超过 {self.max_rounds} 轮, 取消本次对话")
+                await self.coze.chat.cancel(conversation_id=event.chat.conversation_id, chat_id=event.chat.id)
+                return finish_turn_stats(self.stats)
+
+            tool_calls = event.chat.required_action.submit_tool_outputs.tool_calls
+            outputs = await self.run_tool_calls(tool_calls)
+            api = "/v3/chat/submit_tool_outputs"
+            stream = self.coze.chat.submit_tool_outputs_stream(
+                conversation_id=event.chat.conversation_id,
+                chat_id=event.chat.id,
+                tool_outputs=outputs,
+            )
+
+    # 其他插件通过 to_thread 在线程池中并发执行; main 执行方式的插件 (如 tkinter 截屏) 只能在主线程执行,
+    # 在事件循环所在的线程中依次执行, 多个对话同时调用时也不会在多个线程中同时调用 tkinter
+    async def run_tool_calls(self, tool_calls) -> List[ToolOutput]:
+        main_calls = [t for t in tool_calls if self.registry.executor_of(t.function.name) == "main"]
+        other_calls = [t for t in tool_calls if t not in main_calls]
+        task = (
+            asyncio.create_task(asyncio.to_thread(run_tool_calls, self.registry, other_calls)) if other_calls else None
         )
 
+        outputs: Dict[str, ToolOutput] = {}
+        for tool_call in main_calls:
+            print(f" > 执行端插件: {tool_call.function.name}, 参数: {tool_call.function.arguments}")
+            if threading.current_thread() is not threading.main_thread():
+                error = json.dumps({"error": "只能在主线程执行, 事件循环不在主线程中"}, ensure_ascii=False)
+                output, latency_ms, ok = ToolOutput(tool_call_id=tool_call.id, output=error), 0.0, False
+            else:
+                output, latency_ms, ok = run_tool_call(self.registry, tool_call)
+            record_tool_call(tool_call, latency_ms, ok)
+            outputs[tool_call.id] = output
+        if task is not None:
+            for tool_call, output in zip(other_calls, await task):
+                outputs[tool_call.id] = output
+        return [outputs[tool_call.id] for tool_call in tool_calls]
 
-# SSE 事件处理器
-def handle_coze_stream(coze: Coze, api: str, stream: Stream[ChatEvent]):
-    # 本次示例处理 3 个事件: 一个是模型输出, 一个是端插件中断, 一个是输出 logid debug.
-    is_first_pkg = True
-    for event in stream:
-        if is_first_pkg:
-            print(f"[{api}] logid: {event.response.logid}")
+    async def handle_stream(self, api: str, stream: AsyncIterator[ChatEvent]) -> Optional[ChatEvent]:
+        requires_action, raw_response = None, None
+        try:
+            # 异步生成器关闭时不会关闭 http 响应, 需要从事件中取出内部的响应 (ChatEvent._raw_response) 关闭,
+            # 和同步版本一样依赖 pyproject.toml 中固定的 cozepy 版本
+            async for event in stream:
+                if raw_response is None:
+                    raw_response = event._raw_response
+                    print(f"[{api}] logid: {event.response.logid}")
+                record_turn_event(self.stats, event)
 
-        # 模型输出事件, 直接 print 到控制台即可
-        if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
-            print(event.message.content, end="", flush=True)
+                if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    print(event.message.content, end="", flush=True)
 
-        # 端插件中断, 需要根据端插件的类型分别处理, 比较复杂, 定义一个单独的函数处理
-        if event.event == ChatEventType.CONVERSATION_CHAT_REQUIRES_ACTION:
-            handle_local_plugin(coze, event)
+                if event.event == ChatEventType.CONVERSATION_CHAT_REQUIRES_ACTION:
+                    requires_action = event
 
-        is_first_pkg = False
+                if event.event == ChatEventType.CONVERSATION_CHAT_FAILED:
+                    print(f"\n > 对话失败: {event.chat.last_error}")
+        finally:
+            await stream.aclose()
+            if raw_response is not None:
+                await raw_response.aclose()
+        return requires_action
 
 
-# 运行端插件 example 智能体
-def run_local_plugin_app(token: str, api_base: str, bot_id: str, user_id: str, user_input: str):
-    # 使用 token 和 base_url 构建一个 coze python 客户端
-    coze = Coze(auth=TokenAuth(token), base_url=api_base)
-    # 使用 .chat.stream 发起一个 /v3/chat 流式对话
-    stream = coze.chat.stream(
-        bot_id=bot_id, user_id=user_id, additional_messages=[Message.build_user_question_text(user_input)]
-    )
-    # 这个 api 会返回一系列 SSE 事件, 定义一个函数来处理这些事件
-    handle_coze_stream(coze, "/v3/chat", stream)
+# 端插件对话会话: 在多次用户输入之间复用同一个扣子客户端(连接池)、端插件注册表和会话 id
+# 后续的输入会在同一个会话中继续对话, 并复用已经建立的 keep-alive 连接
+class LocalPluginSession:
+    def __init__(self, token: str, api_base: str, bot_id: str, user_id: str, max_rounds: int = MAX_TOOL_ROUNDS):
+        # 使用 token 和 base_url 构建一个 coze python 客户端
+        self.coze = Coze(auth=TokenAuth(token), base_url=api_base)
+        self.upload_cache = UploadCache(namespace=upload_cache_namespace(api_base, token))
+        self.registry = build_plugin_registry(self.coze, self.upload_cache)
+        self.driver = ChatDriver(self.coze, self.registry, max_rounds)
+        self.bot_id = bot_id
+        self.user_id = user_id
+        self.conversation_id: Optional[str] = None  # 第一次对话后由扣子生成
+
+    # 发送一次用户输入, 返回本次对话的耗时统计
+    def chat(self, user_input: str) -> dict:
+        started_at = time.perf_counter()
+        # 使用 .chat.stream 发起一个 /v3/chat 流式对话
+        stream = self.coze.chat.stream(
+            bot_id=self.bot_id,
+            user_id=self.user_id,
+            conversation_id=self.conversation_id,
+            additional_messages=[Message.build_user_question_text(user_input)],
+        )
+        # 这个 api 会返回一系列 SSE 事件, 由 ChatDriver 处理这些事件和端插件调用
+        stats = self.driver.run(stream, started_at)
+        self.conversation_id = self.conversation_id or stats["conversation_id"]
+        return stats
+
+
+# asyncio 版本的会话, 可以用 asyncio.gather 同时运行多个会话
+class AsyncLocalPluginSession:
+    def __init__(self, token: str, api_base: str, bot_id: str, user_id: str, max_rounds: int = MAX_TOOL_ROUNDS):
+        self.coze = AsyncCoze(auth=TokenAuth(token), base_url=api_base)
+        self.upload_cache = UploadCache(namespace=upload_cache_namespace(api_base, token))
+        # 端插件中的文件上传使用同步客户端
+        self.registry = build_plugin_registry(Coze(auth=TokenAuth(token), base_url=api_base), self.upload_cache)
+        self.driver = AsyncChatDriver(self.coze, self.registry, max_rounds)
+        self.bot_id = bot_id
+        self.user_id = user_id
+        self.conversation_id: Optional[str] = None
+
+    async def chat(self, user_input: str) -> dict:
+        started_at = time.perf_counter()
+        stream = self.coze.chat.stream(
+            bot_id=self.bot_id,
+            user_id=self.user_id,
+            conversation_id=self.conversation_id,
+            additional_messages=[Message.build_user_question_text(user_input)],
+        )
+        stats = await self.driver.run(stream, started_at)
+        self.conversation_id = self.conversation_id or stats["conversation_id"]
+        return stats
 
 
 # 主入口
@@ -154,10 +441,14 @@ if __name__ == "__main__":
     coze_bot_id = os.getenv("COZE_BOT_ID") or ("请配置你的扣子 bot_id" "please config your coze bot_id")
     your_user_id = secrets.token_urlsafe()
 
+    # 使用 token, bot_id 创建会话, 所有输入都在同一个会话中进行
+    session = LocalPluginSession(coze_token, coze_api_base, coze_bot_id, your_user_id)
+
     # 循环获取用户输入, 触发智能体和端插件
     while True:
         # 获取用户的输入, 在控制台输入
         your_user_input = input("\n-----\n请输入你的问题：")
 
-        # 使用 token, bot_id 和输入运行智能体对话
-        run_local_plugin_app(coze_token, coze_api_base, coze_bot_id, your_user_id, your_user_input)
+        # 运行智能体对话, 并输出本次对话的耗时
+        turn_stats = session.chat(your_user_input)
+        print("\n" + format_turn_stats(turn_stats))
@@ -0,0 +1,461 @@
+# 端插件的本地文件操作
+#
+# read_file: 按字节范围读取, 大文件使用 mmap, 自动识别编码, 限制单次返回的字节数
+# list_files: 递归列出目录, 支持 glob 过滤、深度限制和分页, 目录内容缓存在内存中,
+# 通过目录的 mtime (Linux 上优先使用 inotify) 判断是否需要重新扫描
+#
+# 性能测试:
+#
+#     # 对比一次性读取整个文件和按范围读取的耗时和内存
+#     python local_files.py read --sizes 1K,1M,100M,1G
+#     # 对比每次重新扫描和使用目录缓存列出 10 万个文件的耗时
+#     python local_files.py list --files 100000
+
+import codecs
+import ctypes
+import ctypes.util
+import fnmatch
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+READ_FILE_MAX_BYTES = int(os.getenv("READ_FILE_MAX_BYTES", str(64 * 1024)))  # 单次最多返回的字节数
+READ_FILE_MMAP_THRESHOLD = 1024 * 1024  # 超过这个大小的文件使用 mmap 读取
+READ_FILE_UPLOAD_MAX_BYTES = 512 * 1024 * 1024  # 扣子文件上传的大小限制
+ENCODING_SAMPLE_BYTES = 4096  # 识别编码时检查的字节数
+LIST_FILES_PAGE_SIZE = 200  # list_files 每页默认返回的条数
+LIST_FILES_MAX_QUERIES = 64  # 缓存的 list_files 查询结果数量
+
+# 文件开头的 BOM 和对应的编码
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+
+
+# 识别文本编码: 优先使用 BOM, 然后依次尝试 utf-8 和 gb18030, 包含 \0 的认为是二进制文件, 返回 None
+def detect_encoding(sample: bytes, at_start: bool = True) -> Optional[str]:
+    if at_start:
+        for bom, encoding in BOMS:
+            if sample.startswith(bom):
+                return encoding
+    if b"\0" in sample:
+        return None
+    for encoding in ("utf-8", "gb18030"):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            # 采样的结尾可能截断了一个多字节字符, 不作为错误
+            decoder.decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+# 文件开头的 BOM 对应的编码, 没有 BOM 时返回 None
+def file_bom_encoding(path: str) -> Optional[str]:
+    with open(path, "rb") as f:
+        head = f.read(len(codecs.BOM_UTF8))
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+# 读取文件 [offset, offset + length) 范围的字节
+def read_bytes(path: str, offset: int, length: int) -> bytes:
+    size = os.path.getsize(path)
+    end = min(size, offset + length)
+    if offset >= end:
+        return b""
+    with open(path, "rb") as f:
+        if size < READ_FILE_MMAP_THRESHOLD:
+            f.seek(offset)
+            return f.read(end - offset)
+        # 大文件使用 mmap, 只有实际访问的页会被读入内存
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[offset:end]
+
+
+# 按范围读取文本文件, 返回内容和下一段的 offset, 多字节字符不会被截断
+def read_file_range(
+    path: str, offset: int = 0, length: Optional[int] = None, max_bytes: int = READ_FILE_MAX_BYTES
+) -> dict:
+    # 负数的 length 会使 next_offset 等于 offset, 按 next_offset 分页读取的调用方会一直循环
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError(f"offset 和 length 不能为负数: offset={offset}, length={length}")
+    size = os.path.getsize(path)
+    offset = min(offset, size)
+    length = min(length or max_bytes, max_bytes)
+
+    # 从文件中间开始读时读到的内容中没有 BOM, 沿用文件开头的 BOM 对应的编码;
+    # utf-16 的文本中有大量 \0, 不能再通过内容识别, 起始位置按 2 字节对齐
+    encoding = file_bom_encoding(path) if offset > 0 else None
+    if encoding == "utf-8-sig":
+        encoding = "utf-8"
+    utf16 = encoding in ("utf-16-le", "utf-16-be")
+    if utf16:
+        offset -= offset % 2
+    data = read_bytes(path, offset, length)
+
+    skip = 0
+    if utf16:
+        # 开头是代理对的后半部分时跳过, 不解码成替换字符
+        unit = int.from_bytes(data[:2], "little" if encoding.endswith("le") else "big")
+        if len(data) >= 2 and 0xDC00 <= unit <= 0xDFFF:
+            skip = 2
+    elif offset > 0:
+        # 开头可能是不完整的 utf-8 字符, 先跳过再识别编码
+        while skip < min(3, len(data)) and data[skip] & 0xC0 == 0x80:
+            skip += 1
+    if encoding is None:
+        encoding = detect_encoding(data[skip : skip + ENCODING_SAMPLE_BYTES], at_start=offset == 0)
+        if encoding != "utf-8":
+            skip = 0
+        # utf-16-le/be 的解码器不会去掉 BOM, 和 utf-8-sig 一样不返回 BOM, 分段读取的内容可以直接拼接
+        if offset == 0 and encoding in ("utf-16-le", "utf-16-be"):
+            skip = len(codecs.BOM_UTF16_LE)
+    result = {"size": size, "offset": offset, "encoding": encoding}
+    if encoding is None:
+        result.update(content="", length=0, next_offset=None, binary=True)
+        return result
+
+    # 末尾不完整的字符留给下一段读取
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    end_of_file = offset + len(data) >= size
+    content = decoder.decode(data[skip:], final=end_of_file)
+    pending = len(decoder.getstate()[0])
+    read = len(data) - pending
+
+    result.update(
+        offset=offset + skip,
+        content=content,
+        length=read - skip,
+        next_offset=None if offset + read >= size else offset + read,
+    )
+    return result
+
+
+# 基于 ctypes 的 inotify 监听, 目录中有文件新增、删除、修改时回调, 不依赖第三方库
+# 只在 Linux 上可用, 超过系统的监听数量限制时, 对应的目录退回到 mtime 检查
+class InotifyWatcher:
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    WATCH_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    )
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, on_change: Callable[[Optional[str]], None]):
+        self.on_change = on_change  # 参数为变化的目录, None 表示事件丢失, 需要全部失效
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self._lock = threading.Lock()
+        self._paths: Dict[int, str] = {}  # watch descriptor -> 目录
+        self._watching: Dict[str, int] = {}
+        threading.Thread(target=self._run, name="inotify", daemon=True).start()
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(os, "O_CLOEXEC") and os.uname().sysname == "Linux"
+
+    def watching(self, path: str) -> bool:
+        return path in self._watching
+
+    def watch(self, path: str) -> bool:
+        with self._lock:
+            if path in self._watching:
+                return True
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK | self.IN_ONLYDIR)
+            if wd < 0:
+                return False
+            self._paths[wd] = path
+            self._watching[path] = wd
+            return True
+
+    def _run(self):
+        while True:
+            buf = os.read(self._fd, 64 * 1024)
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(buf, pos)
+                pos += self.EVENT_HEADER.size + name_len
+                if mask & self.IN_Q_OVERFLOW:
+                    self.on_change(None)
+                    continue
+                with self._lock:
+                    path = self._paths.get(wd)
+                    if mask & self.IN_IGNORED and path is not None:
+                        del self._paths[wd]
+                        self._watching.pop(path, None)
+                if path is not None:
+                    self.on_change(path)
+
+
+# 把 glob 编译成正则, 包含 / 时匹配相对路径, 否则只匹配文件名
+def compile_pattern(pattern: Optional[str]) -> Optional[Callable[[str, str], bool]]:
+    if not pattern:
+        return None
+    regex = re.compile(fnmatch.translate(pattern))
+    if "/" in pattern:
+        return lambda name, rel: regex.match(rel) is not None
+    return lambda name, rel: regex.match(name) is not None
+
+
+# 目录索引: 缓存每个目录的文件列表和 stat 信息, 以及 list_files 的查询结果
+# 目录被 inotify 监听时, 只有收到变化事件才重新扫描; 否则每次检查目录的 mtime
+# 注意: 没有 inotify 时, 只修改文件内容不会改变目录的 mtime, 返回的 size 和 mtime 可能是旧的
+class DirectoryIndex:
+    def __init__(self, use_inotify: bool = True):
+        self.use_inotify = use_inotify
+        self.version = 0  # 任意目录变化时加一, 用于判断查询结果是否失效
+        self._lock = threading.Lock()
+        # 目录 -> (目录 mtime, [(名称, 是否目录, 大小, 修改时间)])
+        self._dirs: Dict[str, Tuple[int, List[tuple]]] = {}
+        # (目录, glob, 深度) -> (version, 结果, 没有被监听的目录及其 mtime)
+        self._queries: Dict[tuple, tuple] = {}
+        self._watcher: Optional[InotifyWatcher] = None
+        self._watcher_started = False
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher_started:
+                return
+            self._watcher_started = True
+        if self.use_inotify and InotifyWatcher.available():
+            try:
+                self._watcher = InotifyWatcher(self._invalidate)
+            except OSError:
+                self._watcher = None
+
+    def _invalidate(self, path: Optional[str]):
+        with self._lock:
+            self.version += 1
+            if path is None:
+                self._dirs.clear()
+            else:
+                self._dirs.pop(path, None)
+
+    # 返回目录下的条目, 目录没有变化时直接使用缓存; 第二个返回值为目录的 mtime, 目录被 inotify 监听时为 None
+    def entries(self, path: str) -> Tuple[List[tuple], Optional[int]]:
+        watched = self._watcher is not None and self._watcher.watch(path)  # 先监听再扫描, 不会漏掉扫描期间的变化
+        cached = self._dirs.get(path)
+        if cached is not None and watched:
+            return cached[1], None
+        version = self.version
+        mtime = os.stat(path).st_mtime_ns
+        if cached is not None and cached[0] == mtime:
+            return cached[1], None if watched else mtime
+
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    size, modified = (None if is_dir else stat.st_size), int(stat.st_mtime)
+                except OSError:
+                    size, modified = None, None
+                entries.append((entry.name, is_dir, size, modified))
+        entries.sort()
+        with self._lock:
+            # 扫描期间目录发生了变化, 不缓存这次的结果
+            if self.version == version:
+                self._dirs[path] = (mtime, entries)
+        return entries, None if watched else mtime
+
+    # 按深度优先遍历目录, 返回匹配的条目, 以及没有被 inotify 监听的目录和它们的 mtime
+    def _walk(self, root: str, match, depth: int) -> Tuple[List[dict], List[Tuple[str, int]]]:
+        results, unwatched = [], []
+        stack = [(root, "", 1)]
+        while stack:
+            path, prefix, level = stack.pop()
+            try:
+                entries, mtime = self.entries(path)
+            except OSError:
+                continue  # 没有权限或者已经被删除的子目录
+            if mtime is not None:
+                unwatched.append((path, mtime))
+            subdirs = []
+            for name, is_dir, size, modified in entries:
+                rel = prefix + name
+                if match is None or match(name, rel):
+                    results.append({"name": rel, "type": "dir" if is_dir else "file", "size": size, "mtime": modified})
+                if is_dir and level < depth:
+                    subdirs.append((os.path.join(path, name), rel + "/", level + 1))
+            stack.extend(reversed(subdirs))
+        return results, unwatched
+
+    # 查询结果是否还有效: 期间没有收到 inotify 事件, 并且没有被监听的目录 mtime 都没有变化
+    def _is_fresh(self, cached: tuple, version: int) -> bool:
+        cached_version, _, unwatched = cached
+        if cached_version != version:
+            return False
+        try:
+            return all(os.stat(path).st_mtime_ns == mtime for path, mtime in unwatched)
+        except OSError:
+            return False
+
+    # 列出 root 下 depth 层以内的文件, cursor 为上一页返回的 next_cursor
+    def list(
+        self,
+        root: str,
+        pattern: Optional[str] = None,
+        depth: int = 1,
+        cursor: Optional[str] = None,
+        limit: int = LIST_FILES_PAGE_SIZE,
+    ) -> dict:
+        self._start_watcher()
+        root = os.path.abspath(root)
+        if not os.path.isdir(root):
+            raise ValueError(f"目录不存在: {root}")
+        key = (root, pattern, max(1, depth))
+        offset = int(cursor) if cursor else 0
+
+        with self._lock:
+            version, cached = self.version, self._queries.get(key)
+        if cached is not None and self._is_fresh(cached, version):
+            results = cached[1]
+        else:
+            results, unwatched = self._walk(root, compile_pattern(pattern), key[2])
+            with self._lock:
+                self._queries.pop(key, None)
+                self._queries[key] = (version, results, unwatched)
+                if len(self._queries) > LIST_FILES_MAX_QUERIES:
+                    del self._queries[next(iter(self._queries))]
+
+        end = offset + max(1, limit)
+        return {
+            "files": results[offset:end],
+            "total": len(results),
+            "next_cursor": str(end) if end < len(results) else None,
+        }
+
+
+directory_index = DirectoryIndex()
+
+
+# 性能测试: read_file
+def benchmark_read(sizes, old_max: int):
+    import json
+    import tempfile
+    import time
+    import tracemalloc
+
+    def parse_size(s):
+        units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+        return int(s[:-1]) * units[s[-1].upper()] if s[-1].upper() in units else int(s)
+
+    def measure(f):
+        tracemalloc.start()
+        start = time.perf_counter()
+        payload = f()
+        cost_ms = (time.perf_counter() - start) * 1000
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return cost_ms, peak, len(payload)
+
+    line = "2025-01-01 00:00:00 INFO 示例日志 example log line for read_file benchmark\n".encode("utf-8")
+    print(f"{'size':>6} {'mode':<6} {'cost ms':>10} {'peak MB':>10} {'output KB':>10}")
+    for label in sizes.split(","):
+        size = parse_size(label)
+        fd, path = tempfile.mkstemp(suffix=".log")
+        with os.fdopen(fd, "wb") as f:
+            block = line * (1024 * 1024 // len(line) + 1)
+            written = 0
+            while written < size:
+                chunk = block[: size - written]
+                f.write(chunk)
+                written += len(chunk)
+        try:
+            rows = []
+            if size <= old_max:
+
+                def old():
+                    with open(path, "r") as f:
+                        return json.dumps({"content": f.read()})
+
+                rows.append(("old", measure(old)))
+
+            rows.append(("range", measure(lambda: json.dumps(read_file_range(path), ensure_ascii=False))))
+            for mode, (cost_ms, peak, out) in rows:
+                print(f"{label:>6} {mode:<6} {cost_ms:>10.2f} {peak / 1024**2:>10.2f} {out / 1024:>10.1f}")
+        finally:
+            os.remove(path)
+
+
+# 性能测试: list_files, 生成 files 个文件, 每个目录 1000 个
+def benchmark_list(files: int, rounds: int):
+    import shutil
+    import tempfile
+    import time
+
+    root = tempfile.mkdtemp(prefix="list_files_")
+    try:
+        for i in range(files):
+            if i % 1000 == 0:
+                subdir = os.path.join(root, f"dir_{i // 1000:04d}")
+                os.makedirs(subdir)
+            open(os.path.join(subdir, f"file_{i:06d}.txt"), "w").close()
+
+        def scan():
+            results = []
+            for path, dirs, names in os.walk(root):
+                for name in dirs + names:
+                    stat = os.stat(os.path.join(path, name))
+                    results.append({"name": name, "size": stat.st_size, "mtime": int(stat.st_mtime)})
+            return results
+
+        def timeit(f):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                f()
+            return (time.perf_counter() - start) / rounds * 1000
+
+        print(f"文件数 {files}, 目录数 {files // 1000}, 每次列出 depth=3, 每页 200 条")
+        print(f"  每次重新扫描:         {timeit(scan):10.2f}ms")
+        for name, use_inotify in (("mtime 检查", False), ("inotify", True)):
+            index = DirectoryIndex(use_inotify=use_inotify)
+            start = time.perf_counter()
+            index.list(root, depth=3)
+            first_ms = (time.perf_counter() - start) * 1000
+            repeat_ms = timeit(lambda: index.list(root, depth=3, cursor="1000"))
+            print(f"  {name:<10} 首次:       {first_ms:10.2f}ms")
+            print(f"  {name:<10} 再次:       {repeat_ms:10.3f}ms")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="端插件本地文件操作性能测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    read_parser = sub.add_parser("read", help="read_file 性能测试")
+    read_parser.add_argument("--sizes", default="1K,1M,100M,1G")
+    read_parser.add_argument(
+        "--old-max", default=256 * 1024 * 1024, type=int, help="超过这个大小不测试一次性读取, 避免内存不足"
+    )
+    list_parser = sub.add_parser("list", help="list_files 性能测试")
+    list_parser.add_argument("--files", default=100000, type=int)
+    list_parser.add_argument("--rounds", default=20, type=int)
+    args = parser.parse_args()
+    if args.command == "read":
+        benchmark_read(args.sizes, args.old_max)
+    else:
+        benchmark_list(args.files, args.rounds)
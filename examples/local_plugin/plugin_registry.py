@@ -0,0 +1,166 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 端插件的执行方式
+# thread: 普通同步函数, 在端插件线程池中执行 (默认)
+# main: 依赖 tkinter 等 GUI 库的函数, 在部分系统(如 macOS)上只能在主线程执行
+# async: async 函数, 在后台的事件循环中执行
+# process: CPU 密集的同步函数, 在进程池中执行, 不占用 GIL; 函数和参数需要可以被 pickle
+EXECUTORS = ("thread", "main", "async", "process")
+
+# openapi 中的参数类型对应的 python 类型
+SCHEMA_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+class PluginArgumentError(Exception):
+    pass
+
+
+# 读取 openapi 文件, 支持 yaml 和 json 格式
+def load_openapi(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise Exception("读取 yaml 格式的端插件定义需要安装 pyyaml: pip install pyyaml")
+        return yaml.safe_load(f)
+
+
+# 把 openapi 中一个接口的参数定义编译成校验函数: 填充默认值、检查必填参数和参数类型
+def compile_validator(operation: dict) -> Callable[[dict], dict]:
+    # (参数名, 允许的类型, 是否必填, 默认值, 最小值)
+    fields: List[Tuple[str, Optional[tuple], bool, Any, Any]] = []
+    for param in operation.get("parameters") or []:
+        schema = param.get("schema") or {}
+        fields.append(
+            (
+                param["name"],
+                SCHEMA_TYPES.get(schema.get("type")),
+                bool(param.get("required")),
+                schema.get("default"),
+                schema.get("minimum"),
+            )
+        )
+    for content in ((operation.get("requestBody") or {}).get("content") or {}).values():
+        schema = content.get("schema") or {}
+        required = set(schema.get("required") or [])
+        for name, prop in (schema.get("properties") or {}).items():
+            fields.append(
+                (name, SCHEMA_TYPES.get(prop.get("type")), name in required, prop.get("default"), prop.get("minimum"))
+            )
+
+    def validate(args: dict) -> dict:
+        values = {}
+        for name, types, required, default, minimum in fields:
+            value = args.get(name, default)
+            if value is None:
+                if required:
+                    raise PluginArgumentError(f"缺少参数 {name}")
+                continue
+            # bool 是 int 的子类, integer 和 number 类型需要单独排除
+            if types and (not isinstance(value, types) or (isinstance(value, bool) and bool not in types)):
+                raise PluginArgumentError(f"参数 {name} 类型错误: {type(value).__name__}")
+            if minimum is not None and isinstance(value, (int, float)) and value < minimum:
+                raise PluginArgumentError(f"参数 {name} 不能小于 {minimum}: {value}")
+            values[name] = value
+        return values
+
+    return validate
+
+
+# 一个端插件: 参数校验函数、处理函数和执行方式
+class PluginOperation:
+    def __init__(self, name: str, validate: Callable[[dict], dict]):
+        self.name = name
+        self.validate = validate
+        self.handler: Optional[Callable] = None
+        self.executor = "thread"
+
+
+# 端插件注册表: 启动时读取 plugin.json 和 plugin.yaml, 为每个 operationId 预编译参数校验,
+# 执行时按名称从字典中找到处理函数, 不需要遍历和反射
+class PluginRegistry:
+    def __init__(self, manifest: dict, openapi: dict, process_workers: Optional[int] = None):
+        self.manifest = manifest
+        self.operations: Dict[str, PluginOperation] = {}
+        for methods in (openapi.get("paths") or {}).values():
+            for operation in methods.values():
+                name = operation.get("operationId") or operation.get("x-functionName")
+                if name:
+                    self.operations[name] = PluginOperation(name, compile_validator(operation))
+        self._process_workers = process_workers
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, manifest_path: str = "plugin.json", openapi_path: str = "plugin.yaml", **kwargs) -> "PluginRegistry":
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return cls(manifest, load_openapi(openapi_path), **kwargs)
+
+    # 注册处理函数, 处理函数使用校验后的参数作为关键字参数调用, 返回插件定义的出参 dict
+    def register(self, name: str, handler: Callable, executor: str = "thread"):
+        if name not in self.operations:
+            raise ValueError(f"端插件定义中没有 {name}")
+        if executor not in EXECUTORS:
+            raise ValueError(f"不支持的执行方式: {executor}")
+        self.operations[name].handler = handler
+        self.operations[name].executor = executor
+
+    # 装饰器形式的 register
+    def handler(self, name: str, executor: str = "thread"):
+        def decorator(f):
+            self.register(name, f, executor)
+            return f
+
+        return decorator
+
+    def executor_of(self, name: str) -> Optional[str]:
+        operation = self.operations.get(name)
+        return operation.executor if operation else None
+
+    # 校验参数并执行端插件, 在调用方的线程中同步等待结果
+    def call(self, name: str, arguments: str) -> dict:
+        operation = self.operations.get(name)
+        if operation is None or operation.handler is None:
+            raise ValueError(f"不支持的端插件: {name}")
+        args = operation.validate(json.loads(arguments) if arguments else {})
+
+        if operation.executor == "async":
+            return asyncio.run_coroutine_threadsafe(operation.handler(**args), self._event_loop()).result()
+        if operation.executor == "process":
+            return self._pool().submit(operation.handler, **args).result()
+        return operation.handler(**args)
+
+    def close(self):
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # async 端插件共用一个后台事件循环, 第一次使用时创建
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="plugin_loop", daemon=True).start()
+            return self._loop
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self._process_workers)
+            return self._process_pool
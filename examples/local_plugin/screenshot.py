@@ -0,0 +1,183 @@
+# 端插件的截屏: 屏幕尺寸只获取一次, 截图缩放后直接编码到内存中, 不写临时文件
+#
+# 可以通过环境变量配置:
+#
+#     SCREENSHOT_GRABBER: 截屏方式, pil (默认, 使用 PIL.ImageGrab) 或 fake (生成测试图片, 无需显示器)
+#     SCREENSHOT_MAX_SIDE: 图片最长边的像素数, 超过时等比例缩小, 默认 1920
+#     SCREENSHOT_QUALITY: JPEG 质量, 1~95, 默认 80
+#
+# 性能测试, 对比原来的截屏流程和新流程的耗时:
+#
+#     python screenshot.py --grabber fake --size 2560x1440
+
+import io
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from PIL import Image
+
+SCREENSHOT_GRABBER = os.getenv("SCREENSHOT_GRABBER", "pil")
+SCREENSHOT_MAX_SIDE = int(os.getenv("SCREENSHOT_MAX_SIDE", "1920"))
+SCREENSHOT_QUALITY = int(os.getenv("SCREENSHOT_QUALITY", "80"))
+
+
+# 截屏方式: 返回屏幕尺寸和截取指定区域
+class ScreenGrabber:
+    def geometry(self) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    def grab(self, bbox: Tuple[int, int, int, int]) -> Image.Image:
+        raise NotImplementedError
+
+
+# 使用 PIL.ImageGrab 截屏, 屏幕尺寸通过 tkinter 获取一次后缓存
+# Linux 上需要 X11 显示 (可以使用 Xvfb)
+class PILScreenGrabber(ScreenGrabber):
+    def __init__(self):
+        self._geometry: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def geometry(self) -> Tuple[int, int]:
+        with self._lock:
+            if self._geometry is None:
+                import tkinter
+
+                win = tkinter.Tk()
+                self._geometry = (win.winfo_screenwidth(), win.winfo_screenheight())
+                win.destroy()  # 关闭临时窗口
+            return self._geometry
+
+    def grab(self, bbox: Tuple[int, int, int, int]) -> Image.Image:
+        from PIL import ImageGrab
+
+        return ImageGrab.grab(bbox=bbox)
+
+
+# 生成测试图片的截屏方式, 用于没有显示器的环境测试和性能测试
+class FakeScreenGrabber(ScreenGrabber):
+    def __init__(self, width: int = 2560, height: int = 1440):
+        self.width = width
+        self.height = height
+        # 使用渐变加噪声, 接近真实截图的编码开销
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 64)
+        self._image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+    def geometry(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def grab(self, bbox: Tuple[int, int, int, int]) -> Image.Image:
+        return self._image.crop(bbox)
+
+
+# 截屏并编码为 JPEG, 返回图片内容和耗时信息
+class ScreenshotCapture:
+    def __init__(
+        self,
+        grabber: ScreenGrabber,
+        max_side: int = SCREENSHOT_MAX_SIDE,
+        quality: int = SCREENSHOT_QUALITY,
+    ):
+        self.grabber = grabber
+        self.max_side = max_side
+        self.quality = quality
+
+    def capture(self) -> Tuple[bytes, dict]:
+        start = time.perf_counter()
+        width, height = self.grabber.geometry()
+        img = self.grabber.grab((0, 0, width, height))
+        grabbed = time.perf_counter()
+
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        # 等比例缩小到最长边不超过 max_side: 先按整数倍缩小 (如高分屏的 2 倍), 剩余部分再用 BOX 缩放
+        if max(img.size) > self.max_side:
+            factor = max(img.size) // self.max_side
+            if factor >= 2:
+                img = img.reduce(factor)
+            if max(img.size) > self.max_side:
+                scale = self.max_side / max(img.size)
+                size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+                img = img.resize(size, Image.Resampling.BOX)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=self.quality)
+        encoded = time.perf_counter()
+
+        return buf.getvalue(), {
+            "width": img.width,
+            "height": img.height,
+            "bytes": buf.tell(),
+            "grab_ms": (grabbed - start) * 1000,
+            "encode_ms": (encoded - grabbed) * 1000,
+        }
+
+
+# 根据配置创建截屏方式
+def new_screen_grabber(name: str = SCREENSHOT_GRABBER) -> ScreenGrabber:
+    if name == "fake":
+        return FakeScreenGrabber()
+    if name == "pil":
+        return PILScreenGrabber()
+    raise ValueError(f"不支持的截屏方式: {name}")
+
+
+# 性能测试: 原来的流程每次都会启动 tkinter 获取屏幕尺寸, 并把全尺寸图片写入临时文件
+def benchmark(grabber: ScreenGrabber, rounds: int, max_side: int, quality: int):
+    import statistics
+    import tempfile
+
+    def old():
+        try:
+            import tkinter
+
+            win = tkinter.Tk()
+            win.winfo_screenwidth(), win.winfo_screenheight()
+            win.destroy()
+        except Exception:
+            pass  # 没有显示器时跳过, 结果会比实际偏快
+        width, height = grabber.geometry()
+        img = grabber.grab((0, 0, width, height)).convert("RGB")
+        fd, temp_path = tempfile.mkstemp(suffix=".jpg")
+        os.close(fd)
+        img.save(temp_path)
+        size = os.path.getsize(temp_path)
+        os.remove(temp_path)
+        return size
+
+    capture = ScreenshotCapture(grabber, max_side=max_side, quality=quality)
+
+    def new():
+        return len(capture.capture()[0])
+
+    print(f"屏幕 {grabber.geometry()[0]}x{grabber.geometry()[1]}, 执行 {rounds} 次")
+    for name, f in (("原流程", old), ("新流程", new)):
+        f()  # 预热
+        latencies, size = [], 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            size = f()
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+        print(f"  {name}: p50 {statistics.median(latencies):8.1f}ms, p99 {p99:8.1f}ms, 图片 {size / 1024:8.1f}KB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="截屏性能测试")
+    parser.add_argument("--grabber", default="fake", choices=["fake", "pil"])
+    parser.add_argument("--size", default="2560x1440", help="fake 截屏方式的屏幕尺寸")
+    parser.add_argument("--rounds", default=20, type=int)
+    parser.add_argument("--max-side", default=SCREENSHOT_MAX_SIDE, type=int)
+    parser.add_argument("--quality", default=SCREENSHOT_QUALITY, type=int)
+    args = parser.parse_args()
+
+    if args.grabber == "fake":
+        w, h = args.size.split("x")
+        grabber = FakeScreenGrabber(int(w), int(h))
+    else:
+        grabber = PILScreenGrabber()
+    benchmark(grabber, args.rounds, args.max_side, args.quality)
@@ -0,0 +1,413 @@
+# 各个示例的端到端性能测试: 启动本地模拟的扣子 API (mock_coze.py), 依次运行各个示例的流程,
+# 统计每个流程的 p50/p99 延迟、吞吐和峰值内存 (RSS), 结果可以保存下来和其他提交的结果对比
+#
+#     python benchmark.py --flows all --requests 50 --concurrency 5 --latency-ms 20 --output new.json
+#     python benchmark.py --compare old.json new.json
+#
+# 每个示例流程在单独的子进程中运行, 峰值内存互不影响; 渠道服务的流程复用 async_connector/loadtest.py,
+# 统计的是渠道服务进程的峰值内存
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.dirname(HERE)
+AUDIO_CHAT_DIR = os.path.join(EXAMPLES, "audio_chat_with_vision_image")
+LOCAL_PLUGIN_DIR = os.path.join(EXAMPLES, "local_plugin")
+CONNECTOR_DIR = os.path.join(EXAMPLES, "custom_connector", "async_connector")
+
+# 在子进程中运行的示例流程
+CLIENT_FLOWS = ["http_chat", "websocket_chat", "agent_chat"]
+# 渠道服务的压测场景, 见 async_connector/loadtest.py
+CONNECTOR_FLOWS = [
+    "connector_callback",
+    "connector_bots",
+    "connector_users_me",
+    "connector_oauth",
+]
+
+
+def summarize(flow: str, latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    total = len(latencies)
+    return {
+        "flow": flow,
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99_ms": latencies[max(0, int(total * 0.99) - 1)] * 1000 if latencies else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# 在线程池中并发执行 total 次 fn(i), 返回统计结果
+def run_threads(
+    flow: str, fn: Callable[[int], None], total: int, concurrency: int
+) -> dict:
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            fn(i)
+            ok = True
+        except Exception:
+            ok = False
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            errors += 0 if ok else 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return summarize(flow, latencies, errors, time.perf_counter() - start)
+
+
+# http_chat.run_app: 上传语音和图片, 然后通过 /v3/chat 流式对话
+def flow_http_chat(api_base: str, total: int, concurrency: int) -> dict:
+    sys.path.insert(0, AUDIO_CHAT_DIR)
+    os.environ["COZE_UPLOAD_CACHE_PATH"] = ""  # 每次都真正上传
+    import http_chat
+
+    audio_path = os.path.join(AUDIO_CHAT_DIR, "input_audio.wav")
+    image_path = os.path.join(AUDIO_CHAT_DIR, "input_coze.png")
+    workdir = tempfile.mkdtemp(prefix="benchmark_http_chat_")
+
+    # 多个线程同时对话, 每次对话的语音写入不同的文件
+    def one(i):
+        http_chat.run_app(
+            api_base,
+            "mock_token",
+            "mock_bot",
+            audio_path,
+            image_path,
+            output_path=os.path.join(workdir, f"output_{i}.wav"),
+        )
+
+    return run_threads("http_chat", one, total, concurrency)
+
+
+# websocket_chat: 每个对话一个 websocket 连接, 发送语音后等待回复的语音写入文件
+def flow_websocket_chat(api_base: str, total: int, concurrency: int) -> dict:
+    sys.path.insert(0, AUDIO_CHAT_DIR)
+    from audio_uplink import AudioUplink, WavAudioSource
+    from cozepy import AsyncCoze, AsyncWebsocketsChatClient, TokenAuth
+    from websocket_chat import WebsocketsChatEventHandler
+
+    workdir = tempfile.mkdtemp(prefix="benchmark_websocket_chat_")
+    ws_base_url = api_base.replace("http://", "ws://")
+    audio_path = os.path.join(AUDIO_CHAT_DIR, "input_audio.wav")
+
+    async def main():
+        coze = AsyncCoze(auth=TokenAuth("mock_token"), base_url=api_base)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    handler = WebsocketsChatEventHandler(
+                        os.path.join(workdir, f"output_{i}.wav"), verbose=False
+                    )
+                    # 模拟服务使用 ws://, SDK 的 coze.websockets 只支持 https 地址, 这里直接创建客户端
+                    client = AsyncWebsocketsChatClient(
+                        base_url=ws_base_url,
+                        requester=coze._requester,
+                        bot_id="mock_bot",
+                        on_event=handler,
+                    )
+                    async with client() as client:
+                        with WavAudioSource(audio_path) as source:
+                            # 不按真实说话速度发送, 只测量客户端和协议的开销
+                            await AudioUplink(client, realtime=False).send(
+                                source.chunks(), source.bytes_per_second
+                            )
+                        await client.input_audio_buffer_complete()
+                        await asyncio.wait_for(client.wait(), 60)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(total)])
+        return summarize(
+            "websocket_chat", latencies, errors, time.perf_counter() - start
+        )
+
+    return asyncio.run(main())
+
+
+# agent_chat: 端插件对话, 模拟服务会先要求调用 list_files 端插件, 提交结果后再回复
+def flow_agent_chat(api_base: str, total: int, concurrency: int) -> dict:
+    sys.path.insert(0, LOCAL_PLUGIN_DIR)
+    os.environ["COZE_UPLOAD_CACHE_PATH"] = ""
+    os.environ.setdefault("SCREENSHOT_GRABBER", "fake")
+    import agent_chat
+
+    # 每个并发一个会话, 会话内的多次输入复用连接和会话 id
+    sessions = [
+        agent_chat.LocalPluginSession(
+            "mock_token", api_base, "plugin_mock_bot", f"user_{i}"
+        )
+        for i in range(concurrency)
+    ]
+    local = threading.local()
+    counter = iter(range(concurrency))
+    counter_lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, "session"):
+            with counter_lock:
+                local.session = sessions[next(counter)]
+        local.session.chat("列出示例目录中的文件")
+
+    return run_threads("agent_chat", one, total, concurrency)
+
+
+FLOW_RUNNERS = {
+    "http_chat": flow_http_chat,
+    "websocket_chat": flow_websocket_chat,
+    "agent_chat": flow_agent_chat,
+}
+
+
+# 子进程入口: 运行一个示例流程, 最后一行输出 json 格式的结果
+def run_worker(flow: str, api_base: str, total: int, concurrency: int):
+    # 示例会打印对话内容, 丢弃这些输出, 避免影响结果和刷屏
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = FLOW_RUNNERS[flow](api_base, total, concurrency)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def run_client_flow(flow: str, api_base: str, total: int, concurrency: int) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", flow]
+    cmd += ["--api-base", api_base]
+    cmd += ["--requests", str(total), "--concurrency", str(concurrency)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        raise Exception(f"{flow} 运行失败:\n{proc.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+# 进程的峰值内存, 在进程退出前读取
+def process_peak_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+async def run_connector_flow(
+    flow: str, target: str, mock_url: str, port: int, total: int, concurrency: int
+) -> dict:
+    sys.path.insert(0, CONNECTOR_DIR)
+    import loadtest
+
+    scenario = flow[len("connector_") :]
+    url = f"http://127.0.0.1:{port}"
+    server = loadtest.start_server(target, scenario, port, mock_url)
+    try:
+        await loadtest.wait_ready(url)
+        result = await loadtest.run_load(url, scenario, concurrency, total)
+        peak = process_peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "flow": f"{flow}_{target}",
+        "requests": result["requests"],
+        "errors": result["errors"],
+        "rps": result["rps"],
+        "p50_ms": result["p50_ms"],
+        "p99_ms": result["p99_ms"],
+        "peak_rss_mb": peak,
+    }
+
+
+def start_mock(args) -> subprocess.Popen:
+    cmd = [
+        sys.executable,
+        os.path.join(HERE, "mock_coze.py"),
+        "--port",
+        str(args.mock_port),
+    ]
+    cmd += ["--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate)]
+    cmd += ["--event-interval-ms", str(args.event_interval_ms)]
+    cmd += ["--audio-ms", str(args.audio_ms), "--tool-dir", EXAMPLES]
+    return subprocess.Popen(cmd)
+
+
+async def wait_mock_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url + "/v1/users/me")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise Exception(f"模拟服务启动超时: {url}")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_results(results: List[dict]):
+    print(f"{'flow':<26} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8} errors")
+    for r in results:
+        print(
+            f"{r['flow']:<26} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+            f"{r['peak_rss_mb']:>8.1f} {r['errors']}/{r['requests']}"
+        )
+
+
+# 对比两次运行的结果, 输出变化的百分比
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('revision') or old_path} -> {new.get('revision') or new_path}")
+    old_results = {r["flow"]: r for r in old["results"]}
+
+    def change(a, b):
+        return f"{(b - a) / a * 100:+.1f}%" if a else "-"
+
+    print(f"{'flow':<26} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>9}")
+    for r in new["results"]:
+        o = old_results.get(r["flow"])
+        if o is None:
+            continue
+        print(
+            f"{r['flow']:<26} {change(o['rps'], r['rps']):>9} {change(o['p50_ms'], r['p50_ms']):>9} "
+            f"{change(o['p99_ms'], r['p99_ms']):>9} {change(o['peak_rss_mb'], r['peak_rss_mb']):>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各个示例的端到端性能测试")
+    parser.add_argument(
+        "--flows",
+        default="all",
+        help="逗号分隔, 可选: " + ",".join(CLIENT_FLOWS + CONNECTOR_FLOWS),
+    )
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument(
+        "--connector-target", default="async", choices=["flask", "async"]
+    )
+    parser.add_argument("--latency-ms", type=int, default=20, help="模拟扣子接口耗时")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--event-interval-ms", type=int, default=0)
+    parser.add_argument("--audio-ms", type=int, default=3000, help="每次回复的语音时长")
+    parser.add_argument("--mock-port", type=int, default=8090)
+    parser.add_argument("--port", type=int, default=8091, help="渠道服务的端口")
+    parser.add_argument("--output", help="保存结果的 json 文件")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--worker", choices=CLIENT_FLOWS, help=argparse.SUPPRESS)
+    parser.add_argument("--api-base", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.worker:
+        run_worker(args.worker, args.api_base, args.requests, args.concurrency)
+        return
+    asyncio.run(run_benchmark(args))
+
+
+# 启动模拟服务, 依次运行各个流程
+async def run_benchmark(args):
+    flows = (
+        CLIENT_FLOWS + CONNECTOR_FLOWS if args.flows == "all" else args.flows.split(",")
+    )
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    mock = start_mock(args)
+    results = []
+    try:
+        await wait_mock_ready(mock_url)
+        for flow in flows:
+            if flow in CONNECTOR_FLOWS:
+                result = await run_connector_flow(
+                    flow,
+                    args.connector_target,
+                    mock_url,
+                    args.port,
+                    args.requests,
+                    args.concurrency,
+                )
+            else:
+                result = await asyncio.to_thread(
+                    run_client_flow, flow, mock_url, args.requests, args.concurrency
+                )
+            results.append(result)
+            print(json.dumps(result))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print()
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "id": secrets.token_hex(4),
+                    "created_at": int(time.time()),
+                    "args": {
+                        k: v
+                        for k, v in vars(args).items()
+                        if k not in ("worker", "api_base", "compare")
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+# 主入口
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# 本地模拟的扣子 API, 实现了各个示例用到的接口, 用于性能测试和回归测试, 不依赖真实的扣子账号
+#
+# - /v3/chat 和 /v3/chat/submit_tool_outputs: SSE 流式对话, 返回文字和语音; bot_id 以 plugin_ 开头时先返回端插件调用
+# - /v1/chat: websocket 语音对话
+# - /v1/files/upload、/v1/bot/get_online_info、/v1/users/me、/v1/connectors/<id>/user_configs
+# - /api/permission/oauth2/token: jwt 和 pkce 换取 access_token
+#
+#     python mock_coze.py --port 8090 --latency-ms 50 --event-interval-ms 5 --audio-ms 3000
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import secrets
+import time
+
+import uvicorn
+from quart import Quart, jsonify, request, websocket
+
+app = Quart(__name__)
+app.config["MAX_CONTENT_LENGTH"] = 512 * 1024 * 1024  # 和扣子文件上传的大小限制一致
+app.config["LATENCY_MS"] = 0  # 每个接口返回前的模拟耗时
+app.config["ERROR_RATE"] = 0.0  # 返回错误的概率
+app.config["EVENT_INTERVAL_MS"] = 0  # 流式接口中相邻两个事件的间隔
+app.config["TEXT_CHUNKS"] = 20  # 每次回复的文字分几个 delta 事件返回
+app.config["TEXT_CHUNK_CHARS"] = 8  # 每个文字 delta 的字数
+app.config["AUDIO_MS"] = 3000  # 每次回复的语音时长, 0 表示不返回语音
+app.config["AUDIO_CHUNK_MS"] = 100  # 每个语音 delta 的时长
+app.config["TAG_AUDIO"] = (
+    False  # 语音数据用 bot_id 重复填充, 用于检查并发对话的语音是否串到一起
+)
+app.config["TOOL_ROUNDS"] = 1  # plugin_ 开头的 bot 每次对话调用几轮端插件
+app.config["TOOL_CALLS"] = 2  # 每轮调用几个端插件
+app.config["TOOL_DIR"] = "."  # 端插件 list_files 的目录
+
+PLUGIN_BOT_PREFIX = "plugin_"
+PCM_BYTES_PER_MS = 48  # 24kHz, 16bit, 单声道
+
+# 等待提交端插件结果的对话: chat_id -> 剩余的端插件调用轮数
+pending_tool_rounds = {}
+
+
+# 一个语音 delta 的 pcm 数据, 默认是静音; tag 不为空时用 tag 重复填充
+def audio_chunk_bytes(size: int, tag: str = "") -> bytes:
+    if not tag:
+        return bytes(size)
+    data = tag.encode("utf-8")
+    return (data * (size // len(data) + 1))[:size]
+
+
+def should_fail() -> bool:
+    return random.random() < app.config["ERROR_RATE"]
+
+
+# 模拟网络和服务端耗时, 并按概率返回错误
+@app.before_request
+async def simulate_latency_and_errors():
+    if app.config["LATENCY_MS"]:
+        await asyncio.sleep(app.config["LATENCY_MS"] / 1000)
+    if should_fail():
+        return jsonify({"code": 5000, "msg": "mock error"}), 500
+
+
+# 和扣子 API 一样, 每个响应都带上 logid
+@app.after_request
+async def add_logid(response):
+    response.headers.setdefault("x-tt-logid", f"mock_{secrets.token_hex(8)}")
+    return response
+
+
+# jwt 和 pkce 换取 access_token
+@app.route("/api/permission/oauth2/token", methods=["POST"])
+async def oauth_token():
+    data = await request.get_json(silent=True) or {}
+    ttl = int(data.get("duration_seconds") or 900)
+    return jsonify(
+        {
+            "access_token": secrets.token_urlsafe(32),
+            "expires_in": int(time.time()) + ttl,
+            "token_type": "Bearer",
+        }
+    )
+
+
+# bots.retrieve
+@app.route("/v1/bot/get_online_info")
+async def bot_online_info():
+    bot_id = request.args.get("bot_id", "")
+    return jsonify(
+        {
+            "code": 0,
+            "msg": "",
+            "data": {
+                "bot_id": bot_id,
+                "name": f"bot {bot_id}",
+                "description": f"mock bot {bot_id}",
+                "icon_url": "https://lf-coze-web-cdn.coze.cn/obj/coze-web-cn/obric/coze/favicon.1970.png",
+            },
+        }
+    )
+
+
+@app.route("/v1/users/me")
+async def users_me():
+    return jsonify(
+        {
+            "code": 0,
+            "msg": "",
+            "data": {
+                "user_id": "mock_user_id",
+                "user_name": "mock_user",
+                "nick_name": "mock user",
+                "avatar_url": "",
+            },
+        }
+    )
+
+
+@app.route("/v1/connectors/<connector_id>/user_configs", methods=["POST"])
+async def user_configs(connector_id):
+    return jsonify({"code": 0, "msg": ""})
+
+
+# files.upload
+@app.route("/v1/files/upload", methods=["POST"])
+async def files_upload():
+    files = await request.files
+    file = files.get("file")
+    if file is None:
+        return jsonify({"code": 4000, "msg": "file is required"}), 400
+    size = len(file.read())
+    return jsonify(
+        {
+            "code": 0,
+            "msg": "",
+            "data": {
+                "id": f"file_{secrets.token_hex(8)}",
+                "bytes": size,
+                "file_name": file.filename,
+                "created_at": int(time.time()),
+            },
+        }
+    )
+
+
+def new_chat(bot_id: str, conversation_id: str, chat_id: str, status: str, **kwargs):
+    return {
+        "id": chat_id,
+        "conversation_id": conversation_id,
+        "bot_id": bot_id,
+        "status": status,
+        "created_at": int(time.time()),
+        **kwargs,
+    }
+
+
+def new_message(chat: dict, content: str, content_type: str = "text") -> dict:
+    return {
+        "id": f"msg_{chat['id']}",
+        "conversation_id": chat["conversation_id"],
+        "bot_id": chat["bot_id"],
+        "chat_id": chat["id"],
+        "role": "assistant",
+        "type": "answer",
+        "content": content,
+        "content_type": content_type,
+    }
+
+
+# 一次回复的事件: (事件类型, 数据), SSE 和 websocket 共用
+def reply_events(chat: dict, tool_round: bool):
+    if tool_round:
+        tool_calls = [
+            {
+                "id": f"call_{secrets.token_hex(4)}",
+                "type": "function",
+                "function": {
+                    "name": "list_files",
+                    "arguments": json.dumps({"dir": app.config["TOOL_DIR"]}),
+                },
+            }
+            for _ in range(app.config["TOOL_CALLS"])
+        ]
+        required_action = {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {"tool_calls": tool_calls},
+        }
+        yield (
+            "conversation.chat.requires_action",
+            {**chat, "status": "requires_action", "required_action": required_action},
+        )
+        return
+
+    yield "conversation.chat.in_progress", {**chat, "status": "in_progress"}
+    text = "模拟的回复" * (
+        app.config["TEXT_CHUNKS"] * app.config["TEXT_CHUNK_CHARS"] // 5 + 1
+    )
+    size = app.config["TEXT_CHUNK_CHARS"]
+    for i in range(app.config["TEXT_CHUNKS"]):
+        yield (
+            "conversation.message.delta",
+            new_message(chat, text[i * size : (i + 1) * size]),
+        )
+    audio_chunk = PCM_BYTES_PER_MS * app.config["AUDIO_CHUNK_MS"]
+    tag = chat["bot_id"] if app.config["TAG_AUDIO"] else ""
+    audio = base64.b64encode(audio_chunk_bytes(audio_chunk, tag)).decode("utf-8")
+    for _ in range(app.config["AUDIO_MS"] // app.config["AUDIO_CHUNK_MS"]):
+        yield "conversation.audio.delta", new_message(chat, audio, "audio")
+    yield (
+        "conversation.message.completed",
+        new_message(chat, text[: size * app.config["TEXT_CHUNKS"]]),
+    )
+    output_count = app.config["TEXT_CHUNKS"] * size
+    usage = {
+        "token_count": output_count + 100,
+        "output_count": output_count,
+        "input_count": 100,
+    }
+    yield "conversation.chat.completed", {**chat, "status": "completed", "usage": usage}
+
+
+async def sse_stream(chat: dict):
+    interval = app.config["EVENT_INTERVAL_MS"] / 1000
+    yield f"event:conversation.chat.created\ndata:{json.dumps(chat)}\n\n"
+    rounds = pending_tool_rounds.get(chat["id"], 0)
+    for event, data in reply_events(chat, rounds > 0):
+        if interval:
+            await asyncio.sleep(interval)
+        yield f"event:{event}\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+    if rounds > 0:
+        pending_tool_rounds[chat["id"]] = rounds - 1
+    else:
+        pending_tool_rounds.pop(chat["id"], None)
+    yield 'event:done\ndata:"[DONE]"\n\n'
+
+
+def sse_response(chat: dict):
+    headers = {"Content-Type": "text/event-stream", "X-Tt-Logid": f"mock_{chat['id']}"}
+    return sse_stream(chat), 200, headers
+
+
+# /v3/chat, 只支持流式对话
+@app.route("/v3/chat", methods=["POST"])
+async def chat_create():
+    data = await request.get_json()
+    conversation_id = (
+        request.args.get("conversation_id") or f"conv_{secrets.token_hex(8)}"
+    )
+    chat = new_chat(
+        data["bot_id"], conversation_id, f"chat_{secrets.token_hex(8)}", "created"
+    )
+    if data["bot_id"].startswith(PLUGIN_BOT_PREFIX):
+        pending_tool_rounds[chat["id"]] = app.config["TOOL_ROUNDS"]
+    return sse_response(chat)
+
+
+@app.route("/v3/chat/submit_tool_outputs", methods=["POST"])
+async def chat_submit_tool_outputs():
+    chat_id = request.args.get("chat_id", "")
+    if chat_id not in pending_tool_rounds:
+        return jsonify(
+            {"code": 4000, "msg": f"chat {chat_id} is not waiting for tool outputs"}
+        ), 400
+    chat = new_chat("", request.args.get("conversation_id", ""), chat_id, "in_progress")
+    return sse_response(chat)
+
+
+@app.route("/v3/chat/cancel", methods=["POST"])
+async def chat_cancel():
+    data = await request.get_json()
+    pending_tool_rounds.pop(data.get("chat_id"), None)
+    chat = new_chat(
+        "", data.get("conversation_id", ""), data.get("chat_id", ""), "canceled"
+    )
+    return jsonify({"code": 0, "msg": "", "data": chat})
+
+
+# websocket 语音对话: 收到 input_audio_buffer.complete 后返回一次回复
+@app.websocket("/v1/chat")
+async def websocket_chat():
+    bot_id = websocket.args.get("bot_id", "")
+    conversation_id = f"conv_{secrets.token_hex(8)}"
+    interval = app.config["EVENT_INTERVAL_MS"] / 1000
+
+    async def send(event_type: str, data=None):
+        detail = {"logid": f"mock_{conversation_id}"}
+        message = {
+            "id": secrets.token_hex(8),
+            "event_type": event_type,
+            "data": data or {},
+            "detail": detail,
+        }
+        await websocket.send(json.dumps(message, ensure_ascii=False))
+
+    await send("chat.created")
+    audio_bytes = 0
+    while True:
+        message = json.loads(await websocket.receive())
+        event_type = message.get("event_type")
+        data = message.get("data") or {}
+        if event_type == "chat.update":
+            conversation_id = (data.get("chat_config") or {}).get(
+                "conversation_id"
+            ) or conversation_id
+            await send("chat.updated", data)
+        elif event_type == "input_audio_buffer.append":
+            audio_bytes += len(data.get("delta") or "") * 3 // 4
+        elif event_type == "input_audio_buffer.complete":
+            await send("input_audio_buffer.completed")
+            if app.config["LATENCY_MS"]:
+                await asyncio.sleep(app.config["LATENCY_MS"] / 1000)
+            if should_fail():
+                await send("error", {"code": 5000, "msg": "mock error"})
+                audio_bytes = 0
+                continue
+            chat = new_chat(
+                bot_id, conversation_id, f"chat_{secrets.token_hex(8)}", "created"
+            )
+            await send("conversation.chat.created", chat)
+            for event, event_data in reply_events(chat, False):
+                if interval:
+                    await asyncio.sleep(interval)
+                await send(event, event_data)
+            audio_bytes = 0
+        elif event_type == "conversation.chat.cancel":
+            await send("conversation.chat.canceled")
+
+
+# 主入口
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的扣子 API")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--event-interval-ms", type=int, default=0)
+    parser.add_argument("--text-chunks", type=int, default=20)
+    parser.add_argument("--text-chunk-chars", type=int, default=8)
+    parser.add_argument("--audio-ms", type=int, default=3000)
+    parser.add_argument("--audio-chunk-ms", type=int, default=100)
+    parser.add_argument("--tag-audio", action="store_true")
+    parser.add_argument("--tool-rounds", type=int, default=1)
+    parser.add_argument("--tool-calls", type=int, default=2)
+    parser.add_argument("--tool-dir", default=".")
+    args = parser.parse_args()
+
+    app.config["LATENCY_MS"] = args.latency_ms
+    app.config["ERROR_RATE"] = args.error_rate
+    app.config["EVENT_INTERVAL_MS"] = args.event_interval_ms
+    app.config["TEXT_CHUNKS"] = args.text_chunks
+    app.config["TEXT_CHUNK_CHARS"] = args.text_chunk_chars
+    app.config["AUDIO_MS"] = args.audio_ms
+    app.config["AUDIO_CHUNK_MS"] = args.audio_chunk_ms
+    app.config["TAG_AUDIO"] = args.tag_audio
+    app.config["TOOL_ROUNDS"] = args.tool_rounds
+    app.config["TOOL_CALLS"] = args.tool_calls
+    app.config["TOOL_DIR"] = args.tool_dir
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,156 @@
+# 检查并发 websocket 对话之间互不影响, 并且内存不随对话次数增长
+#
+# 启动模拟服务 (--tag-audio, 每个对话的语音用 bot_id 重复填充), 每轮同时进行 --sessions 个
+# websocket_chat.py 的对话, 每个对话使用不同的 bot_id, 回复的语音写入各自的 wav 文件:
+#
+# - 隔离: 每个 wav 文件的长度和内容必须和这个对话的 bot_id 填充的语音完全一致
+# - 内存: 每轮结束后记录进程当前的 RSS, 第一轮之后的增长不能超过 --max-rss-growth-mb
+#
+#     python session_isolation.py --sessions 100 --rounds 5 --audio-ms 10000
+#
+# 检查失败时退出码为 1
+
+import argparse
+import asyncio
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from typing import List
+
+import benchmark
+from mock_coze import PCM_BYTES_PER_MS, audio_chunk_bytes
+
+sys.path.insert(0, benchmark.AUDIO_CHAT_DIR)
+from audio_uplink import AudioUplink, WavAudioSource  # noqa: E402
+from cozepy import AsyncCoze, AsyncWebsocketsChatClient, TokenAuth  # noqa: E402
+from websocket_chat import WebsocketsChatEventHandler  # noqa: E402
+
+
+# 进程当前的 RSS, 和 benchmark.py 统计的峰值不同, 用来观察内存是否随对话次数增长
+def current_rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# 对话 bot_id 对应的回复语音, 和模拟服务 reply_events 中的生成方式一致
+def expected_audio(bot_id: str, audio_ms: int, audio_chunk_ms: int) -> bytes:
+    chunk = audio_chunk_bytes(PCM_BYTES_PER_MS * audio_chunk_ms, bot_id)
+    return chunk * (audio_ms // audio_chunk_ms)
+
+
+def check_output(path: str, expected: bytes) -> str:
+    try:
+        with wave.open(path, "rb") as f:
+            data = f.readframes(f.getnframes())
+    except (OSError, EOFError, wave.Error) as e:
+        return f"读取失败: {e}"
+    if len(data) != len(expected):
+        return f"长度 {len(data)}, 应为 {len(expected)}"
+    if data != expected:
+        return "内容和 bot_id 不一致, 混入了其他对话的语音"
+    return ""
+
+
+# 同时进行 sessions 个对话, 返回每个对话的错误信息, 空字符串表示通过
+async def run_round(
+    coze: AsyncCoze, ws_base_url: str, workdir: str, round_index: int, args
+) -> List[str]:
+    audio_path = os.path.join(benchmark.AUDIO_CHAT_DIR, "input_audio.wav")
+
+    async def one(i: int) -> str:
+        bot_id = f"isolation_{round_index}_{i:04d}"
+        output_path = os.path.join(workdir, f"{bot_id}.wav")
+        try:
+            handler = WebsocketsChatEventHandler(output_path, verbose=False)
+            client = AsyncWebsocketsChatClient(
+                base_url=ws_base_url,
+                requester=coze._requester,
+                bot_id=bot_id,
+                on_event=handler,
+            )
+            # 退出时连接关闭, on_closed 会关闭 wav 文件
+            async with client() as client:
+                with WavAudioSource(audio_path) as source:
+                    await AudioUplink(client, realtime=False).send(
+                        source.chunks(), source.bytes_per_second
+                    )
+                await client.input_audio_buffer_complete()
+                await asyncio.wait_for(client.wait(), 60)
+        except Exception as e:
+            return f"{bot_id}: 对话失败 {type(e).__name__}: {e}"
+        error = check_output(
+            output_path, expected_audio(bot_id, args.audio_ms, args.audio_chunk_ms)
+        )
+        os.remove(output_path)
+        return f"{bot_id}: {error}" if error else ""
+
+    return await asyncio.gather(*[one(i) for i in range(args.sessions)])
+
+
+async def run_check(args) -> bool:
+    cmd = [sys.executable, os.path.join(benchmark.HERE, "mock_coze.py")]
+    cmd += ["--port", str(args.mock_port), "--tag-audio"]
+    cmd += ["--audio-ms", str(args.audio_ms)]
+    cmd += ["--audio-chunk-ms", str(args.audio_chunk_ms)]
+    mock = subprocess.Popen(cmd)
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    workdir = tempfile.mkdtemp(prefix="session_isolation_")
+    ok = True
+    try:
+        await benchmark.wait_mock_ready(mock_url)
+        coze = AsyncCoze(auth=TokenAuth("mock_token"), base_url=mock_url)
+        ws_base_url = mock_url.replace("http://", "ws://")
+        rss = []
+        for round_index in range(args.rounds):
+            start = time.perf_counter()
+            errors = [
+                e
+                for e in await run_round(coze, ws_base_url, workdir, round_index, args)
+                if e
+            ]
+            gc.collect()
+            rss.append(current_rss_mb())
+            print(
+                f"第 {round_index + 1} 轮: {args.sessions} 个对话, 失败 {len(errors)} 个, "
+                f"耗时 {time.perf_counter() - start:.1f}s, RSS {rss[-1]:.1f}MB"
+            )
+            for error in errors[:10]:
+                print(f"  {error}")
+            ok = ok and not errors
+        # 第一轮包含导入模块、建立连接池等一次性的内存
+        growth = max(rss[1:], default=rss[0]) - rss[0]
+        print(f"第一轮之后 RSS 增长 {growth:.1f}MB, 上限 {args.max_rss_growth_mb}MB")
+        ok = ok and growth <= args.max_rss_growth_mb
+    finally:
+        mock.terminate()
+        mock.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return ok
+
+
+# 主入口
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查并发 websocket 对话的隔离和内存")
+    parser.add_argument(
+        "--sessions", type=int, default=100, help="每轮同时进行的对话数"
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--audio-ms", type=int, default=10000, help="每次回复的语音时长"
+    )
+    parser.add_argument("--audio-chunk-ms", type=int, default=100)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=20)
+    parser.add_argument("--mock-port", type=int, default=8092)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run_check(args))
+    print("通过" if ok else "失败")
+    sys.exit(0 if ok else 1)